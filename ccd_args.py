@@ -36,6 +36,61 @@ class ccd_args():
             "-sm",
             help = f"Specify the state machine to start with.\nExample: python {self.app_name} -sm assembly_process.json "
             )
+        parser.add_argument(
+            "-profile-startup",
+            action = "store_true",
+            help = f"Report how long each phase of starting up takes: imports, building the window,\nloading the model and painting it.\nExample: python {self.app_name} -profile-startup"
+            )
+        parser.add_argument(
+            "-timings",
+            action = "store_true",
+            help = f"Time the main editor operations, e.g. painting and routing, for the View -> Timings window.\nExample: python {self.app_name} -timings"
+            )
+        parser.add_argument(
+            "-timings-json",
+            help = f"Time the main editor operations, and write the timings to this JSON file on exit.\nExample: python {self.app_name} -timings-json timings.json"
+            )
+        parser.add_argument(
+            "-route-workers",
+            type = int,
+            help = f"Set the number of processes which route the transitions of a model loaded without paths.\nThe default is one per CPU, and 1 routes them all in this process.\nExample: python {self.app_name} -route-workers 4"
+            )
+
+        # Headless commands, run over many models without a window, e.g. in CI.
+        # The names match ccd_batch.BATCH_COMMANDS, which isn't imported here
+        # so that starting the editor doesn't pay for it.
+        commands = parser.add_subparsers( dest = "command", metavar = "command",
+            help = "Run a command over model files without opening the editor, and report on each as JSON." )
+        for ( command, command_help ) in (
+          ( "validate",      "Check the models can be opened." ),
+          ( "route-missing", "Give a path to each transition without one, keeping the others." ),
+          ( "reroute",       "Route every transition afresh." ),
+          ( "normalize",     "Rewrite the models just as the editor saves them." ),
+          ( "export",        "Draw the models, with every composite expanded, as SVG or PNG images." ),
+          ( "compile",       "Compile the models to dispatch tables for the state machine runtime." ) ):
+            command_parser = commands.add_parser( command, help = command_help, formatter_class = argparse.RawTextHelpFormatter )
+            command_parser.add_argument( "files", nargs = "+",
+                help = f"The model files, or glob patterns for them, quoted so the shell leaves them be.\nExample: python {self.app_name} {command} \"models/**/*.json\"" )
+            command_parser.add_argument( "-jobs", type = int,
+                help = "Set the number of files processed at once, by default one per CPU." )
+            command_parser.add_argument( "-report",
+                help = "Write the report to this file rather than to the output." )
+            if command not in ( "validate", "export", "compile" ):
+                command_parser.add_argument( "-check", action = "store_true",
+                    help = "Leave the files as they are, and fail if any would be changed." )
+            if command == "export":
+                command_parser.add_argument( "-format", choices = [ "svg", "png" ], default = "svg",
+                    help = "Set the image format, by default svg. Each image is named after its model." )
+                command_parser.add_argument( "-zoom", type = float, default = 1.0,
+                    help = "Scale the images, as zooming in the editor does, by default 1." )
+                command_parser.add_argument( "-tile", type = int,
+                    help = "Set the size in pixels of the tiles drawn at a time, by default 4096. A PNG bigger\nthan one tile is written as one file per tile, e.g. model_r0_c1.png." )
+            if command in ( "export", "compile" ):
+                command_parser.add_argument( "-output-dir",
+                    help = "Write the output to this folder rather than next to the models." )
+            if command == "compile":
+                command_parser.add_argument( "-benchmark", type = int,
+                    help = "Dispatch this many random events to each model, as it is and compiled, and report\nthe events per second of both." )
 
         ## Allow address with int or hex format.
         #parser.add_argument(
@@ -48,6 +103,33 @@ class ccd_args():
         self.args = parser.parse_args()
         #print( f"self.args = {self.args}" )
 
+    # Returns the headless command asked for, or None to run the editor.
+    def get_batch_command( self ) -> str:
+        return self.args.command
+
+    def get_batch_files( self ) -> list:
+        return self.args.files
+
+    def get_batch_jobs( self ) -> int:
+        if self.args.jobs is not None:
+            return max( 1, self.args.jobs )
+        return os.cpu_count() or 1
+
+    def get_batch_report( self ) -> str:
+        return self.args.report
+
+    def want_batch_check( self ) -> bool:
+        return getattr( self.args, "check", False )
+
+    # Returns the options of the export and compile commands, or None for the others.
+    def get_batch_options( self ) -> dict:
+        if self.args.command == "export":
+            tile_pix = max( 1, self.args.tile ) if self.args.tile is not None else None
+            return { "format": self.args.format, "zoom": self.args.zoom, "tile_pix": tile_pix, "output_dir": self.args.output_dir }
+        if self.args.command == "compile":
+            return { "output_dir": self.args.output_dir, "benchmark": self.args.benchmark }
+        return None
+
     def want_fullscreen( self ) -> bool:
         return self.args.fullscreen
 
@@ -60,9 +142,24 @@ class ccd_args():
             result = self.args.geometry[ 0 ]
         return result
 
+    def want_profile_startup( self ) -> bool:
+        return self.args.profile_startup
+
+    def want_timings( self ) -> bool:
+        return self.args.timings or self.args.timings_json is not None
+
+    def get_timings_file( self ) -> str:
+        return self.args.timings_json
+
     def have_start_file( self ) -> bool:
         return self.args.sm
         
+    # Returns the number of routing processes asked for, or one per CPU.
+    def get_route_workers( self ) -> int:
+        if self.args.route_workers is not None:
+            return max( 1, self.args.route_workers )
+        return os.cpu_count() or 1
+
     def get_start_file( self ) -> str:
         result = ""
         if self.args.sm:
@@ -0,0 +1,314 @@
+import concurrent.futures
+import contextlib
+import copy
+import glob
+import io
+import json
+import os
+import sys
+import time
+import ccd_ui_hsm
+import save_service
+import sm_canvas
+import sm_compiler
+import sm_export
+
+
+# The headless commands, run over many model files at once, e.g. in CI.
+# Nothing here, or in what it imports, needs Tk or a display.
+BATCH_VALIDATE     = "validate"
+BATCH_ROUTE        = "route-missing"
+BATCH_REROUTE      = "reroute"
+BATCH_NORMALIZE    = "normalize"
+BATCH_EXPORT       = "export"
+BATCH_COMPILE      = "compile"
+BATCH_COMMANDS = ( BATCH_VALIDATE, BATCH_ROUTE, BATCH_REROUTE, BATCH_NORMALIZE, BATCH_EXPORT, BATCH_COMPILE )
+
+# The image formats the export command writes.
+EXPORT_SVG = "svg"
+EXPORT_PNG = "png"
+EXPORT_FORMATS = ( EXPORT_SVG, EXPORT_PNG )
+
+REPORT_VERSION = 1
+
+
+# Returns the files named, with any glob patterns expanded, in the order given.
+def expand_files( patterns: list ) -> list:
+    filenames = []
+    for pattern in patterns:
+        if glob.has_magic( pattern ):
+            matches = sorted( glob.glob( pattern, recursive = True ) )
+        else:
+            matches = [ pattern ]
+        for filename in matches:
+            if filename not in filenames:
+                filenames.append( filename )
+    return filenames
+
+
+# Checks the structure of a model, returning ( errors, warnings, counts ),
+# where counts has the numbers of states, transitions and transitions without
+# a path. A model with errors can't be opened in the editor.
+def validate_model( model: object ) -> tuple:
+    errors = []
+    warnings = []
+    counts = { "states": 0, "transitions": 0, "missing_paths": 0 }
+    if not isinstance( model, dict ):
+        return ( [ "The model is not a JSON object." ], warnings, counts )
+    if not isinstance( model.get( ccd_ui_hsm.HSM_RSVD_STATES, {} ), dict ):
+        return ( [ f"\"{ccd_ui_hsm.HSM_RSVD_STATES}\" is not an object." ], warnings, counts )
+
+    # First every state, as transitions may go to states anywhere in the model.
+    names = set()
+    def check_states( states: dict, where: str ) -> None:
+        for state_name, state in states.items():
+            if not isinstance( state, dict ):
+                errors.append( f"State \"{state_name}\"{where} is not an object." )
+                continue
+            counts[ "states" ] += 1
+            if state_name in names:
+                warnings.append( f"The state name \"{state_name}\" is used more than once, only the first is shown." )
+            names.add( state_name )
+            layout = state.get( ccd_ui_hsm.HSM_RSVD_LYOUT )
+            if layout is None:
+                warnings.append( f"State \"{state_name}\" has no layout." )
+            elif not isinstance( layout, dict ) or not all( is_number( layout.get( key ) ) for key in ( "x", "y" ) ):
+                errors.append( f"State \"{state_name}\" has a layout without numbers for x and y." )
+            elif any( key in layout and not ( is_number( layout[ key ] ) and layout[ key ] > 0 ) for key in ( "w", "h" ) ):
+                errors.append( f"State \"{state_name}\" has a layout with a size which is not a positive number." )
+            substates = state.get( ccd_ui_hsm.HSM_RSVD_STATES )
+            if substates is not None:
+                if not isinstance( substates, dict ):
+                    errors.append( f"The substates of \"{state_name}\" are not an object." )
+                else:
+                    check_states( substates, f" in \"{state_name}\"" )
+    check_states( model.get( ccd_ui_hsm.HSM_RSVD_STATES, {} ), "" )
+
+    for ( state_name, state ) in ccd_ui_hsm.iter_substates( model ):
+        if not isinstance( state, dict ):
+            continue
+        transitions = state.get( ccd_ui_hsm.HSM_RSVD_TRAN, {} )
+        if not isinstance( transitions, dict ):
+            errors.append( f"The transitions of \"{state_name}\" are not an object." )
+            continue
+        for transition_name, transition in transitions.items():
+            counts[ "transitions" ] += 1
+            if not isinstance( transition, dict ):
+                errors.append( f"Transition \"{transition_name}\" of \"{state_name}\" is not an object." )
+                continue
+            dst_name = transition.get( ccd_ui_hsm.HSM_RSVD_DEST )
+            if not dst_name:
+                errors.append( f"Transition \"{transition_name}\" of \"{state_name}\" has no destination." )
+            elif dst_name not in names:
+                errors.append( f"Transition \"{transition_name}\" of \"{state_name}\" goes to \"{dst_name}\", which is not a state." )
+            path = transition.get( ccd_ui_hsm.HSM_RSVD_PATH )
+            if path is None:
+                counts[ "missing_paths" ] += 1
+            elif not isinstance( path, list ) or len( path ) < 2 or not all( is_point( point ) for point in path ):
+                errors.append( f"Transition \"{transition_name}\" of \"{state_name}\" has a path which is not a list of two or more x, y points." )
+    if counts[ "missing_paths" ]:
+        warnings.append( f"{counts[ 'missing_paths' ]} transitions have no path." )
+    return ( errors, warnings, counts )
+
+def is_number( value: object ) -> bool:
+    return isinstance( value, ( int, float ) ) and not isinstance( value, bool )
+
+def is_point( point: object ) -> bool:
+    return isinstance( point, dict ) and is_number( point.get( "x" ) ) and is_number( point.get( "y" ) )
+
+
+# Returns a diagram of the model, with every composite expanded, so that all
+# the transitions, at any depth, have been routed just as the editor would.
+def create_expanded_diagram( model: dict ) -> ccd_ui_hsm.sm_diagram:
+    diagram = ccd_ui_hsm.sm_diagram( model, sm_canvas.sm_recording_canvas(), 0, 0 )
+    while True:
+        collapsed = [ state_name for state_name, expanded in diagram.expanded.items() if not expanded ]
+        if not collapsed:
+            return diagram
+        for state_name in collapsed:
+            diagram.expand_state( state_name )
+
+# Yields ( state name, transition name, transition ) for every transition.
+def iter_transitions( model: dict ):
+    for ( state_name, state ) in ccd_ui_hsm.iter_substates( model ):
+        for transition_name, transition in state.get( ccd_ui_hsm.HSM_RSVD_TRAN, {} ).items():
+            yield ( state_name, transition_name, transition )
+
+# Returns the model with a path for every transition, those it already had
+# kept as they are. A model without any layout is laid out, as on opening it.
+def route_missing( model: dict ) -> dict:
+    if ccd_ui_hsm.get_auto_layout().is_unlaid( model ):
+        return create_expanded_diagram( model ).export_model()
+    missing = set( ( state_name, transition_name ) for ( state_name, transition_name, transition ) in iter_transitions( model )
+        if ccd_ui_hsm.HSM_RSVD_PATH not in transition )
+    if not missing:
+        return model
+    routed = create_expanded_diagram( copy.deepcopy( model ) ).export_model()
+    paths = { ( state_name, transition_name ): transition.get( ccd_ui_hsm.HSM_RSVD_PATH )
+        for ( state_name, transition_name, transition ) in iter_transitions( routed ) }
+    for ( state_name, transition_name, transition ) in iter_transitions( model ):
+        if ( state_name, transition_name ) in missing and paths.get( ( state_name, transition_name ) ) is not None:
+            transition[ ccd_ui_hsm.HSM_RSVD_PATH ] = paths[ ( state_name, transition_name ) ]
+    return model
+
+# Returns the model with every transition routed afresh.
+def reroute_all( model: dict ) -> dict:
+    for ( state_name, transition_name, transition ) in iter_transitions( model ):
+        transition.pop( ccd_ui_hsm.HSM_RSVD_PATH, None )
+    return create_expanded_diagram( model ).export_model()
+
+# Returns the model with its layouts and paths on whole pixels, as the editor
+# keeps them. Written out with serialize_json(), it is exactly as the editor
+# would save it.
+def normalize( model: dict ) -> dict:
+    for ( state_name, state ) in ccd_ui_hsm.iter_substates( model ):
+        layout = state.get( ccd_ui_hsm.HSM_RSVD_LYOUT )
+        if layout is not None:
+            for key in ( "x", "y", "w", "h" ):
+                if key in layout:
+                    layout[ key ] = int( layout[ key ] )
+    for ( state_name, transition_name, transition ) in iter_transitions( model ):
+        for point in transition.get( ccd_ui_hsm.HSM_RSVD_PATH, [] ):
+            point[ "x" ] = int( point[ "x" ] )
+            point[ "y" ] = int( point[ "y" ] )
+    return model
+
+# Returns the name of a file made from the model file, with its extension
+# replaced by suffix, next to it or in output_dir if given. That folder is
+# created if need be.
+def get_output_filename( filename: str, options: dict, suffix: str ) -> str:
+    output_dir = options.get( "output_dir" )
+    if output_dir:
+        os.makedirs( output_dir, exist_ok = True )
+    else:
+        output_dir = os.path.dirname( filename )
+    return os.path.join( output_dir, os.path.splitext( os.path.basename( filename ) )[ 0 ] + suffix )
+
+# Draws the model, with every composite expanded, to an image next to the
+# model file, or in output_dir if given, named after the model. Returns the
+# files written, more than one for a PNG drawn in tiles.
+def export_image( model: dict, filename: str, options: dict ) -> list:
+    export_format = options.get( "format" ) or EXPORT_SVG
+    assert( export_format in EXPORT_FORMATS )
+    zoom = options.get( "zoom" ) or 1.0
+    tile_pix = options.get( "tile_pix" ) or sm_export.DEFAULT_TILE_PIX
+    image_filename = get_output_filename( filename, options, "." + export_format )
+    diagram = create_expanded_diagram( model )
+    if export_format == EXPORT_PNG:
+        return sm_export.export_png( diagram, image_filename, zoom, tile_pix )
+    sm_export.export_svg( diagram, image_filename, zoom, tile_pix )
+    return [ image_filename ]
+
+# Compiles the model to its dispatch table, see sm_compiler, written next to
+# the model file, or in output_dir if given, and adds the sizes of the table
+# to the result. With the "benchmark" option, that many random events are also
+# dispatched, by the model as it is and compiled, and the rates reported.
+def compile_dispatch( model: dict, filename: str, options: dict, result: dict ) -> None:
+    compiled = sm_compiler.compile_model( model )
+    compiled_filename = get_output_filename( filename, options, sm_compiler.COMPILED_SUFFIX )
+    sm_compiler.write_compiled( compiled, compiled_filename )
+    result[ "outputs" ] = [ compiled_filename ]
+    result[ "compiled" ] = { "states": len( compiled[ "states" ] ), "events": len( compiled[ "events" ] ),
+        "steps": len( compiled[ "steps" ] ), "table": compiled[ "table" ] }
+    if options.get( "benchmark" ):
+        result[ "benchmark" ] = sm_compiler.run_benchmark( model, options[ "benchmark" ] )
+        if not result[ "benchmark" ][ "same_result" ]:
+            result[ "errors" ].append( "The compiled model behaves differently from the model." )
+
+
+# Runs a command on one file, in a worker process, returning its part of the
+# report. Unless check is set, a file the command changes is rewritten. What
+# the editor code prints along the way goes in the report, not the output.
+# The options are those of the command, e.g. the format for export.
+def process_file( command: str, filename: str, check: bool, options: dict = None ) -> dict:
+    result = { "file": filename, "ok": False, "errors": [], "warnings": [], "messages": [] }
+    start = time.perf_counter()
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout( messages ):
+            run_command( command, filename, check, options or {}, result )
+    except Exception as e:
+        result[ "errors" ].append( f"{type( e ).__name__}: {e}" )
+    result[ "messages" ] = messages.getvalue().splitlines()
+    result[ "ok" ] = not result[ "errors" ]
+    result[ "seconds" ] = round( time.perf_counter() - start, 3 )
+    return result
+
+# This function is for internal use only.
+def run_command( command: str, filename: str, check: bool, options: dict, result: dict ) -> None:
+    try:
+        with open( filename, "rb" ) as model_file:
+            contents = model_file.read()
+        model = json.loads( contents )
+    except json.JSONDecodeError as e:
+        result[ "errors" ].append( f"JSONDecodeError, {e.msg}, line = {e.lineno}, col = {e.colno}." )
+        return
+    except ( OSError, UnicodeDecodeError ) as e:
+        result[ "errors" ].append( f"The file can't be read, {e}." )
+        return
+
+    ( errors, warnings, counts ) = validate_model( model )
+    result[ "errors" ].extend( errors )
+    result[ "warnings" ].extend( warnings )
+    result.update( counts )
+    if errors or command == BATCH_VALIDATE:
+        return
+    if command == BATCH_EXPORT:
+        result[ "outputs" ] = export_image( model, filename, options )
+        return
+    if command == BATCH_COMPILE:
+        compile_dispatch( model, filename, options, result )
+        return
+
+    if command == BATCH_ROUTE:
+        model = route_missing( model )
+    elif command == BATCH_REROUTE:
+        model = reroute_all( model )
+    model = normalize( model )
+    data = save_service.serialize_json( model )
+    result[ "changed" ] = data != contents
+    if result[ "changed" ] and not check:
+        save_service.write_file_atomic( filename, data )
+
+
+# Runs a command over the files, spread over num_workers processes, and
+# writes the report as JSON to report_filename, or to stdout if not given.
+# Returns the exit code: 0 if every file is fine, and, with check, would be
+# left unchanged, otherwise 1.
+def run( command: str, patterns: list, num_workers: int, report_filename: str = None, check: bool = False, options: dict = None ) -> int:
+    assert( command in BATCH_COMMANDS )
+    filenames = expand_files( patterns )
+    start = time.perf_counter()
+    if num_workers > 1 and len( filenames ) > 1:
+        with concurrent.futures.ProcessPoolExecutor( max_workers = min( num_workers, len( filenames ) ) ) as executor:
+            results = list( executor.map( process_file, [ command ] * len( filenames ), filenames,
+                [ check ] * len( filenames ), [ options ] * len( filenames ) ) )
+    else:
+        results = [ process_file( command, filename, check, options ) for filename in filenames ]
+
+    summary = {
+        "files": len( results ),
+        "failed": sum( 1 for result in results if not result[ "ok" ] ),
+        "changed": sum( 1 for result in results if result.get( "changed" ) ),
+        "seconds": round( time.perf_counter() - start, 3 ),
+    }
+    report = { "version": REPORT_VERSION, "command": command, "check": check, "summary": summary, "files": results }
+    if options:
+        report[ "options" ] = options
+    report_json = json.dumps( report, indent = 4 )
+    if report_filename:
+        try:
+            with open( report_filename, "w" ) as report_file:
+                report_file.write( report_json + "\n" )
+        except OSError:
+            print( f"WARN: There is something wrong with the file {report_filename}, and it can't be opened for writing.", file = sys.stderr )
+            return 1
+    else:
+        print( report_json )
+
+    if not filenames:
+        print( f"WARN: No files match {' '.join( patterns )}.", file = sys.stderr )
+        return 1
+    if summary[ "failed" ] or ( check and summary[ "changed" ] ):
+        return 1
+    return 0
@@ -1,18 +1,35 @@
+# Imported first, so the startup profile covers the imports below.
+import startup_profile
 import os
+import sys
 import ccd_args
-import ccd_ui
+import timing_registry
 
 
 IMAGES_FOLDER = "images\\"
 
 
 def window_exit():
+    import ccd_ui
     if ( ccd_ui.ui is not None ):
         ccd_ui.ui.quit()
         ccd_ui.ui.destroy()
 
 def main():
     args = ccd_args.ccd_args( __file__ )
+    if args.get_batch_command():
+        # Headless, so neither the window nor Tk are needed.
+        import ccd_batch
+        sys.exit( ccd_batch.run( args.get_batch_command(), args.get_batch_files(), args.get_batch_jobs(),
+            args.get_batch_report(), args.want_batch_check(), args.get_batch_options() ) )
+
+    # Only imported for the editor, as it brings in Tk.
+    import ccd_ui
+    if args.want_profile_startup():
+        startup_profile.enable()
+    if args.want_timings():
+        timing_registry.enable()
+    startup_profile.mark( "imports" )
     
     app_path = os.path.dirname( os.path.realpath( __file__ ) )
     images_path = app_path + "\\" + IMAGES_FOLDER
@@ -22,6 +39,9 @@ def main():
     # Ready for the Tk framework to take over.
     ccd_ui.ui.run()
 
+    if args.get_timings_file():
+        timing_registry.dump_json( args.get_timings_file() )
+
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,9 @@
+import copy
+import importlib.util
 import json
 import os
 import sys
+import time
 # Note: Tkinter is usually auto-installed with python, but if you get "ImportError: No module named Tkinter":
 # python -m pip install python3-tk
 import tkinter as tk
@@ -10,10 +13,19 @@ from tkinter import *
 import workspace_settings
 #import hierarchical_state_machine
 import ccd_ui_hsm
-
-try:
-    import hierarchical_state_machine as hsm
-except ImportError:
+import edit_journal
+import model_cache
+import model_loader
+import save_service
+import sm_simulator
+import sm_tk_layout
+import sm_undo
+import startup_profile
+import timing_registry
+
+# Nothing runs a model yet, so rather than paying to import the module, just
+# check it is there.
+if importlib.util.find_spec( "hierarchical_state_machine" ) is None:
     print( f"Unable to import module \"hierarchical_state_machine\"." )
     print( f"Run:\npython -m pip install hierarchical_state_machine\n    ... then try again." )
     quit()
@@ -54,6 +66,8 @@ TOOL_ICON_STARTS = f"Tool_Start_State_64x64.png"
 TOOL_ICON_STATEM = f"Tool_State_Machine_64x64.png"
 TOOL_ICON_TRANSI = f"Tool_Transition_64x64.png"
 TOOL_ICON_STOPST = f"Tool_Stop_State_64x64.png"
+# The tool icons are blank until the window is up, see load_tool_icons().
+TOOL_ICON_SIZE = 64
 EMPTY_SM_JSON = f"{{}}"
 
 TOOL_NAME_SELECT = f"Select"
@@ -62,6 +76,29 @@ TOOL_NAME_STATEM = f"StateMachine"
 TOOL_NAME_TRANSI = f"Transition"
 TOOL_NAME_STOPST = f"StopState"
 
+# How often to check on a model being loaded in the background.
+LOAD_POLL_MS = 50
+# The number of states painted per Tk event loop pass while a model loads.
+LOAD_PAINT_BATCH = 200
+
+# The memory the undo history may use, in KiB, unless set in the workspace
+# settings as "undo_limit_kb".
+DEFAULT_UNDO_LIMIT_KB = sm_undo.DEFAULT_MAX_BYTES // 1024
+
+# The disk space, in MiB, kept for models cached for quick reopening, unless
+# set in the workspace settings as "cache_limit_mb", with 0 turning it off.
+DEFAULT_CACHE_LIMIT_MB = model_cache.DEFAULT_MAX_BYTES // ( 1024 * 1024 )
+
+# With autosave on, edits are journaled, and the model is only saved in full
+# once its journal grows beyond this many KiB, unless set in the workspace
+# settings as "journal_limit_kb".
+DEFAULT_JOURNAL_LIMIT_KB = 1024
+
+# The number of random events the simulator runs at once by default, and
+# the number of lines kept in its log.
+SIM_RANDOM_EVENTS = 100000
+SIM_LOG_LINES = 1000
+
 
 this_module = sys.modules[__name__]
 ui = None
@@ -88,8 +125,12 @@ class ccd_ui_layout( tk.Tk ):
         app_lft = 0
         app_top = 0
         app_geom_str = f"{app_wid}x{app_hgt}+{app_lft}+{app_top}"
+        # Model files, and the workspace, are written in the background, see
+        # save_file() and model_changed().
+        self.saver = save_service.save_service()
+
         # Use screen width and height as defaults in case they are needed.
-        self.wksp_settings = workspace_settings.workspace_settings( app_wid, app_hgt )
+        self.wksp_settings = workspace_settings.workspace_settings( app_wid, app_hgt, saver = self.saver )
         
         # If no request for fullscreen, see if geometry was specified.
         if ( self.args.want_fullscreen() == False ):
@@ -133,6 +174,10 @@ class ccd_ui_layout( tk.Tk ):
         self.edit_menu.add_command( label = "Paste", state = "disabled", command = lambda: self.edit_click_cb( "Paste" ) )
         self.edit_menu.add_command( label = "Undo" , state = "disabled", command = lambda: self.edit_click_cb( "Undo"  ) )
         self.edit_menu.add_command( label = "Redo" , state = "disabled", command = lambda: self.edit_click_cb( "Redo"  ) )
+        self.edit_menu.add_separator()
+        self.edit_menu.add_command( label = "Auto Layout", state = "normal", command = lambda: self.edit_click_cb( "Auto Layout" ) )
+        self.bind( "<Control-z>", lambda event: self.edit_click_cb( "Undo" ) )
+        self.bind( "<Control-y>", lambda event: self.edit_click_cb( "Redo" ) )
         
         self.button_view = tk.Menubutton( menu_frame, text = "View", indicatoron = False, padx = 10, relief = "raised" )
         self.button_view.grid( row = 0, column = 2 )
@@ -141,16 +186,36 @@ class ccd_ui_layout( tk.Tk ):
         self.view_menu.add_command( label = "All"  , state = "normal", command = lambda: self.view_click_cb( "All"   ) )
         self.view_menu.add_command( label = "State", state = "normal", command = lambda: self.view_click_cb( "State" ) )
         self.view_menu.add_command( label = "JSON" , state = "normal", command = lambda: self.view_click_cb( "JSON"  ) )
+        self.view_menu.add_separator()
+        self.view_menu.add_command( label = "Zoom In"  , state = "normal", command = lambda: self.view_click_cb( "Zoom In"   ) )
+        self.view_menu.add_command( label = "Zoom Out" , state = "normal", command = lambda: self.view_click_cb( "Zoom Out"  ) )
+        self.view_menu.add_command( label = "Zoom 100%", state = "normal", command = lambda: self.view_click_cb( "Zoom 100%" ) )
+        self.view_menu.add_separator()
+        self.view_menu.add_command( label = "Timings", state = "normal" if timing_registry.is_enabled() else "disabled", command = lambda: self.view_click_cb( "Timings" ) )
+        self.timings_window = None
+        self.view_menu.add_command( label = "Simulate", state = "normal", command = lambda: self.view_click_cb( "Simulate" ) )
+        self.simulator_window = None
+        self.simulator = None
         
         self.button_exit = tk.Menubutton( menu_frame, text = "Exit", indicatoron = False, padx = 10, relief = "raised" )
         self.button_exit.bind( sequence = "<Button-1>", func = self.exit_click_cb )
         self.button_exit.grid( row = 0, column = 3 )
+
+        # Progress of a model being loaded, only shown while loading.
+        self.load_label = tk.Label( menu_frame, text = "", padx = 10 )
+        self.load_label.grid( row = 0, column = 4 )
+        self.load_progress = ttk.Progressbar( menu_frame, orient = "horizontal", length = 200, mode = "determinate" )
+        self.load_progress.grid( row = 0, column = 5 )
+        self.load_cancel = tk.Button( menu_frame, text = "Cancel", padx = 10, command = self.cancel_load )
+        self.load_cancel.grid( row = 0, column = 6 )
+        self.hide_load_progress()
         
         self.paned_win.add( menu_frame, minsize = menu_height )
 
         # Tool Buttons
         self.tool_names = []
         self.tool_icons = []
+        self.tool_icon_paths = []
         self.tool_buttons = []
         paned_sub_win = tk.PanedWindow( self, orient = 'horizontal', sashwidth = 0 )
         paned_sub_win.grid()
@@ -163,8 +228,8 @@ class ccd_ui_layout( tk.Tk ):
         self.tool_button_create( TOOL_NAME_TRANSI, self.images + TOOL_ICON_TRANSI, self.tool_cb_transi )
         self.tool_button_create( TOOL_NAME_STOPST, self.images + TOOL_ICON_STOPST, self.tool_cb_stopst )
         
-        self.tool_frame.update()
-        tool_width = self.tool_frame.winfo_width()
+        self.tool_frame.update_idletasks()
+        tool_width = self.tool_frame.winfo_reqwidth()
 
         # Working Canvas
         work_frame_wid = app_wid - tool_width - 1
@@ -173,7 +238,8 @@ class ccd_ui_layout( tk.Tk ):
         self.work_frame = tk.Frame( paned_sub_win, width = work_frame_wid, height = work_frame_hgt, background = 'white' )
         self.work_frame.grid( row = 0, column = 0, padx = 0, pady = 0 )
         self.work_frame.grid_propagate( False )
-        self.work_frame.update()
+        self.work_frame_wid = work_frame_wid
+        self.work_frame_hgt = work_frame_hgt
 
         paned_sub_win.add( self.tool_frame )
         paned_sub_win.add( self.work_frame )
@@ -184,6 +250,22 @@ class ccd_ui_layout( tk.Tk ):
         self.dirty = False
         self.selected_tool_idx = -1
         self.tool_button_click( TOOL_NAME_SELECT )
+
+        # State of a model being loaded in the background, see load_file().
+        self.hsm_layout = None
+        self.loader = None
+        self.loading_layout = None
+        self.paint_job = None
+        self.load_start_time = 0.0
+
+        startup_profile.mark( "window" )
+
+        # Edits to the model loaded are journaled, see open_journal().
+        self.journal = None
+
+        # Models loaded are cached, see load_file().
+        cache_limit_mb = int( self.wksp_settings.get_value( [ "settings", "cache_limit_mb" ], DEFAULT_CACHE_LIMIT_MB ) )
+        self.model_cache = model_cache.sm_model_cache( max_bytes = cache_limit_mb * 1024 * 1024 ) if cache_limit_mb > 0 else None
         
         self.curr_model_filename = ""
         if self.args.have_start_file():
@@ -195,10 +277,112 @@ class ccd_ui_layout( tk.Tk ):
             if mru_filename:
                 self.load_file( mru_filename )
 
+        if self.loader is None:
+            # Nothing is being loaded, so show the blank template.
+            self.show_model()
+
+    # Lays out and paints the current model in one go.
+    def show_model( self ):
         #self.hsm_canvas = ccd_ui_hsm.sm_canvas( self.work_frame, model = self.model, width = work_frame_wid, height = work_frame_hgt )
         #self.hsm_canvas.paint()
-        self.hsm_layout = ccd_ui_hsm.sm_layout( self.work_frame, model = self.model, width = work_frame_wid, height = work_frame_hgt )
+        if self.hsm_layout is not None:
+            self.hsm_layout.destroy()
+        self.close_journal()
+        self.hsm_layout = sm_tk_layout.sm_layout( self.work_frame, model = self.model, width = self.work_frame_wid, height = self.work_frame_hgt )
+        self.hsm_layout.add_change_listener( self.model_changed )
+        self.setup_undo()
+        startup_profile.mark( "model load" )
         self.hsm_layout.paint()
+        startup_profile.mark( "first paint" )
+        self.reset_simulator()
+        self.after_idle( self.startup_done )
+
+    # Called after each edit. With autosave on, a write of the model is
+    # (re)scheduled, so a burst of edits is saved once they pause. When the
+    # edits are being journaled, that only happens once the journal is big
+    # enough to be worth compacting into the model file.
+    def model_changed( self ):
+        self.has_model_changed = True
+        self.update_edit_menu()
+        should_auto_save = self.wksp_settings.get_value( [ "settings", "autosave" ], False )
+        if should_auto_save and self.filename:
+            if self.journal is None:
+                self.saver.schedule( self.filename, self.get_model_snapshot() )
+            else:
+                limit_kb = self.wksp_settings.get_value( [ "settings", "journal_limit_kb" ], DEFAULT_JOURNAL_LIMIT_KB )
+                if self.journal.get_num_bytes() > int( limit_kb ) * 1024:
+                    self.save_journaled( self.filename )
+
+    # Returns a function giving a copy of the model as it is when called,
+    # bound to the current layout in case another model is loaded before the
+    # save service gets to it. The copy is taken holding the layout's
+    # route_lock, as every edit does, so it never catches an edit half done.
+    def get_model_snapshot( self ):
+        layout = self.hsm_layout
+        def snapshot():
+            with layout.route_lock:
+                return layout.export_model()
+        return snapshot
+
+    # Schedules a full save of the model being journaled, after which the
+    # journal starts over from the file saved, keeping any edits made since
+    # the snapshot was taken. The journal is marked under the same lock as
+    # the snapshot, so every edit is either in the snapshot or after the mark.
+    def save_journaled( self, filename: str, delay: float = None ):
+        ( journal, layout ) = ( self.journal, self.hsm_layout )
+        def snapshot():
+            with layout.route_lock:
+                journal.mark()
+                return layout.export_model()
+        def rebase( data: bytes ):
+            journal.rebase( edit_journal.get_digest( data ) )
+        self.saver.schedule( filename, snapshot, delay = delay, on_saved = rebase )
+
+    # Starts journaling the edits to the model just loaded, whose file has the
+    # given digest. If there is a journal left over for that very save, e.g.
+    # after a crash, its edits are replayed first. Should one of them fail,
+    # the model is put back as it was saved, and the journal is dropped.
+    def open_journal( self, digest: bytes ):
+        self.close_journal()
+        self.journal = edit_journal.edit_journal( self.filename )
+        deltas = self.journal.recover( digest )
+        if deltas:
+            saved_model = copy.deepcopy( self.hsm_layout.export_model() )
+            try:
+                for delta in deltas:
+                    self.hsm_layout.apply_delta( delta )
+            except Exception as e:
+                print( f"WARN: Could not replay the journal of \"{self.filename}\", {type( e ).__name__} {e}, so its edits are dropped." )
+                deltas = []
+                self.model = saved_model
+                self.hsm_layout.destroy()
+                self.hsm_layout = sm_tk_layout.sm_layout( self.work_frame, model = self.model, width = self.work_frame_wid, height = self.work_frame_hgt )
+                self.hsm_layout.add_change_listener( self.model_changed )
+                self.setup_undo()
+                self.hsm_layout.paint()
+        if deltas:
+            print( f"INFO: Recovered {len( deltas )} edits to \"{self.filename}\" from its journal." )
+            ccd_ui_hsm.have_changes = True
+            self.has_model_changed = True
+        self.journal.open( digest, keep = bool( deltas ) )
+        self.hsm_layout.undo_log.add_listener( self.journal.append )
+
+    def close_journal( self ):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    # Applies the undo memory limit to the layout just shown.
+    def setup_undo( self ):
+        limit_kb = self.wksp_settings.get_value( [ "settings", "undo_limit_kb" ], DEFAULT_UNDO_LIMIT_KB )
+        self.hsm_layout.undo_log.set_max_bytes( int( limit_kb ) * 1024 )
+        self.update_edit_menu()
+
+    def update_edit_menu( self ):
+        can_undo = self.hsm_layout is not None and self.hsm_layout.undo_log.can_undo()
+        can_redo = self.hsm_layout is not None and self.hsm_layout.undo_log.can_redo()
+        self.edit_menu.entryconfigure( "Undo", state = "normal" if can_undo else "disabled" )
+        self.edit_menu.entryconfigure( "Redo", state = "normal" if can_redo else "disabled" )
 
 
     # Track main app window size & placement.
@@ -240,38 +424,304 @@ class ccd_ui_layout( tk.Tk ):
 
     def edit_click_cb( self, option_name ):
         print( f"Edit -> {option_name}" )
+        if self.hsm_layout is None:
+            return
+        if option_name == "Undo":
+            self.hsm_layout.undo()
+        elif option_name == "Redo":
+            self.hsm_layout.redo()
+        elif option_name == "Auto Layout":
+            self.hsm_layout.auto_layout()
+        self.update_edit_menu()
 
     def view_click_cb( self, option_name ):
         print( f"View -> {option_name}" )
+        if option_name == "Timings":
+            self.show_timings()
+            return
+        if option_name == "Simulate":
+            self.show_simulator()
+            return
+        if self.hsm_layout is None:
+            return
+        # Zoom about the middle of the view.
+        ( mid_x, mid_y ) = ( self.hsm_layout.view_wid // 2, self.hsm_layout.view_hgt // 2 )
+        if option_name == "Zoom In":
+            self.hsm_layout.zoom_by( ccd_ui_hsm.ZOOM_STEP, mid_x, mid_y )
+        elif option_name == "Zoom Out":
+            self.hsm_layout.zoom_by( 1 / ccd_ui_hsm.ZOOM_STEP, mid_x, mid_y )
+        elif option_name == "Zoom 100%":
+            self.hsm_layout.set_zoom( 1.0, mid_x, mid_y )
+
+    # Shows the timings taken so far in a window of their own, or refreshes it.
+    def show_timings( self ):
+        if self.timings_window is None or not self.timings_window.winfo_exists():
+            self.timings_window = tk.Toplevel( self )
+            self.timings_window.title( "Timings" )
+            self.timings_text = tk.Text( self.timings_window, width = 110, height = 16, font = "TkFixedFont", wrap = "none" )
+            self.timings_text.grid( row = 0, column = 0, sticky = "nsew" )
+            tk.Button( self.timings_window, text = "Refresh", padx = 10, command = self.show_timings ).grid( row = 1, column = 0, sticky = "e" )
+            self.timings_window.grid_rowconfigure( 0, weight = 1 )
+            self.timings_window.grid_columnconfigure( 0, weight = 1 )
+        self.timings_text.configure( state = "normal" )
+        self.timings_text.delete( "1.0", "end" )
+        self.timings_text.insert( "1.0", timing_registry.format_stats() )
+        self.timings_text.configure( state = "disabled" )
+        self.timings_window.lift()
+
+    # Simulate mode, in a window of its own. Events from the model's list, or
+    # typed in, are fired at the model shown, compiled as the runtime would
+    # run it, and the active state and the transition just taken are
+    # highlighted on the canvas.
+    def show_simulator( self ):
+        if self.simulator_window is not None and self.simulator_window.winfo_exists():
+            self.simulator_window.lift()
+            return
+        self.simulator_window = tk.Toplevel( self )
+        self.simulator_window.title( "Simulate" )
+        self.simulator_window.protocol( "WM_DELETE_WINDOW", self.close_simulator )
+        controls = tk.Frame( self.simulator_window )
+        controls.grid( row = 0, column = 0, sticky = "ew" )
+        tk.Label( controls, text = "Event", padx = 5 ).grid( row = 0, column = 0 )
+        self.sim_event = ttk.Combobox( controls, width = 30 )
+        self.sim_event.grid( row = 0, column = 1 )
+        self.sim_event.bind( "<Return>", lambda event: self.fire_sim_event() )
+        self.sim_event.bind( "<<ComboboxSelected>>", lambda event: self.fire_sim_event() )
+        tk.Button( controls, text = "Fire", padx = 10, command = self.fire_sim_event ).grid( row = 0, column = 2 )
+        tk.Button( controls, text = "Reset", padx = 10, command = self.reset_simulator ).grid( row = 0, column = 3 )
+        tk.Label( controls, text = "Random events", padx = 5 ).grid( row = 0, column = 4 )
+        self.sim_num_events = tk.Entry( controls, width = 10 )
+        self.sim_num_events.insert( 0, str( SIM_RANDOM_EVENTS ) )
+        self.sim_num_events.grid( row = 0, column = 5 )
+        tk.Button( controls, text = "Run", padx = 10, command = self.run_sim_random ).grid( row = 0, column = 6 )
+        self.sim_log = tk.Text( self.simulator_window, width = 100, height = 16, font = "TkFixedFont", wrap = "none", state = "disabled" )
+        self.sim_log.grid( row = 1, column = 0, sticky = "nsew" )
+        self.simulator_window.grid_rowconfigure( 1, weight = 1 )
+        self.simulator_window.grid_columnconfigure( 0, weight = 1 )
+        self.reset_simulator()
+
+    # Compiles the model as it is now, e.g. after edits or loading another,
+    # and starts it over.
+    def reset_simulator( self ):
+        if self.simulator_window is None or not self.simulator_window.winfo_exists() or self.hsm_layout is None:
+            return
+        try:
+            self.simulator = sm_simulator.sm_simulator( self.hsm_layout.export_model() )
+        except ValueError as e:
+            self.simulator = None
+            self.hsm_layout.set_highlight( None, None )
+            self.log_sim( f"ERR: The model can't be run, {e}" )
+            return
+        self.sim_event.configure( values = self.simulator.get_event_names() )
+        self.simulator.reset()
+        self.log_sim( f"Started in \"{self.simulator.get_active_name()}\"{self.get_sim_actions()}." )
+        self.show_sim_state()
+
+    def fire_sim_event( self ):
+        event_name = self.sim_event.get().strip()
+        if self.simulator is None or not event_name:
+            return
+        if self.simulator.fire( event_name ):
+            ( src_name, transition_name ) = self.simulator.get_last_transition()
+            self.log_sim( f"{event_name}: \"{src_name}\" -> \"{self.simulator.get_active_name()}\"{self.get_sim_actions()}." )
+        else:
+            self.log_sim( f"{event_name}: not handled in \"{self.simulator.get_active_name()}\"." )
+        self.show_sim_state()
+
+    # Runs the number of random events asked for, as fast as they can be
+    # dispatched, and reports the throughput. Only the final state is shown.
+    def run_sim_random( self ):
+        if self.simulator is None:
+            return
+        try:
+            num_events = int( self.sim_num_events.get() )
+        except ValueError:
+            self.log_sim( f"WARN: \"{self.sim_num_events.get()}\" is not a number of events." )
+            return
+        result = self.simulator.run_random( num_events )
+        self.log_sim( f"Ran {result[ 'events' ]} random events in {result[ 'seconds' ] * 1000:.1f} ms, {result[ 'events_per_sec' ]:,.0f} events/s, "
+            f"{result[ 'taken' ]} transitions taken, now in \"{self.simulator.get_active_name()}\"." )
+        self.show_sim_state()
+
+    def close_simulator( self ):
+        if self.hsm_layout is not None:
+            self.hsm_layout.set_highlight( None, None )
+        self.simulator = None
+        self.simulator_window.destroy()
+        self.simulator_window = None
+
+    # This method is for internal use only.
+    def show_sim_state( self ):
+        self.hsm_layout.set_highlight( self.simulator.get_active_name(), self.simulator.get_last_transition() )
+
+    # This method is for internal use only.
+    def get_sim_actions( self ) -> str:
+        actions = self.simulator.get_actions()
+        return f", running {', '.join( actions )}" if actions else ""
+
+    # This method is for internal use only.
+    def log_sim( self, text: str ):
+        self.sim_log.configure( state = "normal" )
+        self.sim_log.insert( "end", text + "\n" )
+        num_lines = int( self.sim_log.index( "end-1c" ).split( "." )[ 0 ] )
+        if num_lines > SIM_LOG_LINES:
+            self.sim_log.delete( "1.0", f"{num_lines - SIM_LOG_LINES}.0" )
+        self.sim_log.configure( state = "disabled" )
+        self.sim_log.see( "end" )
 
     def exit_click_cb( self, event ):
         self.quit()
 
+    # Starts loading a model in the background. The file is parsed off the Tk
+    # thread, then the states are painted in batches while any transitions
+    # without a path are routed, also off the Tk thread. The model currently
+    # shown stays in place until the new one is complete, or the load is cancelled.
+    # A file reopened unchanged is taken from the model cache, with its paths.
+    # The load is timed as a whole, from here to finish_load(), as load_file.
     def load_file( self, filename: str = "" ):
         # See if the file exists as listed.
         if not os.path.isfile( filename ):
             # File isn't there, can't load it.
             print( f"WARN: File \"{filename}\" not found when loading state machine file." )
         else:
-            # Deserialize the JSON state machine description.
-            try:
-                print( f"INFO: Loading project file \"{filename}\"." )
-                model_file = open( filename, "r" )
-                if not model_file:
-                    print( f"WARN: There is something wrong with the file {filename}, and it can't be opened." )
-                else:
-                    try:
-                        self.model = json.load( model_file )
-                        self.filename = filename
-                        self.wksp_settings.set_latest_used_model( filename )
-                        self.curr_model_filename = filename
-                    except json.JSONDecodeError as e:
-                        print( f"ERR: JSONDecodeError, {e.msg}, file=\"{filename}\", line = {e.lineno}, col = {e.colno}." )
-
-                    model_file.close()
-            except OSError:
-                print( f"WARN: There is something wrong with the file {filename}, and it can't be opened." )
+            self.cancel_load()
+            print( f"INFO: Loading project file \"{filename}\"." )
+            self.loader = model_loader.sm_model_loader( filename, self.model_cache )
+            self.load_start_time = time.perf_counter()
+            self.loader.start_parse()
+            self.show_load_progress( f"Loading {os.path.basename( filename )}" )
+            self.after( LOAD_POLL_MS, self.poll_load )
+
+    # Handles whatever the background load has produced since the last poll.
+    def poll_load( self ):
+        loader = self.loader
+        if loader is None or loader.is_cancelled():
+            return
+
+        for message in loader.get_messages():
+            kind = message[ 0 ]
+            if kind == model_loader.LOAD_MSG_ERROR:
+                print( message[ 1 ] )
+                if self.paint_job is not None:
+                    self.after_cancel( self.paint_job )
+                    self.paint_job = None
+                if self.loading_layout is not None:
+                    self.loading_layout.destroy()
+                self.end_load()
+                if self.hsm_layout is None:
+                    self.show_model()
+                return
+            elif kind == model_loader.LOAD_MSG_PARSED:
+                self.start_load_layout( message[ 1 ] )
+            elif kind == model_loader.LOAD_MSG_ROUTED:
+                self.loading_layout.merge_routes( message[ 1 ] )
+                self.routes_done = message[ 2 ]
+                self.update_load_progress()
+            elif kind == model_loader.LOAD_MSG_DONE:
+                self.routing_done = True
+
+        if self.loading_layout is not None and self.routing_done and self.paint_job is None:
+            self.finish_load()
+        else:
+            self.after( LOAD_POLL_MS, self.poll_load )
+
+    # The file has been parsed, lay it out without routing, and start painting
+    # and routing it.
+    def start_load_layout( self, model: dict ):
+        startup_profile.mark( "model load" )
+        self.loading_model = model
+        self.loading_layout = sm_tk_layout.sm_layout( self.work_frame, model = model, route_missing = False, bounds = self.loader.bounds,
+            width = self.work_frame_wid, height = self.work_frame_hgt )
+        self.loading_layout.paint_begin()
+        self.paint_next = 0
+        self.routes_done = 0
+        self.routing_done = len( self.loading_layout.pending_routes ) == 0
+        if not self.routing_done:
+            self.loader.start_routing( self.loading_layout, self.args.get_route_workers() )
+        self.load_progress.stop()
+        self.load_progress.configure( mode = "determinate" )
+        self.paint_job = self.after_idle( self.paint_load_batch )
+
+    def paint_load_batch( self ):
+        self.paint_next = self.loading_layout.paint_batch( self.paint_next, LOAD_PAINT_BATCH )
+        startup_profile.mark( "first paint" )
+        if self.paint_next < self.loading_layout.get_paint_count():
+            self.paint_job = self.after( 1, self.paint_load_batch )
+        else:
+            self.paint_job = None
+        self.update_load_progress()
+
+    # The new model is complete, so it replaces the one that was shown.
+    def finish_load( self ):
+        if self.hsm_layout is not None:
+            self.hsm_layout.destroy()
+        self.hsm_layout = self.loading_layout
+        self.hsm_layout.add_change_listener( self.model_changed )
+        self.setup_undo()
+        self.model = self.loading_model
+        self.filename = self.loader.filename
+        self.wksp_settings.set_latest_used_model( self.filename )
+        self.curr_model_filename = self.filename
+        # Cached as loaded, before any edits are replayed from the journal.
+        self.loader.save_to_cache( self.hsm_layout.get_bounds() )
+        self.open_journal( self.loader.digest )
+        self.end_load()
+        self.reset_simulator()
+        startup_profile.mark( "routing" )
+        if timing_registry.is_enabled():
+            timing_registry.record( "ccd_ui_layout.load_file", time.perf_counter() - self.load_start_time )
+        self.after_idle( self.startup_done )
+
+    # Once the first model is shown, and the window is ready for input, fill
+    # in the tool icons, and report the startup profile.
+    def startup_done( self ):
+        if self.tool_icon_paths:
+            self.load_tool_icons()
+        startup_profile.report()
+
+    # Abandons a load in progress, leaving the previous model in place.
+    def cancel_load( self ):
+        if self.loader is None:
+            return
+        self.loader.cancel()
+        if self.paint_job is not None:
+            self.after_cancel( self.paint_job )
+            self.paint_job = None
+        if self.loading_layout is not None:
+            self.loading_layout.destroy()
+        print( f"INFO: Cancelled loading \"{self.loader.filename}\"." )
+        self.end_load()
+        if self.hsm_layout is None:
+            self.show_model()
+
+    def end_load( self ):
+        self.loader = None
+        self.loading_layout = None
+        self.loading_model = None
+        self.hide_load_progress()
+
+    def show_load_progress( self, text: str ):
+        self.load_label.configure( text = text )
+        self.load_label.grid()
+        self.load_progress.configure( mode = "indeterminate", value = 0 )
+        self.load_progress.grid()
+        self.load_progress.start()
+        self.load_cancel.grid()
+
+    def update_load_progress( self ):
+        if self.loading_layout is None:
+            return
+        total = self.loading_layout.get_paint_count() + len( self.loading_layout.pending_routes )
+        done = self.paint_next + self.routes_done
+        self.load_progress.configure( maximum = max( total, 1 ), value = done )
 
+    def hide_load_progress( self ):
+        self.load_progress.stop()
+        self.load_label.grid_remove()
+        self.load_progress.grid_remove()
+        self.load_cancel.grid_remove()
+
+    @timing_registry.timed
     def save_file( self, new_filename: str = "" ):
         #print( f"model={self.model}." )
         if (new_filename == "" and not self.has_model_changed and not ccd_ui_hsm.have_changes ):
@@ -294,33 +744,41 @@ class ccd_ui_layout( tk.Tk ):
             filename_to_save = HSM_DEFAULT_FILENAME
 
         # Serialize the JSON state machine description.
-        try:
-            if ( use_dialog ):
-                filename_to_save = filedialog.asksaveasfilename( parent = self,
-                  title = "Select Save File Name",
-                  initialdir = ".",
-                  initialfile = filename_to_save,
-                  filetypes = (("JSON files","*.json"),("all files","*.*")),
-                  defaultextension = "json",
-                  confirmoverwrite = False )
-            model_file = open( filename_to_save, "w" )
-            self.wksp_settings.set_latest_used_model( filename_to_save )
-            json.dump( self.model, model_file, ensure_ascii = True, indent = 4 )
-            model_file.close()
-            self.model_has_changed = False
-            print( f"Saved file = \"{filename_to_save}\"." )
-        except OSError:
-            print( f"WARN: There is something wrong with the file {filename_to_save}, and it can't be opened for writing." )
+        if ( use_dialog ):
+            filename_to_save = filedialog.asksaveasfilename( parent = self,
+              title = "Select Save File Name",
+              initialdir = ".",
+              initialfile = filename_to_save,
+              filetypes = (("JSON files","*.json"),("all files","*.*")),
+              defaultextension = "json",
+              confirmoverwrite = False )
+            if not filename_to_save:
+                # The dialog was cancelled.
+                return
+        self.wksp_settings.set_latest_used_model( filename_to_save )
+        # The write itself happens on the save service's thread.
+        if self.journal is not None and filename_to_save == self.filename:
+            self.save_journaled( filename_to_save, delay = 0 )
+        else:
+            self.saver.schedule( filename_to_save, self.get_model_snapshot(), delay = 0 )
+        self.model_has_changed = False
 
     # Tool Buttons
     def tool_button_create( self, tool_name: str, icon_path: str, callback ):
         tool_idx = len( self.tool_buttons )
         self.tool_names.append( tool_name )
-        self.tool_icons.append( tk.PhotoImage( file = icon_path ) )
+        self.tool_icons.append( tk.PhotoImage( width = TOOL_ICON_SIZE, height = TOOL_ICON_SIZE ) )
+        self.tool_icon_paths.append( icon_path )
         self.tool_buttons.append( ttk.Button( self.tool_frame, image = self.tool_icons[ tool_idx ] ) )
         self.tool_buttons[ tool_idx ].grid( row = tool_idx, column = 0, padx = 0, pady = 0 )
         self.tool_buttons[ tool_idx ].bind( "<Button-1>", callback )
     
+    # Reads the tool icons into the blank images the buttons were made with.
+    def load_tool_icons( self ):
+        for ( icon, icon_path ) in zip( self.tool_icons, self.tool_icon_paths ):
+            icon.configure( file = icon_path )
+        self.tool_icon_paths = []
+
     def tool_button_click( self, new_tool_name: str ):
         tool_name_matched = ""
         tool_idx = 0
@@ -336,11 +794,14 @@ class ccd_ui_layout( tk.Tk ):
             tool_idx += 1
 
     def quit( self ):
-        # Save changes to the model.
+        # A partly loaded model is never saved.
+        self.cancel_load()
+
+        # Save changes to the model, and the workspace, and wait for them to
+        # reach the disk.
         self.save_file()
-        
-        # Save changes to the workspace.
         self.wksp_settings.sync_to_disk()
+        self.saver.flush()
         
         super().quit()
 
@@ -1,28 +1,26 @@
 import json
 import sys
-# Note: Tkinter is usually auto-installed with python, but if you get "ImportError: No module named Tkinter":
-# python -m pip install python3-tk
-import tkinter as tk
-from tkinter import ttk
-from tkinter import *
-#from tkinter.messagebox import showinfo
-from PIL import Image, ImageTk
+# Nothing here uses Tk, so that models can be laid out and routed without a
+# display. The Tk widget showing a diagram is in sm_tk_layout.
+import collections
+import contextlib
+import copy
 import math
+import threading
+import time
 import traceback
 import util
+import sm_autolayout
+import sm_canvas
+import sm_geometry
+import sm_index
+import sm_router
+import sm_undo
+import timing_registry
 # python -m pip install PyYAML
 #import yaml
 
 import workspace_settings
-import hierarchical_state_machine
-
-try:
-    import hierarchical_state_machine as hsm
-except ImportError:
-    print( f"Unable to import module \"hierarchical_state_machine\"." )
-    print( f"Run:\npython -m pip install hierarchical_state_machine\n    ... then try again." )
-    quit()
-
 
 
 BRD_WEIGHT_THN = 0
@@ -65,6 +63,71 @@ HSM_RSVD_PATH  = "path"
 # constrained to multiples of GRID_PIX.
 GRID_PIX = 10
 
+# The spatial index of state rectangles uses square cells of this many grid units.
+INDEX_CELL_GRIDS = 10
+
+# Paths passing near at least this many states are checked for crossings with
+# the batched ( NumPy ) kernel when it is available, rather than edge by edge.
+VECTOR_MIN_RECTS = 8
+
+# Transitions are routed around the states between their ends, searching a
+# corridor this far around the ends, then one ROUTE_CORRIDOR_WIDEN times wider
+# if there was no route in it. Each bend costs as much as ROUTE_BEND_COST pixels of
+# length, and paths keep ROUTE_CLEARANCE_PIX away from the states they pass.
+# The search may settle for a path up to ROUTE_SEARCH_WEIGHT times the cost of
+# the best, which makes it many times faster. With more than
+# ROUTE_MAX_OBSTACLES states in the corridor, or no route found after
+# ROUTE_MAX_NODES steps, the simple dogleg routing of find_clean_path() is
+# used instead.
+ROUTE_CORRIDOR_PIX = 20 * GRID_PIX
+ROUTE_CORRIDOR_WIDEN = 4
+ROUTE_BEND_COST = 4 * GRID_PIX
+ROUTE_CLEARANCE_PIX = GRID_PIX // 2
+ROUTE_SEARCH_WEIGHT = 1.05
+ROUTE_MAX_OBSTACLES = 200
+ROUTE_MAX_NODES = 3000
+
+# The number of routes kept in route_cache.
+ROUTE_CACHE_SIZE = 2000
+
+# The outward direction, as an sm_router.DIRECTIONS index, of the sides of a
+# state in the order of its midpoints: top, right, bottom and left.
+SIDE_DIRECTIONS = ( 3, 0, 1, 2 )
+
+# The number of recent mouse motion latencies kept by sm_diagram.
+MOTION_LATENCY_SAMPLES = 1000
+
+# Undoing or redoing these edits first expands any collapsed composites
+# hiding the state named by their first argument.
+UNDO_REVEAL_OPS = ( "move_state", "resize_state", "reroute_transition", "delete_state", "rename_state", "delete_transition" )
+
+# Items are kept on the canvas for whatever lies within this many pixels of
+# the visible area, so that small scrolls don't need any new items.
+VIEW_MARGIN_PIX = 200
+
+# Grid units scrolled per mouse wheel step.
+WHEEL_SCROLL_UNITS = 3
+
+# The range of zoom factors, and the change made by each zoom step.
+MIN_ZOOM = 0.05
+MAX_ZOOM = 4.0
+ZOOM_STEP = 1.25
+
+# Level of detail.
+# States less than LOD_DETAIL_PIX across on screen are drawn as a plain box,
+# without the title, rounded corners and title separator. Below LOD_PATH_ZOOM,
+# transitions are drawn without arrow heads, and path points closer together
+# than LOD_SIMPLIFY_PIX on screen are merged.
+LOD_DETAIL_PIX = 40
+LOD_PATH_ZOOM = 0.5
+LOD_SIMPLIFY_PIX = 4
+
+# The colour the outlines, titles and transitions are drawn in, and those of
+# the active state and the transition just taken when simulating the model.
+DEFAULT_COLOUR = "black"
+ACTIVE_STATE_COLOUR = "blue"
+TAKEN_TRAN_COLOUR = "red"
+
 # Get the name of this particular code module.
 this_module = sys.modules[__name__]
 
@@ -74,6 +137,10 @@ have_changes = False
 
 style = { "Border Weight": BRD_WEIGHT_THN }
 
+# Paths found by sm_diagram.find_routed_path(), shared by every diagram so
+# that they survive reloading a model.
+route_cache = sm_router.sm_route_cache( ROUTE_CACHE_SIZE )
+
 
 # These 3 helper functions check for / find the intersection of lines in a 2-D plane.
 def ccw( A: dict, B: dict, C: dict ) -> bool:
@@ -124,42 +191,91 @@ def line_intersection(line1, line2) -> dict:
     y = det(d, ydiff) / div
     return {'x': int( round( x ) ), 'y': int( round( y ) ) }    
 
-def find_canvas_rect( model: object, min_w: int, min_h: int ) -> dict:
-    if model:
+# Yields ( name, state ) for every state nested, at any depth, inside the
+# given state, or inside the model if given the model.
+def iter_substates( state: dict ):
+    for sub_name, sub_state in state.get( HSM_RSVD_STATES, {} ).items():
+        yield ( sub_name, sub_state )
+        yield from iter_substates( sub_state )
+
+# Returns a copy of a set of states, at any depth, with only what routing
+# needs: their layouts, the destinations of their transitions and their substates.
+def get_geometry_snapshot( states: dict ) -> dict:
+    snapshot = {}
+    for state_name, state in states.items():
+        state_snapshot = {}
+        if HSM_RSVD_LYOUT in state:
+            state_snapshot[ HSM_RSVD_LYOUT ] = dict( state[ HSM_RSVD_LYOUT ] )
+        if state.get( HSM_RSVD_TRAN ):
+            state_snapshot[ HSM_RSVD_TRAN ] = { transition_name: { HSM_RSVD_DEST: transition.get( HSM_RSVD_DEST ) }
+                for transition_name, transition in state[ HSM_RSVD_TRAN ].items() }
+        if state.get( HSM_RSVD_STATES ):
+            state_snapshot[ HSM_RSVD_STATES ] = get_geometry_snapshot( state[ HSM_RSVD_STATES ] )
+        snapshot[ state_name ] = state_snapshot
+    return snapshot
+
+# Builds a diagram to route transitions on, from a snapshot made by
+# sm_diagram.get_route_snapshot(), e.g. in another process. Nothing is drawn.
+def create_routing_diagram( snapshot: dict ) -> object:
+    return sm_diagram( snapshot, sm_canvas.sm_recording_canvas(), 0, 0, route_missing = False )
+
+# Returns an automatic layout engine set up for the states drawn here.
+def get_auto_layout() -> sm_autolayout.sm_auto_layout:
+    auto_layout = sm_autolayout.sm_auto_layout( GRID_PIX, HSM_RSVD_STATES, HSM_RSVD_LYOUT, HSM_RSVD_TRAN, HSM_RSVD_DEST, HSM_RSVD_PATH )
+    auto_layout.set_default_size( DEF_STATE_WID, DEF_STATE_HGT )
+    # The start and final states are drawn as circles, see sm_start_final_state_layout.
+    for state_name in ( HSM_RSVD_START, HSM_RSVD_FINAL ):
+        auto_layout.set_fixed_size( state_name, THN_CRNR_SIZE * 2, THN_CRNR_SIZE * 2 )
+    return auto_layout
+
+# The extents may be given, as found by get_model_extents(), rather than
+# walking the model again.
+def find_canvas_rect( model: object, min_w: int, min_h: int, extents: tuple = None ) -> dict:
+    if extents is None:
+        extents = get_model_extents( model )
+    ( min_x, min_y ) = ( 0, 0 )
+    ( max_x, max_y ) = ( min_w, min_h )
+    if extents is not None:
         # Push extents out as needed.
-        ( min_x, min_y ) = ( 0, 0 )
-        ( max_x, max_y ) = ( min_w, min_h )
-        states = model.get( HSM_RSVD_STATES )
-        for state_name, state in states.items():
+        min_x = min( min_x, extents[ 0 ] )
+        min_y = min( min_y, extents[ 1 ] )
+        max_x = max( max_x, extents[ 2 ] )
+        max_y = max( max_y, extents[ 3 ] )
+    return { "x": min_x, "y": min_y, "w": max_x - min_x, "h": max_y - min_y }
+
+# Returns the ( lft, top, rgt, btm ) around the layouts of every state in the
+# model, or None if none of them has one.
+def get_model_extents( model: object ) -> tuple:
+    extents = None
+    if model:
+        for state_name, state in iter_substates( model ):
             layout = state.get( HSM_RSVD_LYOUT )
             if layout:
                 state_x = layout.get( "x", DEF_STATE_LFT )
-                if ( min_x > state_x ):
-                    min_x = state_x
                 state_y = layout.get( "y", DEF_STATE_TOP )
-                if ( min_y > state_y ):
-                    min_y = state_y
                 state_w = layout.get( "w", DEF_STATE_WID )
-                if ( max_x < state_x + state_w ):
-                    max_x = state_x + state_w
                 state_h = layout.get( "h", DEF_STATE_HGT )
-                if ( max_y < state_y + state_h ):
-                    max_y = state_y + state_h
+                if extents is None:
+                    extents = ( state_x, state_y, state_x + state_w, state_y + state_h )
+                else:
+                    extents = ( min( extents[ 0 ], state_x ), min( extents[ 1 ], state_y ),
+                                max( extents[ 2 ], state_x + state_w ), max( extents[ 3 ], state_y + state_h ) )
 
-            # TODO: Add recursion to account for sub-states.
-            
             # TODO: Add transition paths extent expansion as well.
-        
-    return { "x": min_x, "y": min_y, "w": max_x - min_x, "h": max_y - min_y }
+    return extents
 
+# The outline is taken from a ( lft, top, wid, hgt ) rect if given, otherwise
+# from the state's layout in the model.
 class sm_state_outline():
-    def __init__( self, state: dict ):
+    def __init__( self, state: dict = None, rect: tuple = None ):
         self.lft = DEF_STATE_LFT
         self.top = DEF_STATE_TOP
         self.wid = DEF_STATE_WID
         self.hgt = DEF_STATE_HGT
 
-        if state:
+        if rect:
+            ( self.lft, self.top, self.wid, self.hgt ) = rect
+        elif state:
             layout = state.get( HSM_RSVD_LYOUT )
             if layout:
                 if ( 'x' in layout.keys() ):
@@ -254,7 +370,7 @@ class sm_start_final_state_layout():
     def __init__( self, parent: object, state_name: str, model: dict ):
         self.initialized = False
         assert( parent )
-        assert( type( parent ) == sm_layout )
+        assert( isinstance( parent, sm_diagram ) )
         self.parent = parent
         assert( state_name )
         assert( state_name == HSM_RSVD_START or state_name == HSM_RSVD_FINAL )
@@ -263,9 +379,6 @@ class sm_start_final_state_layout():
         self.model = model
 
         #print( f"start/final model={self.model}." )
-        # Set border, which for the start symbol, also sets the width and height.
-        self.set_border_thickness( style.get( "Border Weight", BRD_WEIGHT_THN ) )
-
         # Either read the layout from the model or provide a default one.
         global have_changes
 
@@ -274,15 +387,21 @@ class sm_start_final_state_layout():
             layout = { "x": DEF_STATE_LFT, "y": DEF_STATE_TOP }
             have_changes = True
         
-        self.x = layout.get( "x" )
-        if self.x is None:
-            self.x = DEF_STATE_LFT
+        x = layout.get( "x" )
+        if x is None:
+            x = DEF_STATE_LFT
             have_changes = True
-        self.y = layout.get( "y" )
-        if self.y is None:
-            self.y = DEF_STATE_TOP
+        y = layout.get( "y" )
+        if y is None:
+            y = DEF_STATE_TOP
             have_changes = True
 
+        # From here on, the layout is kept in the parent's geometry store.
+        self.geom = parent.geometry.get_state_view( parent.geometry.add_state( state_name, x, y, 0, 0 ) )
+
+        # Set border, which for the start symbol, also sets the width and height.
+        self.set_border_thickness( style.get( "Border Weight", BRD_WEIGHT_THN ) )
+
         self.initialized = True
 
     def set_border_thickness( self, weight: int ):
@@ -293,95 +412,110 @@ class sm_start_final_state_layout():
         if ( weight == BRD_WEIGHT_THK ):
             self.crnr_size = THK_CRNR_SIZE
 
-        self.w = self.crnr_size * 2
-        self.h = self.crnr_size * 2
-        self.model[ HSM_RSVD_LYOUT ][ "w" ] = self.w
-        self.model[ HSM_RSVD_LYOUT ][ "h" ] = self.h
+        self.geom.w = self.crnr_size * 2
+        self.geom.h = self.crnr_size * 2
 
     def drag_start( self, event ):
-        self.drag_start_x = event.x
-        self.drag_start_y = event.y
-        self.drag_x = self.x
-        self.drag_y = self.y
-
-        #print( f"sm strt_otln = {self.x},{self.y} {self.w}x{self.h}" )
-        self.prev_outline = self.parent.canvas.create_rectangle(
-            self.x,              self.y,
-            self.x + self.w - 1, self.y + self.h - 1,
-            outline = "#888888" )
+        ( event_x, event_y ) = self.parent.get_event_point( event )
+        self.drag_start_x = event_x
+        self.drag_start_y = event_y
+        self.drag_x = self.geom.x
+        self.drag_y = self.geom.y
+
+        #print( f"sm strt_otln = {self.geom.x},{self.geom.y} {self.geom.w}x{self.geom.h}" )
+        self.parent.show_ghost( self.geom.x, self.geom.y, self.geom.w, self.geom.h )
     
+    # Motion events are coalesced by the parent, which calls drag_update()
+    # with the latest one once per idle period.
     def drag_motion( self, event ):
-        new_x = self.x + ( event.x - self.drag_start_x )
+        self.parent.queue_motion( self.drag_update, event )
+
+    def drag_update( self, event ):
+        ( event_x, event_y ) = self.parent.get_event_point( event )
+        new_x = self.geom.x + ( event_x - self.drag_start_x )
         # Round it up if closer to next grid point.
         snap_x = new_x + ( GRID_PIX / 2 )
         snap_x = int( snap_x / GRID_PIX )
         snap_x *= GRID_PIX
         
-        new_y = self.y + ( event.y - self.drag_start_y )
+        new_y = self.geom.y + ( event_y - self.drag_start_y )
         snap_y = new_y + ( GRID_PIX / 2 )
         snap_y = int( snap_y / GRID_PIX )
         snap_y *= GRID_PIX
         
         if snap_x != self.drag_x or snap_y != self.drag_y:
-            self.parent.canvas.delete( self.prev_outline )
-
             self.drag_x = snap_x
             self.drag_y = snap_y
-            #print( f"sm new_otln = {self.x},{self.y} {self.w}x{self.h}" )
-            self.prev_outline = self.parent.canvas.create_rectangle(
-                snap_x,              snap_y,
-                snap_x + self.w - 1, snap_y + self.h - 1,
-                outline = "#888888" )
+            #print( f"sm new_otln = {self.geom.x},{self.geom.y} {self.geom.w}x{self.geom.h}" )
+            self.parent.show_ghost( snap_x, snap_y, self.geom.w, self.geom.h )
 
             global have_changes
             have_changes = True
             
     def drag_stop( self, event ):
-        self.parent.canvas.delete( self.prev_outline )
+        self.parent.flush_motion()
+        self.parent.hide_ghost()
 
-        if self.x != self.drag_x or self.y != self.drag_y:
-            self.x = self.drag_x
-            self.y = self.drag_y
-            self.model[ HSM_RSVD_LYOUT ][ "x" ] = self.x
-            self.model[ HSM_RSVD_LYOUT ][ "y" ] = self.y
-
-            #print( f"sm new_outline {self.x},{self.y},{self.x + self.w},{self.y + self.h}" )
-            self.parent.reroute_paths( self )
-            self.parent.paint()
+        if self.geom.x != self.drag_x or self.geom.y != self.drag_y:
+            #print( f"sm new_outline {self.drag_x},{self.drag_y},{self.drag_x + self.geom.w},{self.drag_y + self.geom.h}" )
+            self.parent.move_state( self.name, self.drag_x, self.drag_y )
     
     def paint( self ):
-        #print( f"sm paint canv, {self.name} = {self.x},{self.y} {self.w}x{self.h}" )
+        #print( f"sm paint canv, {self.name} = {self.geom.x},{self.geom.y} {self.geom.w}x{self.geom.h}" )
+        radius = self.crnr_size / 2
+        coords = self.parent.to_canvas( (
+            self.geom.x + 0,          self.geom.y + 0,
+            self.geom.x + self.geom.w - 1, self.geom.y + self.geom.h - 1,
+            self.geom.x + radius,             self.geom.y + radius,
+            self.geom.x + ( radius * 3 ) - 1, self.geom.y + ( radius * 3 ) - 1 ) )
+        circle_coords = coords[ 0 : 4 ]
+        inner_coords = coords[ 4 : 8 ]
+
+        # If the items already exist on the canvas, just move them.
+        items = self.parent.state_items.get( self.name )
+        if items is not None:
+            self.parent.canvas.coords( items[ 0 ], *circle_coords )
+            if len( items ) > 1:
+                self.parent.canvas.coords( items[ 1 ], *inner_coords )
+            return
 
         # Create a simple filled circle.
         # Note: The bottom and right sides of the arc outline box
         #       specify the last position, not last + 1 (as opposed to rectangles).
         circle = self.parent.canvas.create_oval(
-            self.x + 0,          self.y + 0,
-            self.x + self.w - 1, self.y + self.h - 1,
+            *circle_coords,
             width = 0, fill = "black", activefill = "darkgreen" )
         # Make it dragable.
         self.parent.canvas.tag_bind( circle, sequence = "<Button-1>", func = self.drag_start )
         self.parent.canvas.tag_bind( circle, sequence = "<B1-Motion>", func = self.drag_motion )
         self.parent.canvas.tag_bind( circle, sequence = "<ButtonRelease-1>", func = self.drag_stop )
+        items = [ circle ]
 
         # Add a white circle in the center if this is a final state.
         if self.name == HSM_RSVD_FINAL:
-            radius = self.crnr_size / 2
             inner_circle = self.parent.canvas.create_oval(
-                self.x + radius,             self.y + radius,
-                self.x + ( radius * 3 ) - 1, self.y + ( radius * 3 ) - 1,
+                *inner_coords,
                 width = 0, fill = "white", activefill = "lightgreen" )
             # Make it dragable.
             self.parent.canvas.tag_bind( inner_circle, sequence = "<Button-1>", func = self.drag_start )
             self.parent.canvas.tag_bind( inner_circle, sequence = "<B1-Motion>", func = self.drag_motion )
             self.parent.canvas.tag_bind( inner_circle, sequence = "<ButtonRelease-1>", func = self.drag_stop )
+            items.append( inner_circle )
+
+        self.parent.state_items[ self.name ] = items
+
+    # Recolours the items, e.g. to highlight the state, without repainting.
+    def set_colour( self, colour: str ):
+        items = self.parent.state_items.get( self.name )
+        if items is not None:
+            self.parent.canvas.itemconfigure( items[ 0 ], fill = colour )
 
 
 # The State Layout Widget
 class sm_state_layout():
     def __init__( self, parent: object, state_name: str, model: dict ):
         assert( parent )
-        assert( type( parent ) == sm_layout )
+        assert( isinstance( parent, sm_diagram ) )
         self.parent = parent
         assert( state_name )
         self.name = state_name
@@ -398,26 +532,32 @@ class sm_state_layout():
             layout = { "x": DEF_STATE_LFT, "y": DEF_STATE_TOP, "w": DEF_STATE_WID, "h": DEF_STATE_HGT }
             have_changes = True
 
-        self.x = layout.get( "x", None )
-        if self.x is None:
-            self.x = DEF_STATE_LFT
+        x = layout.get( "x", None )
+        if x is None:
+            x = DEF_STATE_LFT
             have_changes = True
 
-        self.y = layout.get( "y", None )
-        if self.y is None:
-            self.y = DEF_STATE_TOP
+        y = layout.get( "y", None )
+        if y is None:
+            y = DEF_STATE_TOP
             have_changes = True
 
-        self.w = layout.get( "w", None )
-        if self.w is None:
-            self.w = DEF_STATE_WID
+        w = layout.get( "w", None )
+        if w is None:
+            w = DEF_STATE_WID
             have_changes = True
 
-        self.h = layout.get( "h", None )
-        if self.h is None:
-            self.h = DEF_STATE_HGT
+        h = layout.get( "h", None )
+        if h is None:
+            h = DEF_STATE_HGT
             have_changes = True
 
+        # From here on, the layout is kept in the parent's geometry store.
+        self.geom = parent.geometry.get_state_view( parent.geometry.add_state( state_name, x, y, w, h ) )
+
+        # Whether the items on the canvas are the full drawing, or a plain box.
+        self.detailed = True
+
     def set_border_thickness( self, weight: int ):
         if ( weight == BRD_WEIGHT_THN ):
             self.line_size = THN_LINE_SIZE
@@ -433,91 +573,90 @@ class sm_state_layout():
             self.titl_size = THK_TITL_SIZE
 
     def size_drag_start( self, event ):
-        self.drag_start_x = event.x
-        self.drag_start_y = event.y
-        self.drag_x = self.x
-        self.drag_y = self.y
-
-        self.prev_wid = self.w
-        self.prev_hgt = self.h
-        self.most_wid = self.w
-        self.most_hgt = self.h
-        self.offs_wid = self.x + self.w - event.x
-        self.offs_hgt = self.y + self.h - event.y
-
-        #print( f"sm strt_otln = {self.x},{self.y} {self.w}x{self.h}" )
-        self.prev_outline = self.parent.canvas.create_rectangle(
-            self.x,              self.y,
-            self.x + self.w - 1, self.y + self.h - 1,
-            outline = "#888888" )
+        ( event_x, event_y ) = self.parent.get_event_point( event )
+        self.drag_start_x = event_x
+        self.drag_start_y = event_y
+        self.drag_x = self.geom.x
+        self.drag_y = self.geom.y
+
+        self.prev_wid = self.geom.w
+        self.prev_hgt = self.geom.h
+        self.most_wid = self.geom.w
+        self.most_hgt = self.geom.h
+        self.offs_wid = self.geom.x + self.geom.w - event_x
+        self.offs_hgt = self.geom.y + self.geom.h - event_y
+
+        #print( f"sm strt_otln = {self.geom.x},{self.geom.y} {self.geom.w}x{self.geom.h}" )
+        self.parent.show_ghost( self.geom.x, self.geom.y, self.geom.w, self.geom.h )
     
+    # Motion events are coalesced by the parent, which calls drag_update() or
+    # size_update() with the latest one once per idle period.
     def drag_motion( self, event ):
-        new_x = self.x + ( event.x - self.drag_start_x )
+        self.parent.queue_motion( self.drag_update, event )
+
+    def drag_update( self, event ):
+        ( event_x, event_y ) = self.parent.get_event_point( event )
+        new_x = self.geom.x + ( event_x - self.drag_start_x )
         # Round it up if closer to next grid point.
         snap_x = new_x + ( GRID_PIX / 2 )
         snap_x = int( snap_x / GRID_PIX )
         snap_x *= GRID_PIX
         
-        new_y = self.y + ( event.y - self.drag_start_y )
+        new_y = self.geom.y + ( event_y - self.drag_start_y )
         snap_y = new_y + ( GRID_PIX / 2 )
         snap_y = int( snap_y / GRID_PIX )
         snap_y *= GRID_PIX
         
         if snap_x != self.drag_x or snap_y != self.drag_y:
-            self.parent.canvas.delete( self.prev_outline )
-
             self.drag_x = snap_x
             self.drag_y = snap_y
-            #print( f"sm new_otln = {self.x},{self.y} {self.w}x{self.h}" )
-            self.prev_outline = self.parent.canvas.create_rectangle(
-                snap_x,              snap_y,
-                snap_x + self.w - 1, snap_y + self.h - 1,
-                outline = "#888888" )
+            #print( f"sm new_otln = {self.geom.x},{self.geom.y} {self.geom.w}x{self.geom.h}" )
+            self.parent.show_ghost( snap_x, snap_y, self.geom.w, self.geom.h )
 
             global have_changes
             have_changes = True
             
     def drag_stop( self, event ):
-        self.parent.canvas.delete( self.prev_outline )
-
-        if self.x != self.drag_x or self.y != self.drag_y:
-            self.x = self.drag_x
-            self.y = self.drag_y
-            self.model[ HSM_RSVD_LYOUT ][ "x" ] = self.x
-            self.model[ HSM_RSVD_LYOUT ][ "y" ] = self.y
+        self.parent.flush_motion()
+        self.parent.hide_ghost()
 
-            #print( f"sm new_outline {self.x},{self.y},{self.x + self.w},{self.y + self.h}" )
-            self.parent.reroute_paths( self )
-            self.parent.paint()
+        if self.geom.x != self.drag_x or self.geom.y != self.drag_y:
+            #print( f"sm new_outline {self.drag_x},{self.drag_y},{self.drag_x + self.geom.w},{self.drag_y + self.geom.h}" )
+            self.parent.move_state( self.name, self.drag_x, self.drag_y )
     
     def size_motion( self, event ):
-        self.parent.canvas.delete( self.prev_outline )
-        
-        temp_wid = event.x - self.x + self.offs_wid
+        self.parent.queue_motion( self.size_update, event )
+
+    def size_update( self, event ):
+        ( event_x, event_y ) = self.parent.get_event_point( event )
+        temp_wid = event_x - self.geom.x + self.offs_wid
         if temp_wid < MIN_SM_WID:
             temp_wid = MIN_SM_WID
         # Round it up if closer to next grid point.
         snap_x = temp_wid + ( GRID_PIX / 2 )
         snap_x = int( snap_x / GRID_PIX )
         temp_wid = snap_x * GRID_PIX
-        self.prev_wid = temp_wid
             
-        temp_hgt = event.y - self.y + self.offs_wid
+        temp_hgt = event_y - self.geom.y + self.offs_wid
         if temp_hgt < MIN_SM_HGT:
             temp_hgt = MIN_SM_HGT
         snap_y = temp_hgt + ( GRID_PIX / 2 )
         snap_y = int( snap_y / GRID_PIX )
         temp_hgt = snap_y * GRID_PIX
-        self.prev_hgt = temp_hgt
 
-        #print( f"sm prev_outline {self.x},{self.y},{self.x + temp_wid},{self.y + temp_hgt}" )
-        self.prev_outline = self.parent.canvas.create_rectangle(
-            self.x + 0,            self.y + 0,
-            self.x + temp_wid - 1, self.y + temp_hgt - 1,
-            outline = "#888888" )
+        # Only move the outline when the snapped size has changed.
+        if temp_wid != self.prev_wid or temp_hgt != self.prev_hgt:
+            self.prev_wid = temp_wid
+            self.prev_hgt = temp_hgt
+            #print( f"sm prev_outline {self.geom.x},{self.geom.y},{self.geom.x + temp_wid},{self.geom.y + temp_hgt}" )
+            self.parent.show_ghost( self.geom.x, self.geom.y, temp_wid, temp_hgt )
 
     def size_stop( self, event ):
-        temp_wid = event.x - self.x + self.offs_wid
+        ( event_x, event_y ) = self.parent.get_event_point( event )
+        self.parent.flush_motion()
+        self.parent.hide_ghost()
+
+        temp_wid = event_x - self.geom.x + self.offs_wid
         if temp_wid < MIN_SM_WID:
             temp_wid = MIN_SM_WID
         # Round it up if closer to next grid point.
@@ -525,47 +664,34 @@ class sm_state_layout():
         snap_x = int( snap_x / GRID_PIX )
         temp_wid = snap_x * GRID_PIX
 
-        temp_hgt = event.y - self.y + self.offs_wid
+        temp_hgt = event_y - self.geom.y + self.offs_wid
         if temp_hgt < MIN_SM_HGT:
             temp_hgt = MIN_SM_HGT
         snap_y = temp_hgt + ( GRID_PIX / 2 )
         snap_y = int( snap_y / GRID_PIX )
         temp_hgt = snap_y * GRID_PIX
 
-        if self.w != temp_wid or self.h != temp_hgt:
-            self.w = temp_wid
-            self.h = temp_hgt
-            self.model[ HSM_RSVD_LYOUT ][ "w" ] = self.w
-            self.model[ HSM_RSVD_LYOUT ][ "h" ] = self.h
-            #print( f"sm new_outline {self.x},{self.y},{self.x + self.w},{self.y + self.h}" )
-            
-            self.parent.reroute_paths( self )
-            self.parent.paint()
-            global have_changes
-            have_changes = True
+        if self.geom.w != temp_wid or self.geom.h != temp_hgt:
+            #print( f"sm new_outline {self.geom.x},{self.geom.y},{self.geom.x + temp_wid},{self.geom.y + temp_hgt}" )
+            self.parent.resize_state( self.name, temp_wid, temp_hgt )
         
-    def paint( self ):
-        #print( f"sm paint canv, {self.name} = {self.x},{self.y} {self.w}x{self.h}" )
-
+    # Returns the canvas coordinates of each of the state's items, in the order
+    # the items are created by paint().
+    def get_item_coords( self ) -> list:
         # Create a rounded rectangle along the edges of this canvas.
         # Note: For widths greater than 1, x and y coordinates relate
         #       to the center of the line or arc.
         top_ctr_y = 0      + ( self.line_size / 2 )
-        rgt_ctr_x = self.w - ( self.line_size / 2 )
-        btm_ctr_y = self.h - ( self.line_size / 2 )
+        rgt_ctr_x = self.geom.w - ( self.line_size / 2 )
+        btm_ctr_y = self.geom.h - ( self.line_size / 2 )
         lft_ctr_x = 0      + ( self.line_size / 2 )
         # Compute Arc Endpoints
         # Note: The x,y coordinates for the arc are to enclose a full ellipse.
         top_arc_y = 0      + ( self.crnr_size * 2 )
-        rgt_arc_x = self.w - ( self.crnr_size * 2 )
-        btm_arc_y = self.h - ( self.crnr_size * 2 )
+        rgt_arc_x = self.geom.w - ( self.crnr_size * 2 )
+        btm_arc_y = self.geom.h - ( self.crnr_size * 2 )
         lft_arc_x = 0      + ( self.crnr_size * 2 )
 
-        #paint_wid = self.w - 1
-        #paint_hgt = self.h - 1
-        #self.parent.canvas.create_line( self.x, self.y, self.x + paint_wid, self.y + paint_hgt, width = self.line_size, arrow = "last" )
-        #self.parent.canvas.create_line( self.x + paint_wid, self.y, self.x, self.y + paint_hgt, width = self.line_size, arrow = "last" )
-        
         # Set up the state name print area.
         title_posn_x = lft_arc_x
         title_posn_y = self.line_size
@@ -573,110 +699,174 @@ class sm_state_layout():
         title_size_y = self.titl_size
         title_cntr_x = title_posn_x + int( title_size_x / 2 )
         title_cntr_y = title_posn_y + int( title_size_y / 2 )
-        title_rect = self.parent.canvas.create_rectangle(
-            self.x + title_posn_x, self.y + title_posn_y,
-            self.x + title_posn_x + title_size_x, self.y + title_posn_y + title_size_y,
+
+        # Note: The bottom and right sides of the arc outline box
+        #       specify the last position, not last + 1.
+        return [
+            # Title Bar
+            ( self.geom.x + title_posn_x, self.geom.y + title_posn_y,
+              self.geom.x + title_posn_x + title_size_x, self.geom.y + title_posn_y + title_size_y ),
+            # Title Text
+            ( self.geom.x + title_cntr_x, self.geom.y + title_cntr_y ),
+            # Resize Handle
+            ( self.geom.x + rgt_arc_x, self.geom.y + btm_arc_y,
+              self.geom.x + rgt_ctr_x, self.geom.y + btm_ctr_y ),
+            # Top Line
+            ( self.geom.x + 0      + self.crnr_size, self.geom.y + top_ctr_y,
+              self.geom.x + self.geom.w - self.crnr_size, self.geom.y + top_ctr_y ),
+            # Upper Right Corner
+            ( self.geom.x + rgt_arc_x    , self.geom.y + top_ctr_y    ,
+              self.geom.x + rgt_ctr_x - 1, self.geom.y + top_arc_y - 1 ),
+            # Right Line
+            ( self.geom.x + rgt_ctr_x, self.geom.y + 0      + self.crnr_size,
+              self.geom.x + rgt_ctr_x, self.geom.y + self.geom.h - self.crnr_size ),
+            # Bottom Right Corner
+            ( self.geom.x + rgt_arc_x    , self.geom.y + btm_arc_y    ,
+              self.geom.x + rgt_ctr_x - 1, self.geom.y + btm_ctr_y - 1 ),
+            # Bottom Line
+            ( self.geom.x + self.geom.w - self.crnr_size, self.geom.y + btm_ctr_y,
+              self.geom.x + 0      + self.crnr_size, self.geom.y + btm_ctr_y ),
+            # Bottom Left Corner
+            ( self.geom.x + lft_ctr_x    , self.geom.y + btm_arc_y    ,
+              self.geom.x + lft_arc_x - 1, self.geom.y + btm_ctr_y - 1 ),
+            # Left Line
+            ( self.geom.x + lft_ctr_x, self.geom.y + self.geom.h - self.crnr_size,
+              self.geom.x + lft_ctr_x, self.geom.y + 0      + self.crnr_size ),
+            # Top Left Corner
+            ( self.geom.x + lft_ctr_x    , self.geom.y + top_ctr_y    ,
+              self.geom.x + lft_arc_x - 1, self.geom.y + top_arc_y - 1 ),
+            # Title Bar Separator
+            ( self.geom.x + lft_ctr_x, self.geom.y + self.line_size + self.titl_size,
+              self.geom.x + rgt_ctr_x, self.geom.y + self.line_size + self.titl_size ),
+        ]
+
+    def paint( self ):
+        #print( f"sm paint canv, {self.name} = {self.geom.x},{self.geom.y} {self.geom.w}x{self.geom.h}" )
+        detailed = self.parent.is_detailed( self.geom.w, self.geom.h )
+        items = self.parent.state_items.get( self.name )
+        if items is not None and detailed != self.detailed:
+            # Changing the level of detail needs a different set of items.
+            self.parent.remove_state_items( self.name )
+            items = None
+        self.detailed = detailed
+        if not detailed:
+            self.paint_box( items )
+            return
+
+        # Convert the coordinates of all the items to the canvas in one go.
+        coords = self.get_item_coords()
+        flat_coords = self.parent.to_canvas( [ value for item_coords in coords for value in item_coords ] )
+        first = 0
+        for idx in range( len( coords ) ):
+            last = first + len( coords[ idx ] )
+            coords[ idx ] = flat_coords[ first : last ]
+            first = last
+
+        # If the items already exist on the canvas, just move and reshape them.
+        if items is not None:
+            for item, item_coords in zip( items, coords ):
+                self.parent.canvas.coords( item, *item_coords )
+            self.parent.canvas.itemconfigure( items[ 1 ], text = self.get_title() )
+            return
+
+        canvas = self.parent.canvas
+        title_rect = canvas.create_rectangle( *coords[ 0 ],
             width = 0,
             activeoutline = "#EEEEEE", activefill = "#EEEEEE" )
-        title_text = self.parent.canvas.create_text(
-            self.x + title_cntr_x, self.y + title_cntr_y,
-            text = self.name, justify = "center", width = 0, activefill = "darkgreen" )
+        title_text = canvas.create_text( *coords[ 1 ],
+            text = self.get_title(), justify = "center", width = 0, activefill = "darkgreen" )
         # Drag the state widget using the title bar.
-        self.parent.canvas.tag_bind( title_text, sequence = "<Button-1>", func = self.size_drag_start )
-        self.parent.canvas.tag_bind( title_text, sequence = "<B1-Motion>", func = self.drag_motion )
-        self.parent.canvas.tag_bind( title_text, sequence = "<ButtonRelease-1>", func = self.drag_stop )
+        canvas.tag_bind( title_text, sequence = "<Button-1>", func = self.size_drag_start )
+        canvas.tag_bind( title_text, sequence = "<B1-Motion>", func = self.drag_motion )
+        canvas.tag_bind( title_text, sequence = "<ButtonRelease-1>", func = self.drag_stop )
+        # Double click the title to expand or collapse a composite state.
+        canvas.tag_bind( title_text, sequence = "<Double-Button-1>", func = self.toggle_expanded )
 
         # Resize the state widget using the bottom right corner.
-        size_rect = self.parent.canvas.create_rectangle(
-            self.x + rgt_arc_x, self.y + btm_arc_y,
-            self.x + rgt_ctr_x, self.y + btm_ctr_y,
+        size_rect = canvas.create_rectangle( *coords[ 2 ],
             width = 0,
             activeoutline = "#EEEEEE", activefill = "#EEEEEE" )
-        self.parent.canvas.tag_bind( size_rect, sequence = "<Button-1>", func = self.size_drag_start )
-        self.parent.canvas.tag_bind( size_rect, sequence = "<B1-Motion>", func = self.size_motion )
-        self.parent.canvas.tag_bind( size_rect, sequence = "<ButtonRelease-1>", func = self.size_stop )
-
-        # Top Line
-        self.parent.canvas.create_line(
-            self.x + 0      + self.crnr_size, self.y + top_ctr_y,
-            self.x + self.w - self.crnr_size, self.y + top_ctr_y,
-            width = self.line_size )
-            
-        # Upper Right Corner
-        # Note: The bottom and right sides of the arc outline box
-        #       specify the last position, not last + 1.
-        self.parent.canvas.create_arc(
-            self.x + rgt_arc_x    , self.y + top_ctr_y    ,
-            self.x + rgt_ctr_x - 1, self.y + top_arc_y - 1,
-            start = 0, extent = 90,
-            style = 'arc', width = self.line_size )
-            
-        # Right Line
-        self.parent.canvas.create_line(
-            self.x + rgt_ctr_x, self.y + 0      + self.crnr_size,
-            self.x + rgt_ctr_x, self.y + self.h - self.crnr_size,
-            width = self.line_size )
-            
-        # Bottom Right Corner
-        self.parent.canvas.create_arc(
-            self.x + rgt_arc_x    , self.y + btm_arc_y    ,
-            self.x + rgt_ctr_x - 1, self.y + btm_ctr_y - 1,
-            start = 270, extent = 90,
-            style = 'arc', width = self.line_size )
-            
-        # Bottom Line
-        self.parent.canvas.create_line(
-            self.x + self.w - self.crnr_size, self.y + btm_ctr_y,
-            self.x + 0      + self.crnr_size, self.y + btm_ctr_y,
-            width = self.line_size )
-            
-        # Bottom Left Corner
-        self.parent.canvas.create_arc(
-            self.x + lft_ctr_x    , self.y + btm_arc_y    ,
-            self.x + lft_arc_x - 1, self.y + btm_ctr_y - 1,
-            start = 180, extent = 90,
-            style = 'arc', width = self.line_size )
-            
-        # Left Line
-        self.parent.canvas.create_line(
-            self.x + lft_ctr_x, self.y + self.h - self.crnr_size, 
-            self.x + lft_ctr_x, self.y + 0      + self.crnr_size,
-            width = self.line_size )
-            
-        # Top Left Corner
-        self.parent.canvas.create_arc(
-            self.x + lft_ctr_x    , self.y + top_ctr_y    ,
-            self.x + lft_arc_x - 1, self.y + top_arc_y - 1,
-            start = 90, extent = 90,
-            style = 'arc', width = self.line_size )
-            
+        canvas.tag_bind( size_rect, sequence = "<Button-1>", func = self.size_drag_start )
+        canvas.tag_bind( size_rect, sequence = "<B1-Motion>", func = self.size_motion )
+        canvas.tag_bind( size_rect, sequence = "<ButtonRelease-1>", func = self.size_stop )
+
+        items = [ title_rect, title_text, size_rect ]
+        # The outline alternates lines and corner arcs, clockwise from the top line.
+        arc_starts = [ 0, 270, 180, 90 ]
+        for side_idx in range( 4 ):
+            items.append( canvas.create_line( *coords[ 3 + side_idx * 2 ], width = self.line_size ) )
+            items.append( canvas.create_arc( *coords[ 4 + side_idx * 2 ],
+                start = arc_starts[ side_idx ], extent = 90,
+                style = 'arc', width = self.line_size ) )
+
         # Section off the title bar.
-        self.parent.canvas.create_line(
-            self.x + lft_ctr_x, self.y + self.line_size + self.titl_size, 
-            self.x + rgt_ctr_x, self.y + self.line_size + self.titl_size, 
-            width = self.line_size )
-
-# The State Machine Layout Widget
-class sm_layout( tk.Frame ):
-    def __init__( self, *args, model: dict = None, **kwargs ):
-        #print( f"frm = {self} = {self.winfo_width()}x{self.winfo_height()}+{self.winfo_x()}+{self.winfo_y()}" )
-        super( sm_layout, self ).__init__( *args, bd = 0, highlightthickness = 0, relief = 'ridge', **kwargs )
-        self.grid( row = 0, column = 0, padx = 0, pady = 0 )
-        self.grid_propagate( False )
-        self.update()
-
-        # Figure out the canvas size needed.
-        # Start with the frame size and then expand if needed by the model.
-        canv_w = self.winfo_width()
-        canv_h = self.winfo_height()
-        canv_geom = find_canvas_rect( model, min_w = canv_w, min_h = canv_h )
-        view_str = f"{canv_geom[ "x" ]} {canv_geom[ "y" ]} {canv_geom[ "x" ] + canv_w} {canv_geom[ "y" ] + canv_h}"
-        #print( f"F Wrk Frame = {self.winfo_width()}x{self.winfo_height()}" )
-        self.canvas = tk.Canvas( master = self, width = canv_geom[ "w" ], height = canv_geom[ "h" ], bd = 0, highlightthickness = 0, relief = 'ridge', scrollregion = view_str )
-        self.canvas.grid( row = 0, column = 0, padx = 0, pady = 0 )
-        self.canvas.grid_propagate( False )
-        self.canvas.update()
-        #print( f"C Wrk Frame = {self.canvas.winfo_width()}x{self.canvas.winfo_height()}" )
+        items.append( canvas.create_line( *coords[ 11 ], width = self.line_size ) )
+
+        self.parent.state_items[ self.name ] = items
+
+    # Draws the state as a single rectangle, for when it is too small on screen
+    # for its title and corners to be made out. It can still be dragged.
+    def paint_box( self, items: list ):
+        box_coords = self.parent.to_canvas( (
+            self.geom.x, self.geom.y, self.geom.x + self.geom.w - 1, self.geom.y + self.geom.h - 1 ) )
+        if items is not None:
+            self.parent.canvas.coords( items[ 0 ], *box_coords )
+            return
+
+        canvas = self.parent.canvas
+        box = canvas.create_rectangle( *box_coords, width = 1, activeoutline = "darkgreen" )
+        canvas.tag_bind( box, sequence = "<Button-1>", func = self.size_drag_start )
+        canvas.tag_bind( box, sequence = "<B1-Motion>", func = self.drag_motion )
+        canvas.tag_bind( box, sequence = "<ButtonRelease-1>", func = self.drag_stop )
+        canvas.tag_bind( box, sequence = "<Double-Button-1>", func = self.toggle_expanded )
+        self.parent.state_items[ self.name ] = [ box ]
+
+    # Recolours the outline and title, e.g. to highlight the state, without repainting.
+    def set_colour( self, colour: str ):
+        items = self.parent.state_items.get( self.name )
+        if items is None:
+            return
+        canvas = self.parent.canvas
+        if not self.detailed:
+            canvas.itemconfigure( items[ 0 ], outline = colour )
+            return
+        canvas.itemconfigure( items[ 1 ], fill = colour )
+        # The outline's lines and the title separator, then its corner arcs, see paint().
+        for item in items[ 3 : 12 : 2 ]:
+            canvas.itemconfigure( item, fill = colour )
+        for item in items[ 4 : 11 : 2 ]:
+            canvas.itemconfigure( item, outline = colour )
+
+    # The title of a composite state shows whether it is expanded [-] or collapsed [+].
+    def get_title( self ) -> str:
+        expanded = self.parent.expanded.get( self.name )
+        if expanded is None:
+            return self.name
+        return self.name + ( " [-]" if expanded else " [+]" )
+
+    def toggle_expanded( self, event ):
+        self.parent.toggle_state( self.name )
+
+# The State Machine Layout
+# The states and transitions of a model, drawn through a canvas backend (see
+# sm_canvas), so the layout, routing and painting code can run without a
+# display. sm_layout puts one in a Tk frame for the editor.
+# When route_missing is False, transitions without a path are not routed here.
+# They are listed in pending_routes instead, for the caller to route in the
+# background and hand back through merge_routes().
+# Only the states and transitions within ( view_lft, view_top, view_wid,
+# view_hgt ), plus a margin, have canvas items. See set_view().
+class sm_diagram():
+    # The boxes around collapsed composites may be given, as returned by
+    # get_subtree_bboxes() for the same model, e.g. when it was last loaded.
+    def __init__( self, model: dict, canvas: sm_canvas.sm_canvas_backend, view_wid: int, view_hgt: int, route_missing: bool = True, view_lft: int = 0, view_top: int = 0, subtree_bboxes: dict = None ):
+        self.canvas = canvas
+        self.view_lft = view_lft
+        self.view_top = view_top
+        self.view_wid = view_wid
+        self.view_hgt = view_hgt
+        # Canvas coordinates are the model's multiplied by the zoom factor.
+        self.zoom = 1.0
         curr_border_weight = style.get( "Border Weight", BRD_WEIGHT_THN )
         self.set_border_thickness( curr_border_weight )
 
@@ -685,46 +875,128 @@ class sm_layout( tk.Frame ):
         # Since we can't alter a dictionary during iteration, we create a new copy, and use that subsequently.
         self.model = dict( model )
 
+        # Registry of the canvas items drawn for each state and transition, so that
+        # edits can reshape existing items rather than repainting everything.
+        self.state_items = {}
+        self.transition_items = {}
+        self.changed_transitions = set()
+        self.paint_states = []
+        self.paint_transitions = []
+
+        # Held while the indexes or the states are changed, so that routing on
+        # a background thread always sees a consistent picture.
+        self.route_lock = threading.RLock()
+        self.pending_routes = []
+
+        # Functions to call, with no arguments, after each edit to the model.
+        self.change_listeners = []
+        # The edits made, as deltas which can be undone and redone.
+        self.undo_log = sm_undo.sm_undo_log()
+        # For each edit in progress, the transitions it has rerouted, as
+        # key -> the points before, see recording_edit().
+        self.path_journals = []
+
+        # The grey outline shown while a state is dragged or resized, and the
+        # latest mouse motion waiting to be handled, as ( handler, event, time ).
+        self.ghost_item = None
+        self.pending_motion = None
+
+        # The state and transition highlighted, see set_highlight(), and the
+        # state whose items show it, which may be a collapsed composite.
+        self.highlight_state = None
+        self.highlight_transition = None
+        self.highlight_shown = None
+        self.motion_job = False
+        self.idle_jobs = []
+        # Seconds from each motion event's arrival to its outline being moved.
+        self.motion_latencies = collections.deque( maxlen = MOTION_LATENCY_SAMPLES )
+
+        # The layout of the states and the transition paths are moved out of the
+        # model into this store, and only put back by export_model().
+        self.geometry = sm_geometry.sm_geometry_store()
+        self.router = sm_router.sm_orthogonal_router( ROUTE_BEND_COST, ROUTE_SEARCH_WEIGHT, ROUTE_MAX_NODES )
+
         # Resolve any layout issues for each state.
         self.state_widgets = []
-        states = model.get( HSM_RSVD_STATES, {} )
-        for state_name, state in states.items():
+        self.widgets_by_name = {}
+        self.spatial_index = sm_index.sm_spatial_index( GRID_PIX * INDEX_CELL_GRIDS )
+        # The bounding boxes of the paths, to find the transitions in view.
+        self.path_index = sm_index.sm_spatial_index( GRID_PIX * INDEX_CELL_GRIDS )
+        self.transition_index = sm_index.sm_transition_index()
+
+        # Composite states, i.e. those with substates of their own. Only the
+        # substates of expanded composites have widgets, see expand_state().
+        # State name -> True if expanded.
+        self.expanded = {}
+        # State name -> the composite it is directly inside, for states with widgets.
+        self.owners = {}
+        # Collapsed composite -> ( lft, top, rgt, btm ) around it and everything inside it.
+        self.subtree_bboxes = {}
+        # State name -> the collapsed composite hiding it, built when first needed.
+        self.hidden_owners = None
+
+        # A model without any layout, e.g. one generated by a tool, is laid out
+        # automatically, rather than every state being put in the same place.
+        auto_layout = get_auto_layout()
+        if self.model.get( HSM_RSVD_STATES ) and auto_layout.is_unlaid( self.model ):
+            auto_layout.layout( self.model )
+            global have_changes
+            have_changes = True
+
+        self.instantiate_states( self.model.get( HSM_RSVD_STATES, {} ), None, route_missing )
+        if subtree_bboxes:
+            for ( state_name, bbox ) in subtree_bboxes.items():
+                if self.expanded.get( state_name ) is False:
+                    self.subtree_bboxes[ state_name ] = tuple( bbox )
+        #print( f"Out model:" )
+        #print( json.dumps( self.model, indent = 2 ) )
+
+    # Creates the widgets for a set of peer states, i.e. the top level of the
+    # model or the substates of a composite, then loads or routes the paths of
+    # the transitions leaving them. Returns the new widgets.
+    def instantiate_states( self, states: dict, owner_name: str, route_missing: bool ) -> list:
+        created = []
+        for state_name, state in list( states.items() ):
+            if state_name in self.widgets_by_name:
+                print( f"WARN: The state name \"{state_name}\" is used more than once, only the first is shown." )
+                continue
             state_outline = sm_state_outline( state )
             if state == {}:
                 # State had no layout info, use a default.
                 state = {'layout': {'x': state_outline.lft, 'y': state_outline.top, 'w': state_outline.wid, 'h': state_outline.hgt }}
             #print( f"state {state_name} = {json.dumps( state, indent = 2 )}." )
-            self.model[ HSM_RSVD_STATES ][ state_name ] = state
+            states[ state_name ] = state
             #print( f"{state_name} @ {state_outline.lft},{state_outline.top}-{state_outline.wid}x{state_outline.hgt}." )
 
-            if state_name == HSM_RSVD_START or state_name == HSM_RSVD_FINAL:
-                new_widget = sm_start_final_state_layout( self, state_name, state )
-                self.state_widgets.append( new_widget )
-            else:
-                new_widget = sm_state_layout( self, state_name, state )
-                self.state_widgets.append( new_widget )
+            created.append( self.create_state_widget( state_name, state, owner_name ) )
 
+        # With every state indexed, the transitions can be routed around them.
+        for key in self.geometry.load_paths( { widget.name: widget.model for widget in created }, HSM_RSVD_PATH, HSM_RSVD_TRAN ):
+            self.index_path( key )
+        for widget in created:
+            ( state_name, state ) = ( widget.name, widget.model )
             # Ensure we have at least a default layout for each transition.
             #print( f" {state_name} - {state}" )
             if state.get( HSM_RSVD_TRAN ):
                 transitions = dict( state.get( HSM_RSVD_TRAN ) )
                 #print( f"  tr = { transitions }" )
                 for transition_name, transition in transitions.items():
-                    path = transition.get( HSM_RSVD_PATH )
-                    if path is None:
+                    if transition.get( HSM_RSVD_DEST ):
+                        self.transition_index.add_transition( state_name, transition_name, transition[ HSM_RSVD_DEST ] )
+                    if not self.geometry.has_path( ( state_name, transition_name ) ):
                         #print( f"1. {state_name} - {state}" )
                         dst_state_name = transition.get( HSM_RSVD_DEST )
-                        if dst_state_name:
-                            dst_state = model[ HSM_RSVD_STATES ][ dst_state_name ]
-                            path = self.find_default_path( state, transition, dst_state )
-                            self.model[ HSM_RSVD_STATES ][ state_name ][ HSM_RSVD_TRAN ][ transition_name ][ HSM_RSVD_PATH ] = path
+                        if dst_state_name and not route_missing:
+                            self.pending_routes.append( ( state_name, transition_name ) )
+                        elif dst_state_name:
+                            path = self.find_default_path( state_name, transition, dst_state_name )
+                            self.set_transition_path( ( state_name, transition_name ), path )
                             global have_changes
                             have_changes = True
                         else:
                             print( f"Transition missing destination { transition_name }: { transition }" )
                             assert( False )
-        #print( f"Out model:" )
-        #print( json.dumps( self.model, indent = 2 ) )
+        return created
 
     def set_border_thickness( self, weight: int ):
         if hasattr( self, "state_widgets" ):
@@ -743,10 +1015,170 @@ class sm_layout( tk.Frame ):
             self.line_size = THK_LINE_SIZE
             self.crnr_size = THK_CRNR_SIZE
 
+    # Creates the layout widget for a state and adds it to the spatial index.
+    # owner_name is the composite state it is inside, if any.
+    def create_state_widget( self, state_name: str, state: dict, owner_name: str = None ) -> object:
+        self.owners[ state_name ] = owner_name
+        if state.get( HSM_RSVD_STATES ):
+            self.expanded[ state_name ] = False
+        if state_name == HSM_RSVD_START or state_name == HSM_RSVD_FINAL:
+            new_widget = sm_start_final_state_layout( self, state_name, state )
+        else:
+            new_widget = sm_state_layout( self, state_name, state )
+        self.state_widgets.append( new_widget )
+        self.widgets_by_name[ state_name ] = new_widget
+        self.index_state( new_widget )
+        # The widget has moved the layout into the geometry store.
+        state.pop( HSM_RSVD_LYOUT, None )
+        return new_widget
+
+    # Returns the model in its JSON dict form, with the current layout and
+    # transition paths included. The live model is left as it is.
+    def export_model( self ) -> dict:
+        return self.geometry.export_layout( self.model, HSM_RSVD_LYOUT, HSM_RSVD_PATH, HSM_RSVD_STATES, HSM_RSVD_TRAN )
+
+    # Returns the current ( lft, top, wid, hgt ) of the named state, or of the
+    # collapsed composite it is hidden in.
+    def get_state_rect( self, state_name: str ) -> tuple:
+        return self.geometry.get_rect( self.geometry.get_id( self.get_shown_state( state_name ) ) )
+
+    # Returns the name of the state itself if it has a widget, or that of the
+    # collapsed composite hiding it, or None if there is no such state.
+    def get_shown_state( self, state_name: str ) -> str:
+        if state_name in self.widgets_by_name:
+            return state_name
+        return self.get_hidden_owners().get( state_name )
+
+    def get_hidden_owners( self ) -> dict:
+        if self.hidden_owners is None:
+            hidden_owners = {}
+            for composite_name, expanded in self.expanded.items():
+                if not expanded:
+                    for ( sub_name, sub_state ) in iter_substates( self.widgets_by_name[ composite_name ].model ):
+                        hidden_owners.setdefault( sub_name, composite_name )
+            self.hidden_owners = hidden_owners
+        return self.hidden_owners
+
+    # Yields ( name, state ) for every state hidden inside a collapsed composite.
+    def iter_hidden_states( self ):
+        for composite_name, expanded in list( self.expanded.items() ):
+            if not expanded:
+                yield from iter_substates( self.widgets_by_name[ composite_name ].model )
+
+    # Returns the model dict of a state with a widget.
+    def get_state_dict( self, state_name: str ) -> dict:
+        return self.widgets_by_name[ state_name ].model
+
+    # Returns the dict of states the named state is in, i.e. its peers.
+    def get_peer_states( self, state_name: str ) -> dict:
+        owner_name = self.owners.get( state_name )
+        if owner_name is None:
+            return self.model.setdefault( HSM_RSVD_STATES, {} )
+        return self.get_state_dict( owner_name )[ HSM_RSVD_STATES ]
+
+    # Returns the composites the named state is inside, innermost first.
+    def get_owner_chain( self, state_name: str ) -> list:
+        chain = []
+        owner_name = self.owners.get( state_name )
+        while owner_name is not None:
+            chain.append( owner_name )
+            owner_name = self.owners.get( owner_name )
+        return chain
+
+    # Expands the collapsed composites hiding the named state, if any.
+    def reveal_state( self, state_name: str ) -> None:
+        while state_name not in self.widgets_by_name:
+            owner_name = self.get_hidden_owners().get( state_name )
+            if owner_name is None:
+                return
+            self.expand_state( owner_name )
+
+    # Returns ( lft, top, rgt, btm ) around a collapsed composite and all the
+    # states hidden inside it. This is cached until the composite next changes.
+    def get_subtree_bbox( self, state_name: str ) -> tuple:
+        bbox = self.subtree_bboxes.get( state_name )
+        if bbox is None:
+            ( lft, top, wid, hgt ) = self.get_state_rect( state_name )
+            ( rgt, btm ) = ( lft + wid, top + hgt )
+            for ( sub_name, sub_state ) in iter_substates( self.get_state_dict( state_name ) ):
+                outline = sm_state_outline( sub_state )
+                lft = min( lft, outline.lft )
+                top = min( top, outline.top )
+                rgt = max( rgt, outline.lft + outline.wid )
+                btm = max( btm, outline.top + outline.hgt )
+            bbox = ( lft, top, rgt, btm )
+            self.subtree_bboxes[ state_name ] = bbox
+        return bbox
+
+    # Returns { composite name: ( lft, top, rgt, btm ) } around each collapsed
+    # composite and the states hidden inside it, see get_subtree_bbox().
+    def get_subtree_bboxes( self ) -> dict:
+        return { state_name: self.get_subtree_bbox( state_name ) for state_name, expanded in self.expanded.items() if not expanded }
+
+    # Returns the ( lft, top, rgt, btm ) around every state, including those
+    # hidden in collapsed composites, or None if there are no states.
+    def get_extents( self ) -> tuple:
+        extents = self.geometry.get_extents()
+        if extents is None:
+            return None
+        ( lft, top, rgt, btm ) = extents
+        for composite_name, expanded in self.expanded.items():
+            if not expanded:
+                bbox = self.get_subtree_bbox( composite_name )
+                ( lft, top ) = ( min( lft, bbox[ 0 ] ), min( top, bbox[ 1 ] ) )
+                ( rgt, btm ) = ( max( rgt, bbox[ 2 ] ), max( btm, bbox[ 3 ] ) )
+        return ( lft, top, rgt, btm )
+
+    def add_change_listener( self, listener ) -> None:
+        self.change_listeners.append( listener )
+
+    # Tell the listeners that an edit to the model has been completed.
+    def notify_change( self ) -> None:
+        for listener in self.change_listeners:
+            listener()
+
+    def get_state_widget( self, state_name: str ) -> object:
+        return self.widgets_by_name.get( state_name )
+
+    # Keep the spatial index in step with a state widget's current rectangle.
+    def index_state( self, widget: object ) -> None:
+        with self.route_lock:
+            geom = widget.geom
+            self.spatial_index.update( widget.name, geom.x, geom.y, geom.w, geom.h )
+            self.subtree_bboxes.pop( widget.name, None )
+
+    # Stores a transition's path and keeps the path index in step with it.
+    def set_transition_path( self, key: tuple, path: list ) -> None:
+        if self.path_journals and key not in self.path_journals[ -1 ]:
+            self.path_journals[ -1 ][ key ] = self.geometry.get_points( key )
+        self.geometry.set_path( key, path )
+        self.index_path( key )
+
+    def index_path( self, key: tuple ) -> None:
+        points = self.geometry.get_transition_view( key ).get_points()
+        if not points:
+            self.path_index.remove( key )
+            return
+        ( lft, top ) = ( min( points[ 0::2 ] ), min( points[ 1::2 ] ) )
+        ( rgt, btm ) = ( max( points[ 0::2 ] ), max( points[ 1::2 ] ) )
+        self.path_index.update( key, lft, top, rgt - lft, btm - top )
+
     # This method checks a path against the current positions of the states, and
     # if there are any transition line segments passing through another state,
     # new segments are added such that the path goes around.
-    def find_clean_path( self, path: list ) -> list:
+    # States named in ignore, e.g. the composites around the ends of the path,
+    # are not routed around.
+    @timing_registry.timed
+    def find_clean_path( self, path: list, ignore: list = () ) -> list:
+        if sm_geometry.have_vector_kernel():
+            candidates = {}
+            for point_idx in range( len( path ) - 1 ):
+                for state_name in self.spatial_index.query_segment( path[ point_idx ], path[ point_idx + 1 ] ):
+                    if state_name not in ignore:
+                        candidates[ state_name ] = None
+            if len( candidates ) >= VECTOR_MIN_RECTS:
+                return self.find_clean_path_batched( path, sorted( candidates, key = self.spatial_index.order.get ) )
+
         clean_path = []
         for point_idx in range( len( path ) - 1 ):
             # Check the path against each state machine.
@@ -754,9 +1186,12 @@ class sm_layout( tk.Frame ):
             A = path[ point_idx ]
             clean_path.append( A )
             B = path[ point_idx + 1 ]
-            for state_name, state in self.model.get( HSM_RSVD_STATES, {} ).items():
-                #print( f"{state_name} = {json.dumps( state, indent = 2 )}" )
-                state_outline = sm_state_outline( state ).get_path()
+            # Only the states overlapping the segment's bounding box can be crossed by it.
+            for state_name in self.spatial_index.query_segment( A, B ):
+                if state_name in ignore:
+                    continue
+                ( x1, y1, x2, y2 ) = self.spatial_index.get_rect( state_name )
+                state_outline = [ {'x': x1, 'y': y1}, {'x': x2, 'y': y1}, {'x': x2, 'y': y2}, {'x': x1, 'y': y2}, {'x': x1, 'y': y1} ]
                 intersections = []
                 for state_corner_idx in range( len( state_outline ) - 1 ):
                     # Points C and D will be an edge on the state outline.
@@ -776,7 +1211,7 @@ class sm_layout( tk.Frame ):
                         # and add a point. Send it to the most appropriate corner.
                         # Compute the perpendicular between the path line and the
                         # center of the state.
-                        vector = sm_state_outline( state ).get_perpendicular( A, B )
+                        vector = sm_state_outline( rect = ( x1, y1, x2 - x1, y2 - y1 ) ).get_perpendicular( A, B )
                         
                         # Arbitrarily selecting E to be A or B depending on which is left-most.
                         E = A
@@ -814,15 +1249,57 @@ class sm_layout( tk.Frame ):
         clean_path.append( path[ -1 ] )
         return clean_path
 
+    # This method is for internal use only. Call find_clean_path() instead.
+    # Does the same as the scalar loop in find_clean_path(), but tests every
+    # segment of the path against the edges of all the candidate states in a
+    # single kernel call. A state outside a segment's bounding box can't be
+    # properly crossed by it, so the candidates may be shared by all segments.
+    def find_clean_path_batched( self, path: list, candidates: list ) -> list:
+        segments = []
+        for point_idx in range( len( path ) - 1 ):
+            ( A, B ) = ( path[ point_idx ], path[ point_idx + 1 ] )
+            segments.append( ( A[ 'x' ], A[ 'y' ], B[ 'x' ], B[ 'y' ] ) )
+        rects = [ self.spatial_index.get_rect( state_name ) for state_name in candidates ]
+        ( mask, points ) = sm_geometry.intersect_segments_rects( segments, rects )
+        crossings = sm_geometry.get_crossings( mask )
+
+        clean_path = []
+        crossing_idx = 0
+        for point_idx in range( len( path ) - 1 ):
+            A = path[ point_idx ]
+            B = path[ point_idx + 1 ]
+            clean_path.append( A )
+            while crossing_idx < len( crossings ) and crossings[ crossing_idx ][ 0 ] == point_idx:
+                ( x1, y1, x2, y2 ) = rects[ crossings[ crossing_idx ][ 1 ] ]
+                crossing_idx += 1
+                # Push the line away based on quadrant, as find_clean_path() does.
+                vector = sm_state_outline( rect = ( x1, y1, x2 - x1, y2 - y1 ) ).get_perpendicular( A, B )
+                E = A
+                F = B
+                if B[ 'x' ] < A[ 'x' ]:
+                    E = B
+                    F = A
+                theta = vector[ 'pha' ]
+                if theta >= -90 and theta < 90:
+                    clean_path.append( { 'x': F['x'], 'y': E['y'] } )
+                else:
+                    clean_path.append( { 'x': E['x'], 'y': F['y'] } )
+
+        clean_path.append( path[ -1 ] )
+        return clean_path
+
     # This just gives the simplest default path.
     #   Find x and y mid-points on each state.
     #   Pick the shortest pair of midpoints for the first and last points in the path.
-    def find_default_path( self, src_state: dict, transition: dict, dst_state: dict ) -> list:
+    # A transition into a state hidden in a collapsed composite is routed to the composite.
+    @timing_registry.timed
+    def find_default_path( self, src_name: str, transition: dict, dst_name: str ) -> list:
         path = []
+        dst_name = self.get_shown_state( dst_name )
         
         # Get the outlines of the states.
-        from_outline = sm_state_outline( src_state ).get_path()
-        to_outline = sm_state_outline( dst_state ).get_path()
+        from_outline = sm_state_outline( rect = self.get_state_rect( src_name ) ).get_path()
+        to_outline = sm_state_outline( rect = self.get_state_rect( dst_name ) ).get_path()
         
         from_midpoints = []
         to_midpoints = []
@@ -835,7 +1312,7 @@ class sm_layout( tk.Frame ):
             y = int( ( to_outline[ corner_idx ]['y'] + to_outline[ corner_idx + 1 ]['y'] ) / 2 )
             to_midpoints.append( {'x': x, 'y': y} )
 
-        if src_state == dst_state:
+        if src_name == dst_name:
             # Special case, a transition to self.
             # Construct a loop on the right side.
             side_idx = 1
@@ -845,111 +1322,966 @@ class sm_layout( tk.Frame ):
               {'x': from_midpoints[ side_idx ]['x'] + box_size, 'y': from_midpoints[ side_idx ]['y'] + box_size },
               {'x': from_midpoints[ side_idx ]['x'],            'y': from_midpoints[ side_idx ]['y'] + box_size } ]
         else:
-            # Compute distance between each from_midpoint and each to_midpoint, and find the min.
-            from_idx = 0
-            min_found = float( 'inf' )
-            for from_midpoint in from_midpoints:
-                for to_midpoint in to_midpoints:
-                    x_delt = to_midpoint['x'] - from_midpoint['x']
-                    y_delt = to_midpoint['y'] - from_midpoint['y']
-                    dist = ( x_delt * x_delt + y_delt * y_delt )
-                    if dist < min_found:
-                        min_found = dist
-                        path = [ from_midpoint, to_midpoint ]
-                    from_idx += 1
-                    
-            # If any path segment intersects (passes through) a state, add a point such that
-            # the path routes around it.
-            path = self.find_clean_path( path )
+            ignore = self.get_owner_chain( src_name ) + self.get_owner_chain( dst_name )
+            path = self.find_routed_path( src_name, dst_name, from_midpoints, to_midpoints, ignore )
 
         return path
 
+    # Routes a transition on the GRID_PIX / 2 lattice from any side of the
+    # source state to any side of the destination, around the states between
+    # them other than those in ignore. If no route was found in the corridors
+    # searched, or there are too many states in them, falls back to
+    # find_fallback_path(). Both kinds of path are kept in route_cache, keyed
+    # by the end points and the states around them.
+    def find_routed_path( self, src_name: str, dst_name: str, from_midpoints: list, to_midpoints: list, ignore: list ) -> list:
+        starts = [ ( point[ 'x' ], point[ 'y' ], SIDE_DIRECTIONS[ idx ] ) for idx, point in enumerate( from_midpoints ) ]
+        goals = [ ( point[ 'x' ], point[ 'y' ], ( SIDE_DIRECTIONS[ idx ] + 2 ) % 4 ) for idx, point in enumerate( to_midpoints ) ]
+        ends_x = [ point[ 'x' ] for point in from_midpoints + to_midpoints ]
+        ends_y = [ point[ 'y' ] for point in from_midpoints + to_midpoints ]
+        for corridor_pix in ( ROUTE_CORRIDOR_PIX, ROUTE_CORRIDOR_PIX * ROUTE_CORRIDOR_WIDEN ):
+            corridor = ( min( ends_x ) - corridor_pix, min( ends_y ) - corridor_pix, max( ends_x ) + corridor_pix, max( ends_y ) + corridor_pix )
+            state_names = self.spatial_index.query_rect( *corridor )
+            obstacles = []
+            for state_name in state_names:
+                if state_name in ignore:
+                    continue
+                ( lft, top, rgt, btm ) = self.spatial_index.get_rect( state_name )
+                if state_name != src_name and state_name != dst_name:
+                    ( lft, top, rgt, btm ) = ( lft - ROUTE_CLEARANCE_PIX, top - ROUTE_CLEARANCE_PIX, rgt + ROUTE_CLEARANCE_PIX, btm + ROUTE_CLEARANCE_PIX )
+                obstacles.append( ( lft, top, rgt, btm ) )
+            key = route_cache.get_key( starts, goals, obstacles, corridor )
+            if len( state_names ) > ROUTE_MAX_OBSTACLES:
+                # Too many states to route around.
+                break
+            cached = route_cache.get( key )
+            if cached is None:
+                points = self.router.route( starts, goals, obstacles, corridor )
+                cached = ( points, self.router.gave_up )
+                route_cache.put( key, cached )
+            ( points, gave_up ) = cached
+            if points is not None and len( points ) > 1:
+                return [ { 'x': x, 'y': y } for ( x, y ) in points ]
+            if gave_up:
+                # A wider search would only take longer.
+                break
+
+        # The fallback only depends on the states between the end points, all
+        # of which are in the corridor last searched, so its key covers them.
+        fallback_key = ( "fallback", ) + key
+        points = route_cache.get( fallback_key )
+        if points is None:
+            points = tuple( ( point[ 'x' ], point[ 'y' ] ) for point in self.find_fallback_path( from_midpoints, to_midpoints, ignore ) )
+            route_cache.put( fallback_key, points )
+        return [ { 'x': x, 'y': y } for ( x, y ) in points ]
+
+    # This method is for internal use only. Call find_routed_path() instead.
+    # Returns the straight line between the nearest pair of midpoints, with
+    # points added to take it around any states it crosses.
+    def find_fallback_path( self, from_midpoints: list, to_midpoints: list, ignore: list ) -> list:
+        # Compute distance between each from_midpoint and each to_midpoint, and find the min.
+        path = []
+        min_found = float( 'inf' )
+        for from_midpoint in from_midpoints:
+            for to_midpoint in to_midpoints:
+                x_delt = to_midpoint['x'] - from_midpoint['x']
+                y_delt = to_midpoint['y'] - from_midpoint['y']
+                dist = ( x_delt * x_delt + y_delt * y_delt )
+                if dist < min_found:
+                    min_found = dist
+                    path = [ from_midpoint, to_midpoint ]
+
+        # If any path segment intersects (passes through) a state, add a point such that
+        # the path routes around it. The composites around either end are crossed anyway.
+        return self.find_clean_path( path, ignore )
+
+    # Repaints the whole view from scratch. After an edit, use paint_changes()
+    # instead, which only touches the canvas items of what was changed.
+    @timing_registry.timed
     def paint( self ):
+        self.paint_begin()
+        self.paint_batch( 0, self.get_paint_count() )
+
+    # Blanks out the canvas and lists the states and transitions in view,
+    # ready to be painted by paint_batch().
+    def paint_begin( self ):
         # Blank out the canvas.
         self.canvas.delete( "all" )
-        self.update_idletasks()
-
-        # Size paint area to the current app window size.
-        canv_wid = self.winfo_width()
-        canv_hgt = self.winfo_height()
-        size_rect = self.canvas.create_rectangle(
-            0, 0, canv_wid, canv_hgt, width = 0, fill = "white" )
-            #, activeoutline = "#EEEEEE", activefill = "#EEEEEE" )
-        #canv_wid -= 1
-        #canv_hgt -= 1
-        #self.canvas.create_line( 0, 0, canv_wid, canv_hgt, width = self.line_size, arrow = "last" )
-        #self.canvas.create_line( canv_wid, 0, 0, canv_hgt, width = self.line_size, arrow = "last" )
-
-        for state in self.state_widgets:
+        self.state_items = {}
+        self.transition_items = {}
+        self.changed_transitions = set()
+        self.ghost_item = None
+
+        view_rect = self.get_view_rect()
+        self.paint_states = [ self.widgets_by_name[ state_name ] for state_name in self.spatial_index.query_rect( *view_rect ) ]
+        self.paint_transitions = self.path_index.query_rect( *view_rect )
+
+    # The number of states and transitions listed by paint_begin().
+    def get_paint_count( self ) -> int:
+        return len( self.paint_states ) + len( self.paint_transitions )
+
+    # Paints up to count of the states and then transitions listed by
+    # paint_begin(), starting at index first. Returns the index to continue from.
+    def paint_batch( self, first: int, count: int ) -> int:
+        last = min( first + count, self.get_paint_count() )
+        for idx in range( first, last ):
+            if idx >= len( self.paint_states ):
+                self.paint_transition( *self.paint_transitions[ idx - len( self.paint_states ) ] )
+                continue
+
             # Paint each state.
+            state = self.paint_states[ idx ]
             state.paint()
         
-            # Then add the transitions.
             #print( f"state.model={state.model}" )
             if state.name == HSM_RSVD_FINAL:
                 # The final state can have no transitions out of it.
                 assert( HSM_RSVD_TRAN not in state.model )
-            else:
-                # General case.
-                # Get the transition info.
+            elif state.name == HSM_RSVD_START:
                 transitions = state.model.get( HSM_RSVD_TRAN )
                 if transitions:
-                    for transition_name, transition in transitions.items():
-                        if state.name == HSM_RSVD_START:
-                            assert( len( transitions ) == 1 )
-                            assert( HSM_RSVD_AUTO in transitions )
-                        #print( f"tr paint = {transition}" )
-                        # See if a path is provided.
-                        path = transition.get( HSM_RSVD_PATH )
-                        for point_idx in range( len( path ) - 1 ):
-                            src_pt = path[ point_idx + 0 ]
-                            dst_pt = path[ point_idx + 1 ]
-                            # Regular line segment, vs add arrow to final line segment.
-                            arrow = "none"
-                            if point_idx == len( path ) - 2:
-                                arrow = "last"
-                            #print( f'paint sf = {src_pt[ "x" ]}, {src_pt[ "y" ]}, {dst_pt[ "x" ]}, {dst_pt[ "y" ]}, {self.line_size}, {arrow}' )
-                            self.canvas.create_line(
-                                src_pt[ "x" ], src_pt[ "y" ], 
-                                dst_pt[ "x" ], dst_pt[ "y" ], 
-                                width = self.line_size, arrow = arrow )
-
-    # This method is for internal use only to facilitate a recursive tree traversal.
-    # Call reroute_paths() instead.
-    def reroute_changed_paths( self, model: dict ) -> dict:
-        changed_model = dict( model )
-        #print( json.dumps( model, indent = 2 ) )
-
-        # Check the states at the top level of the model.
-        states = model.get( HSM_RSVD_STATES, {} )
-        if states:
-            for state_name, state in states.items():
-                
-                # Does this state have the changed_state as a destination?
-                #print( f"Checking... {state_name}   against   {self.changed_state.name}" )
-                if state.get( HSM_RSVD_TRAN ):
-                    transitions = dict( state.get( HSM_RSVD_TRAN ) )
-                    for transition_name, transition in transitions.items():
-                        path = transition.get( HSM_RSVD_PATH )
-                        if path is not None:
-                            dst_state_name = transition.get( HSM_RSVD_DEST )
-                            if dst_state_name:
-                                if dst_state_name == self.changed_state.name:
-                                    dst_state = model[ HSM_RSVD_STATES ][ dst_state_name ]
-                                    #print( f"Need to change path from {state_name} to {self.changed_state.name}" )
-                                    path = self.find_default_path( state, transition, dst_state )
-                                    changed_model[ HSM_RSVD_STATES ][ state_name ][ HSM_RSVD_TRAN ][ transition_name ][ HSM_RSVD_PATH ] = path
-                            else:
-                                print( f"Transition missing destination { transition_name }: { transition }" )
-                                assert( False )
-            changed_model[ HSM_RSVD_STATES ][ state_name ] = state
-            
-        return changed_model
+                    assert( len( transitions ) == 1 )
+                    assert( HSM_RSVD_AUTO in transitions )
+        self.show_highlight()
+        return last
+
+    # Returns the ( lft, top, rgt, btm ) of the visible area plus the margin,
+    # in model coordinates.
+    def get_view_rect( self ) -> tuple:
+        return ( ( self.view_lft - VIEW_MARGIN_PIX ) / self.zoom, ( self.view_top - VIEW_MARGIN_PIX ) / self.zoom,
+                 ( self.view_lft + self.view_wid + VIEW_MARGIN_PIX ) / self.zoom, ( self.view_top + self.view_hgt + VIEW_MARGIN_PIX ) / self.zoom )
+
+    def is_rect_in_view( self, rect: tuple ) -> bool:
+        if rect is None:
+            return False
+        ( lft, top, rgt, btm ) = rect
+        ( view_lft, view_top, view_rgt, view_btm ) = self.get_view_rect()
+        return lft <= view_rgt and view_lft <= rgt and top <= view_btm and view_top <= btm
+
+    # Converts a flat sequence of model coordinates to canvas coordinates.
+    def to_canvas( self, coords ) -> list:
+        zoom = self.zoom
+        if zoom == 1.0:
+            return list( coords )
+        return [ value * zoom for value in coords ]
+
+    # Returns the model coordinates of a mouse event. These are only relative,
+    # i.e. good for working out how far the mouse has moved.
+    def get_event_point( self, event ) -> tuple:
+        return ( event.x / self.zoom, event.y / self.zoom )
+
+    # Whether a state of the given size is drawn in full at the current zoom.
+    def is_detailed( self, wid: int, hgt: int ) -> bool:
+        return min( wid, hgt ) * self.zoom >= LOD_DETAIL_PIX
+
+    # Zooms to the given factor, keeping the model point under the view
+    # position ( anchor_x, anchor_y ), e.g. the mouse, where it is. The items on
+    # the canvas are all rescaled by one scale() call; only those of states and
+    # transitions whose level of detail changes are redrawn.
+    def set_zoom( self, zoom: float, anchor_x: int = 0, anchor_y: int = 0 ) -> None:
+        zoom = min( max( zoom, MIN_ZOOM ), MAX_ZOOM )
+        factor = zoom / self.zoom
+        if factor == 1.0:
+            return
+        prev_zoom = self.zoom
+        self.zoom = zoom
+        self.canvas.scale( "all", 0, 0, factor, factor )
+        self.scroll_view_to( ( self.view_lft + anchor_x ) * factor - anchor_x, ( self.view_top + anchor_y ) * factor - anchor_y )
+
+        for state_name in list( self.state_items ):
+            widget = self.widgets_by_name[ state_name ]
+            if type( widget ) == sm_state_layout and widget.detailed != self.is_detailed( widget.geom.w, widget.geom.h ):
+                widget.paint()
+        if ( prev_zoom < LOD_PATH_ZOOM ) != ( zoom < LOD_PATH_ZOOM ) or zoom < LOD_PATH_ZOOM:
+            for key in list( self.transition_items ):
+                self.canvas.delete( self.transition_items.pop( key ) )
+                self.paint_transition( *key )
+        self.show_highlight()
+
+    def zoom_by( self, factor: float, anchor_x: int = 0, anchor_y: int = 0 ) -> None:
+        self.set_zoom( self.zoom * factor, anchor_x, anchor_y )
+
+    # Scrolls the view so its top left is at the given canvas position.
+    def scroll_view_to( self, lft: float, top: float ) -> None:
+        self.set_view( int( lft ), int( top ), self.view_wid, self.view_hgt )
+
+    # Moves or resizes the visible area, e.g. after scrolling, and brings the
+    # canvas items into line with it.
+    def set_view( self, lft: int, top: int, wid: int, hgt: int ) -> None:
+        ( self.view_lft, self.view_top, self.view_wid, self.view_hgt ) = ( lft, top, wid, hgt )
+        self.update_view()
+
+    # Creates the items for the states and transitions which have come into
+    # view, and deletes those of the ones which have left it. The work depends
+    # on what is near the view, not on the size of the model.
+    def update_view( self ) -> None:
+        view_rect = self.get_view_rect()
+        in_view = self.spatial_index.query_rect( *view_rect )
+        in_view_set = set( in_view )
+        for state_name in [ state_name for state_name in self.state_items if state_name not in in_view_set ]:
+            self.remove_state_items( state_name )
+        for state_name in in_view:
+            if state_name not in self.state_items:
+                self.widgets_by_name[ state_name ].paint()
+
+        in_view = self.path_index.query_rect( *view_rect )
+        in_view_set = set( in_view )
+        for key in [ key for key in self.transition_items if key not in in_view_set ]:
+            self.canvas.delete( self.transition_items.pop( key ) )
+        for key in in_view:
+            if key not in self.transition_items:
+                self.paint_transition( *key )
+        self.show_highlight()
+
+    # Paints a state widget if it is in view, otherwise makes sure it has no items.
+    def paint_state( self, widget: object ) -> None:
+        if self.is_rect_in_view( self.spatial_index.get_rect( widget.name ) ):
+            widget.paint()
+        else:
+            self.remove_state_items( widget.name )
+
+    def remove_state_items( self, state_name: str ) -> None:
+        for item in self.state_items.pop( state_name, [] ):
+            self.canvas.delete( item )
+
+    # Shows the drag outline at the given rectangle, moving the one outline
+    # item rather than creating a new one for each mouse motion.
+    def show_ghost( self, lft: int, top: int, wid: int, hgt: int ) -> None:
+        coords = self.to_canvas( ( lft, top, lft + wid - 1, top + hgt - 1 ) )
+        if self.ghost_item is None:
+            self.ghost_item = self.canvas.create_rectangle( *coords, outline = "#888888" )
+        else:
+            self.canvas.coords( self.ghost_item, *coords )
+
+    def hide_ghost( self ) -> None:
+        if self.ghost_item is not None:
+            self.canvas.delete( self.ghost_item )
+            self.ghost_item = None
+
+    # Calls func( event ) once the pending events have been handled. If more
+    # motion arrives first, only the latest event is passed on, so a flood of
+    # motion costs at most one update per idle period.
+    def queue_motion( self, func, event ) -> None:
+        self.pending_motion = ( func, event, time.perf_counter() )
+        if not self.motion_job:
+            self.motion_job = True
+            self.schedule_idle( self.run_motion )
+
+    # Handles the queued motion event, if any, right away.
+    def flush_motion( self ) -> None:
+        if self.pending_motion is not None:
+            ( func, event, arrived ) = self.pending_motion
+            self.pending_motion = None
+            func( event )
+            self.motion_latencies.append( time.perf_counter() - arrived )
+
+    def run_motion( self ) -> None:
+        self.motion_job = False
+        self.flush_motion()
+
+    # Returns the latencies, in seconds, of the recent motion updates.
+    def get_motion_latencies( self ) -> list:
+        return list( self.motion_latencies )
+
+    # Calls func() when the display is next idle. With no display, the calls
+    # wait until run_idle_jobs().
+    def schedule_idle( self, func ) -> None:
+        self.idle_jobs.append( func )
+
+    def run_idle_jobs( self ) -> None:
+        ( jobs, self.idle_jobs ) = ( self.idle_jobs, [] )
+        for func in jobs:
+            func()
+
+    # Returns ( create_routing_diagram, snapshot ), both picklable, with which
+    # another process can build a diagram whose route_pending() gives the same
+    # paths as this one's. Only the states' geometry and transitions are copied.
+    def get_route_snapshot( self ) -> tuple:
+        with self.route_lock:
+            exported = self.export_model()
+        return ( create_routing_diagram, { HSM_RSVD_STATES: get_geometry_snapshot( exported.get( HSM_RSVD_STATES, {} ) ) } )
+
+    # Stores paths routed in the background, given as ( ( state name, transition
+    # name ), path ) pairs, and draws them. A transition which has been routed in
+    # the meantime, e.g. because one of its states was moved, keeps its path.
+    def merge_routes( self, routes: list ) -> None:
+        for ( key, path ) in routes:
+            if self.transition_index.get_dest( *key ) is None or self.geometry.has_path( key ):
+                continue
+            self.set_transition_path( key, path )
+            self.paint_transition( *key )
+            global have_changes
+            have_changes = True
 
-    def reroute_paths( self, changed_state: object ) -> dict:
+    # Routes a transition listed in pending_routes. This may be called from a
+    # background thread; it returns None if the transition no longer needs a path.
+    def route_pending( self, key: tuple ) -> list:
+        ( state_name, transition_name ) = key
+        with self.route_lock:
+            dst_name = self.transition_index.get_dest( state_name, transition_name )
+            if dst_name is None or self.geometry.has_path( key ):
+                return None
+            if self.get_shown_state( dst_name ) is None:
+                return None
+            transition = self.get_state_dict( state_name )[ HSM_RSVD_TRAN ][ transition_name ]
+            return self.find_default_path( state_name, transition, dst_name )
+
+    # Draws a transition's path as a single polyline with an arrow on the final
+    # segment, or moves the existing polyline onto the current path. A path
+    # outside the view has no item.
+    def paint_transition( self, state_name: str, transition_name: str ):
+        key = ( state_name, transition_name )
+        # See if a path is provided.
+        points = self.geometry.get_transition_view( key ).get_points()
+        if points is None or not self.is_rect_in_view( self.path_index.get_rect( key ) ):
+            points = []
+
+        item = self.transition_items.get( key )
+        if len( points ) < 4:
+            # Not enough points for a line segment.
+            if item is not None:
+                self.canvas.delete( item )
+                del self.transition_items[ key ]
+        elif item is None:
+            self.transition_items[ key ] = self.canvas.create_line(
+                *self.get_path_coords( points ), width = self.line_size, arrow = "last" if self.zoom >= LOD_PATH_ZOOM else "none" )
+        else:
+            self.canvas.coords( item, *self.get_path_coords( points ) )
+
+    # Converts a path's flat points to canvas coordinates. When zoomed out
+    # below LOD_PATH_ZOOM, points which would be drawn within a few pixels of
+    # the previous one are dropped, the end points always being kept.
+    def get_path_coords( self, points ) -> list:
+        coords = self.to_canvas( points )
+        if self.zoom >= LOD_PATH_ZOOM:
+            return coords
+        simple = coords[ 0 : 2 ]
+        for idx in range( 2, len( coords ) - 2, 2 ):
+            if abs( coords[ idx ] - simple[ -2 ] ) >= LOD_SIMPLIFY_PIX or abs( coords[ idx + 1 ] - simple[ -1 ] ) >= LOD_SIMPLIFY_PIX:
+                simple += coords[ idx : idx + 2 ]
+        simple += coords[ -2 : ]
+        return simple
+
+    # Brings the canvas up to date after an edit to the given state widget by
+    # reshaping only its own items and those of the transitions rerouted since
+    # the last paint.
+    def paint_changes( self, changed_widget: object = None ):
+        if changed_widget is not None:
+            self.paint_state( changed_widget )
+
+        for ( state_name, transition_name ) in self.changed_transitions:
+            self.paint_transition( state_name, transition_name )
+        self.changed_transitions = set()
+        self.show_highlight()
+
+    # Highlights the named state, or the collapsed composite it is hidden in,
+    # and the transition with the ( state name, transition name ) key, e.g. the
+    # active state and the transition just taken when simulating, and puts back
+    # the colour of those highlighted before. Either may be None. Only the
+    # colours of the items are changed, nothing is repainted.
+    def set_highlight( self, state_name: str, transition_key: tuple ) -> None:
+        if self.highlight_shown is not None:
+            self.colour_state( self.highlight_shown, DEFAULT_COLOUR )
+            self.highlight_shown = None
+        self.colour_transition( self.highlight_transition, DEFAULT_COLOUR )
+        self.highlight_state = state_name
+        self.highlight_transition = transition_key
+        self.show_highlight()
+
+    # Recolours the highlighted items, as items are always created in the
+    # default colour, e.g. when scrolled into view.
+    def show_highlight( self ) -> None:
+        if self.highlight_state is None and self.highlight_transition is None:
+            return
+        shown = self.get_shown_state( self.highlight_state ) if self.highlight_state is not None else None
+        if shown != self.highlight_shown and self.highlight_shown is not None:
+            self.colour_state( self.highlight_shown, DEFAULT_COLOUR )
+        self.highlight_shown = shown
+        if shown is not None:
+            self.colour_state( shown, ACTIVE_STATE_COLOUR )
+        self.colour_transition( self.highlight_transition, TAKEN_TRAN_COLOUR )
+
+    # This method is for internal use only.
+    def colour_state( self, state_name: str, colour: str ) -> None:
+        widget = self.widgets_by_name.get( state_name )
+        if widget is not None:
+            widget.set_colour( colour )
+
+    # This method is for internal use only.
+    def colour_transition( self, key: tuple, colour: str ) -> None:
+        item = self.transition_items.get( key ) if key is not None else None
+        if item is not None:
+            self.canvas.itemconfigure( item, fill = colour )
+
+    # This method is for internal use only. Call reroute_paths() instead.
+    # Reroutes each transition entering or leaving the named state, using the
+    # transition index to find them rather than walking the whole model.
+    def reroute_changed_paths( self, state_name: str ) -> list:
+        rerouted = self.transition_index.get_connected( state_name )
+        if self.expanded.get( state_name ) is False:
+            # Transitions into the states hidden inside end on this one too.
+            for ( sub_name, sub_state ) in iter_substates( self.get_state_dict( state_name ) ):
+                rerouted += self.transition_index.get_incoming( sub_name )
+        for ( src_name, transition_name ) in rerouted:
+            transition = self.get_state_dict( src_name )[ HSM_RSVD_TRAN ][ transition_name ]
+            dst_name = transition[ HSM_RSVD_DEST ]
+            #print( f"Need to change path from {src_name} to {dst_name}" )
+            path = self.find_default_path( src_name, transition, dst_name )
+            self.set_transition_path( ( src_name, transition_name ), path )
+            self.changed_transitions.add( ( src_name, transition_name ) )
+        return rerouted
+
+    @timing_registry.timed
+    def reroute_paths( self, changed_state: object ) -> list:
         assert( type( changed_state ) == sm_state_layout or type( changed_state ) == sm_start_final_state_layout )
         self.changed_state = changed_state
         #print( f"changed_state = '{self.changed_state.name}'" )
-        #print( json.dumps( self.model, indent = 2 ) )
-        self.model = self.reroute_changed_paths( self.model )
-        #print( json.dumps( self.model, indent = 2 ) )
+        with self.route_lock:
+            return self.reroute_changed_paths( changed_state.name )
+
+    # Moves a state, along with anything inside it, and reroutes only the
+    # transitions into or out of what was moved.
+    def move_state( self, state_name: str, x: int, y: int ) -> None:
+        with self.recording_edit( "Move" ):
+            widget = self.widgets_by_name[ state_name ]
+            ( old_x, old_y ) = ( widget.geom.x, widget.geom.y )
+            if ( x, y ) == ( old_x, old_y ):
+                return
+            self.undo_log.record( "Move", [ ( "move_state", state_name, x, y ) ], [ ( "move_state", state_name, old_x, old_y ) ] )
+            widget.geom.x = x
+            widget.geom.y = y
+            self.index_state( widget )
+            self.move_substates( state_name, widget.geom.x - old_x, widget.geom.y - old_y )
+            self.reroute_paths( widget )
+            self.paint_changes( widget )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+
+    def resize_state( self, state_name: str, wid: int, hgt: int ) -> None:
+        with self.recording_edit( "Resize" ):
+            widget = self.widgets_by_name[ state_name ]
+            ( old_wid, old_hgt ) = ( widget.geom.w, widget.geom.h )
+            if ( wid, hgt ) == ( old_wid, old_hgt ):
+                return
+            self.undo_log.record( "Resize", [ ( "resize_state", state_name, wid, hgt ) ], [ ( "resize_state", state_name, old_wid, old_hgt ) ] )
+            widget.geom.w = wid
+            widget.geom.h = hgt
+            self.index_state( widget )
+            self.reroute_paths( widget )
+            self.paint_changes( widget )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+
+    # Lays out every state afresh, see sm_autolayout, as a single edit.
+    def auto_layout( self ) -> None:
+        with self.recording_edit( "Auto Layout" ):
+            exported = self.export_model()
+            old_rects = []
+            old_paths = []
+            for ( state_name, state ) in iter_substates( exported ):
+                layout = state.get( HSM_RSVD_LYOUT, {} )
+                old_rects.append( ( state_name, layout.get( "x", DEF_STATE_LFT ), layout.get( "y", DEF_STATE_TOP ), layout.get( "w", DEF_STATE_WID ), layout.get( "h", DEF_STATE_HGT ) ) )
+                if self.geometry.get_id( state_name ) is None:
+                    for transition_name, transition in state.get( HSM_RSVD_TRAN, {} ).items():
+                        old_paths.append( ( ( state_name, transition_name ), self.get_flat_points( transition.get( HSM_RSVD_PATH ) ) ) )
+
+            get_auto_layout().layout( exported )
+            new_rects = []
+            new_paths = []
+            routed = []
+            for ( state_name, state ) in iter_substates( exported ):
+                layout = state[ HSM_RSVD_LYOUT ]
+                new_rects.append( ( state_name, layout[ "x" ], layout[ "y" ], layout[ "w" ], layout[ "h" ] ) )
+                for transition_name, transition in state.get( HSM_RSVD_TRAN, {} ).items():
+                    key = ( state_name, transition_name )
+                    if self.geometry.get_id( state_name ) is None:
+                        # Paths inside collapsed composites are kept in their dicts.
+                        new_paths.append( ( key, self.get_flat_points( transition.get( HSM_RSVD_PATH ) ) ) )
+                    else:
+                        routed.append( ( key, transition.get( HSM_RSVD_PATH ) ) )
+
+            self.undo_log.record( "Auto Layout", [ ( "set_state_rects", new_rects ), ( "restore_paths", new_paths ) ],
+                [ ( "set_state_rects", old_rects ), ( "restore_paths", old_paths ) ] )
+            self.set_state_rects( new_rects )
+            self.restore_paths( new_paths )
+            # The states are all in place, so those transitions the layout gave
+            # no path, e.g. those into a composite's substates, can be routed.
+            for ( key, path ) in routed:
+                dst_name = self.transition_index.get_dest( *key )
+                if dst_name is None:
+                    continue
+                if path is None:
+                    transition = self.get_state_dict( key[ 0 ] )[ HSM_RSVD_TRAN ][ key[ 1 ] ]
+                    path = self.find_default_path( key[ 0 ], transition, dst_name )
+                self.set_transition_path( key, path )
+            self.paint()
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+
+    # Returns a path given as a list of { "x", "y" } points as flat x0, y0,
+    # x1, y1, ... points, or None if there is no path.
+    def get_flat_points( self, path: list ) -> list:
+        if path is None:
+            return None
+        return [ value for point in path for value in ( point[ "x" ], point[ "y" ] ) ]
+
+    # Puts states at the ( name, x, y, w, h ) given, without rerouting any
+    # transitions, or moving the substates of the composites with them.
+    def set_state_rects( self, rects: list ) -> None:
+        with self.route_lock:
+            hidden_states = None
+            for ( state_name, x, y, wid, hgt ) in rects:
+                widget = self.widgets_by_name.get( state_name )
+                if widget is None:
+                    if hidden_states is None:
+                        hidden_states = dict( self.iter_hidden_states() )
+                    state = hidden_states.get( state_name )
+                    if state is not None:
+                        state[ HSM_RSVD_LYOUT ] = { "x": x, "y": y, "w": wid, "h": hgt }
+                    continue
+                widget.geom.x = x
+                widget.geom.y = y
+                if isinstance( widget, sm_state_layout ):
+                    widget.geom.w = wid
+                    widget.geom.h = hgt
+                self.index_state( widget )
+            # The boxes around collapsed composites have moved with their substates.
+            self.subtree_bboxes = {}
+            self.paint()
+
+    # Sets the path of a transition to the flat x0, y0, x1, y1, ... points
+    # given, or routes it afresh if there are none.
+    def reroute_transition( self, src_name: str, transition_name: str, points: list = None ) -> None:
+        with self.recording_edit( "Reroute" ):
+            key = ( src_name, transition_name )
+            old_points = self.geometry.get_points( key )
+            if points is None:
+                transition = self.get_state_dict( src_name )[ HSM_RSVD_TRAN ][ transition_name ]
+                self.set_transition_path( key, self.find_default_path( src_name, transition, transition[ HSM_RSVD_DEST ] ) )
+            else:
+                self.geometry.set_points( key, points )
+                self.index_path( key )
+            new_points = self.geometry.get_points( key )
+            if new_points == old_points:
+                return
+            self.undo_log.record( "Reroute", [ ( "reroute_transition", src_name, transition_name, new_points ) ],
+                [ ( "reroute_transition", src_name, transition_name, old_points ) ] )
+            self.paint_transition( src_name, transition_name )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+
+    # Everything done inside this is recorded as one undo entry, including the
+    # exact paths of any transitions rerouted along the way, so that undo and
+    # redo put back the very same paths rather than whatever routing gives.
+    @contextlib.contextmanager
+    def recording_edit( self, label: str ):
+        with self.route_lock:
+            self.undo_log.begin_group( label )
+            self.path_journals.append( {} )
+            try:
+                yield
+            finally:
+                journal = self.path_journals.pop()
+                if self.path_journals:
+                    for key, points in journal.items():
+                        self.path_journals[ -1 ].setdefault( key, points )
+                    self.undo_log.end_group()
+                else:
+                    old_paths = [ ( key, points ) for key, points in journal.items() if points is not None ]
+                    new_paths = [ ( key, self.geometry.get_points( key ) ) for key in journal if self.geometry.has_path( key ) ]
+                    self.undo_log.end_group( [ ( "restore_paths", new_paths ) ], [ ( "restore_paths", old_paths ) ] )
+
+    # Sets the paths given as ( key, flat x0, y0, x1, y1, ... points ) pairs,
+    # skipping any transitions which no longer exist. Points of None remove
+    # the path of a transition inside a collapsed composite.
+    def restore_paths( self, paths: list ) -> None:
+        with self.route_lock:
+            hidden_states = None
+            for ( key, points ) in paths:
+                if self.geometry.get_id( key[ 0 ] ) is None:
+                    # The source is hidden in a collapsed composite, so the path goes in its dict.
+                    if hidden_states is None:
+                        hidden_states = dict( self.iter_hidden_states() )
+                    transition = hidden_states.get( key[ 0 ], {} ).get( HSM_RSVD_TRAN, {} ).get( key[ 1 ] )
+                    if transition is not None and points is None:
+                        transition.pop( HSM_RSVD_PATH, None )
+                    elif transition is not None:
+                        transition[ HSM_RSVD_PATH ] = [ { "x": points[ idx ], "y": points[ idx + 1 ] } for idx in range( 0, len( points ), 2 ) ]
+                    continue
+                if self.transition_index.get_dest( *key ) is None or points is None:
+                    continue
+                self.geometry.set_points( key, points )
+                self.index_path( key )
+                self.changed_transitions.add( key )
+            self.paint_changes()
+
+    # Applies the operations of an undo entry's delta, see sm_undo.
+    def apply_delta( self, delta: list ) -> None:
+        with self.route_lock:
+            self.undo_log.suspend()
+            try:
+                for ( method_name, *args ) in delta:
+                    if method_name in UNDO_REVEAL_OPS:
+                        self.reveal_state( args[ 0 ] )
+                    getattr( self, method_name )( *args )
+            finally:
+                self.undo_log.resume()
+
+    # Undoes the latest edit, returning False if there was none.
+    def undo( self ) -> bool:
+        entry = self.undo_log.pop_undo()
+        if entry is None:
+            return False
+        self.apply_delta( entry.inverse )
+        return True
+
+    def redo( self ) -> bool:
+        entry = self.undo_log.pop_redo()
+        if entry is None:
+            return False
+        self.apply_delta( entry.forward )
+        return True
+
+    # Moves everything inside a composite state by ( move_x, move_y ), after
+    # the composite itself has been moved. Substates with widgets are moved and
+    # their transitions rerouted, while the layouts and paths of hidden ones
+    # are shifted in the model.
+    def move_substates( self, state_name: str, move_x: int, move_y: int ) -> None:
+        with self.route_lock:
+            if state_name not in self.expanded:
+                return
+            state = self.get_state_dict( state_name )
+            if not self.expanded[ state_name ]:
+                self.subtree_bboxes.pop( state_name, None )
+                for ( sub_name, sub_state ) in iter_substates( state ):
+                    layout = sub_state.setdefault( HSM_RSVD_LYOUT, {} )
+                    layout[ "x" ] = layout.get( "x", DEF_STATE_LFT ) + move_x
+                    layout[ "y" ] = layout.get( "y", DEF_STATE_TOP ) + move_y
+                    for transition in sub_state.get( HSM_RSVD_TRAN, {} ).values():
+                        for point in transition.get( HSM_RSVD_PATH, [] ):
+                            point[ "x" ] += move_x
+                            point[ "y" ] += move_y
+                return
+
+            for sub_name in state.get( HSM_RSVD_STATES, {} ):
+                if self.owners.get( sub_name ) != state_name:
+                    continue
+                widget = self.widgets_by_name[ sub_name ]
+                widget.geom.x += move_x
+                widget.geom.y += move_y
+                self.index_state( widget )
+                self.move_substates( sub_name, move_x, move_y )
+                self.reroute_changed_paths( sub_name )
+                self.paint_state( widget )
+
+    def toggle_state( self, state_name: str ) -> None:
+        if self.expanded.get( state_name ):
+            self.collapse_state( state_name )
+        else:
+            self.expand_state( state_name )
+
+    # Gives widgets to the substates of a collapsed composite, routes any of
+    # their transitions without a path, and draws those in view.
+    def expand_state( self, state_name: str ) -> None:
+        with self.route_lock:
+            if self.expanded.get( state_name ) is not False:
+                return
+            widget = self.widgets_by_name[ state_name ]
+            hidden = set( sub_name for ( sub_name, sub_state ) in iter_substates( widget.model ) )
+            self.expanded[ state_name ] = True
+            self.subtree_bboxes.pop( state_name, None )
+            self.hidden_owners = None
+            created = self.instantiate_states( widget.model[ HSM_RSVD_STATES ], state_name, route_missing = True )
+
+            # Transitions from outside which ended on the composite now go to the substates.
+            for sub_name in hidden:
+                for key in self.transition_index.get_incoming( sub_name ):
+                    if key[ 0 ] not in hidden:
+                        transition = self.get_state_dict( key[ 0 ] )[ HSM_RSVD_TRAN ][ key[ 1 ] ]
+                        self.set_transition_path( key, self.find_default_path( key[ 0 ], transition, sub_name ) )
+                        self.changed_transitions.add( key )
+            for sub_widget in created:
+                self.changed_transitions.update( self.transition_index.get_connected( sub_widget.name ) )
+                self.paint_state( sub_widget )
+            self.paint_changes( widget )
+
+    # Drops the widgets of everything inside a composite, writing their layouts
+    # and paths back into the model, so the composite is drawn on its own again.
+    def collapse_state( self, state_name: str ) -> None:
+        with self.route_lock:
+            if not self.expanded.get( state_name ):
+                return
+            released = set()
+            for sub_name in self.get_state_dict( state_name ).get( HSM_RSVD_STATES, {} ):
+                if self.owners.get( sub_name ) != state_name:
+                    continue
+                self.collapse_state( sub_name )
+                self.expanded.pop( sub_name, None )
+                self.subtree_bboxes.pop( sub_name, None )
+                self.release_state_widget( sub_name )
+                released.add( sub_name )
+            self.state_widgets = [ widget for widget in self.state_widgets if widget.name not in released ]
+            self.expanded[ state_name ] = False
+            self.hidden_owners = None
+
+            # Transitions from outside into the substates now end on the composite.
+            self.reroute_changed_paths( state_name )
+            self.paint_changes( self.widgets_by_name[ state_name ] )
+
+    # This method is for internal use only, see collapse_state(). Writes a
+    # state's layout, and the paths of the transitions leaving it, back into
+    # its dict in the model, and drops its widget, items and index entries.
+    def release_state_widget( self, state_name: str ) -> None:
+        widget = self.widgets_by_name.pop( state_name )
+        ( x, y, w, h ) = self.geometry.get_rect( self.geometry.get_id( state_name ) )
+        widget.model[ HSM_RSVD_LYOUT ] = { "x": x, "y": y, "w": w, "h": h }
+        for key in self.transition_index.get_outgoing( state_name ):
+            path = self.geometry.get_path( key )
+            if path is not None:
+                widget.model[ HSM_RSVD_TRAN ][ key[ 1 ] ][ HSM_RSVD_PATH ] = path
+            self.transition_index.remove_transition( *key )
+            self.geometry.remove_path( key )
+            self.path_index.remove( key )
+            self.changed_transitions.discard( key )
+            item = self.transition_items.pop( key, None )
+            if item is not None:
+                self.canvas.delete( item )
+        self.spatial_index.remove( state_name )
+        self.geometry.remove_state( state_name )
+        self.remove_state_items( state_name )
+        del self.owners[ state_name ]
+
+    # Adds a state to the model, with the layout given or a default one. It is
+    # put inside the composite named owner_name if given, which is expanded.
+    def add_state( self, state_name: str, layout: dict = None, owner_name: str = None ) -> object:
+        with self.recording_edit( "Add state" ):
+            assert( state_name not in self.widgets_by_name and state_name not in self.get_hidden_owners() )
+            if owner_name is None:
+                states = self.model.setdefault( HSM_RSVD_STATES, {} )
+            else:
+                self.expand_state( owner_name )
+                states = self.get_state_dict( owner_name ).setdefault( HSM_RSVD_STATES, {} )
+                self.expanded[ owner_name ] = True
+            if layout:
+                state = { HSM_RSVD_LYOUT: dict( layout ) }
+            else:
+                state = { HSM_RSVD_LYOUT: { "x": DEF_STATE_LFT, "y": DEF_STATE_TOP } }
+            states[ state_name ] = state
+            widget = self.create_state_widget( state_name, state, owner_name )
+            self.paint_state( widget )
+            if owner_name is not None:
+                # Update the composite's title.
+                self.paint_state( self.widgets_by_name[ owner_name ] )
+            self.undo_log.record( "Add state", [ ( "add_state", state_name, layout, owner_name ) ], [ ( "delete_state", state_name ) ] )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+            return widget
+
+    # Removes a state from the model along with every transition into or out
+    # of it. For a composite, everything inside it goes too.
+    def delete_state( self, state_name: str ) -> None:
+        with self.recording_edit( "Delete state" ):
+            widget = self.get_state_widget( state_name )
+            assert( widget )
+            deleted = set( [ state_name ] )
+            if state_name in self.expanded:
+                self.collapse_state( state_name )
+                for ( sub_name, sub_state ) in iter_substates( widget.model ):
+                    deleted.add( sub_name )
+                    for ( src_name, transition_name ) in self.transition_index.get_incoming( sub_name ):
+                        self.delete_transition( src_name, transition_name )
+                del self.expanded[ state_name ]
+                self.subtree_bboxes.pop( state_name, None )
+                self.hidden_owners = None
+            for ( src_name, transition_name ) in self.transition_index.get_connected( state_name ):
+                self.delete_transition( src_name, transition_name )
+            # Transitions from states hidden in other composites only exist in the model.
+            for ( hidden_name, hidden_state ) in self.iter_hidden_states():
+                transitions = hidden_state.get( HSM_RSVD_TRAN, {} )
+                for transition_name in [ name for name, transition in transitions.items() if transition.get( HSM_RSVD_DEST ) in deleted ]:
+                    self.undo_log.record( "Delete transition", [],
+                        [ ( "restore_transition", hidden_name, transition_name, copy.deepcopy( transitions[ transition_name ] ), None ) ] )
+                    del transitions[ transition_name ]
+                if HSM_RSVD_TRAN in hidden_state and not transitions:
+                    del hidden_state[ HSM_RSVD_TRAN ]
+
+            # What is needed to put the state back, with everything inside it.
+            peers = self.get_peer_states( state_name )
+            exported = self.geometry.export_states( { state_name: widget.model }, HSM_RSVD_LYOUT, HSM_RSVD_PATH, HSM_RSVD_STATES, HSM_RSVD_TRAN )
+            owner_name = self.owners[ state_name ]
+            self.undo_log.record( "Delete state", [ ( "delete_state", state_name ) ],
+                [ ( "restore_state", state_name, copy.deepcopy( exported[ state_name ] ), owner_name, list( peers ).index( state_name ) ) ] )
+
+            self.state_widgets.remove( widget )
+            del self.widgets_by_name[ state_name ]
+            self.spatial_index.remove( state_name )
+            self.geometry.remove_state( state_name )
+            self.remove_state_items( state_name )
+            del peers[ state_name ]
+            del self.owners[ state_name ]
+            if owner_name is not None:
+                self.paint_state( self.widgets_by_name[ owner_name ] )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+
+    # Puts back a state removed by delete_state(), at the same place among its
+    # peers. state is its dict as it was, layout and all, less the transitions
+    # which were deleted with it.
+    def restore_state( self, state_name: str, state: dict, owner_name: str, position: int ) -> None:
+        with self.recording_edit( "Add state" ):
+            restored = copy.deepcopy( state )
+            if owner_name is None:
+                peers = self.model.setdefault( HSM_RSVD_STATES, {} )
+            else:
+                self.reveal_state( owner_name )
+                self.expand_state( owner_name )
+                peers = self.get_state_dict( owner_name ).setdefault( HSM_RSVD_STATES, {} )
+                self.expanded[ owner_name ] = True
+            restored_peers = list( peers.items() )
+            restored_peers.insert( position, ( state_name, restored ) )
+            peers.clear()
+            peers.update( restored_peers )
+            self.hidden_owners = None
+            for widget in self.instantiate_states( { state_name: restored }, owner_name, route_missing = True ):
+                self.changed_transitions.update( self.transition_index.get_outgoing( widget.name ) )
+                self.paint_changes( widget )
+            if owner_name is not None:
+                self.paint_state( self.widgets_by_name[ owner_name ] )
+            self.undo_log.record( "Add state", [ ( "restore_state", state_name, state, owner_name, position ) ], [ ( "delete_state", state_name ) ] )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+
+    # Renames a state, updating the destinations of the transitions into it.
+    def rename_state( self, old_name: str, new_name: str ) -> None:
+        with self.recording_edit( "Rename state" ):
+            states = self.get_peer_states( old_name )
+            assert( old_name in states and new_name not in self.widgets_by_name and new_name not in self.get_hidden_owners() )
+            connected = self.transition_index.get_connected( old_name )
+            for key in connected:
+                self.changed_transitions.discard( key )
+                item = self.transition_items.pop( key, None )
+                if item is not None:
+                    self.transition_items[ ( new_name if key[ 0 ] == old_name else key[ 0 ], key[ 1 ] ) ] = item
+            self.geometry.rename_state( old_name, new_name )
+            for key in connected:
+                if key[ 0 ] == old_name:
+                    self.path_index.remove( key )
+                    self.index_path( ( new_name, key[ 1 ] ) )
+            for ( src_name, transition_name ) in self.transition_index.get_incoming( old_name ):
+                self.get_state_dict( src_name )[ HSM_RSVD_TRAN ][ transition_name ][ HSM_RSVD_DEST ] = new_name
+            self.transition_index.rename_state( old_name, new_name )
+            for ( hidden_name, hidden_state ) in self.iter_hidden_states():
+                for transition in hidden_state.get( HSM_RSVD_TRAN, {} ).values():
+                    if transition.get( HSM_RSVD_DEST ) == old_name:
+                        transition[ HSM_RSVD_DEST ] = new_name
+
+            # Keep the model's state order while swapping the key.
+            renamed_states = {}
+            for state_name, state in states.items():
+                renamed_states[ new_name if state_name == old_name else state_name ] = state
+            states.clear()
+            states.update( renamed_states )
+
+            widget = self.widgets_by_name.pop( old_name )
+            widget.name = new_name
+            self.widgets_by_name[ new_name ] = widget
+            self.owners[ new_name ] = self.owners.pop( old_name )
+            for sub_name, owner_name in self.owners.items():
+                if owner_name == old_name:
+                    self.owners[ sub_name ] = new_name
+            if old_name in self.expanded:
+                self.expanded[ new_name ] = self.expanded.pop( old_name )
+            self.subtree_bboxes.pop( old_name, None )
+            self.hidden_owners = None
+            self.spatial_index.remove( old_name )
+            self.index_state( widget )
+            if old_name in self.state_items:
+                self.state_items[ new_name ] = self.state_items.pop( old_name )
+            self.paint_state( widget )
+            self.undo_log.record( "Rename state", [ ( "rename_state", old_name, new_name ) ], [ ( "rename_state", new_name, old_name ) ] )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+
+    # Adds a transition between two existing states and routes it.
+    def add_transition( self, src_name: str, transition_name: str, dst_name: str ) -> dict:
+        with self.recording_edit( "Add transition" ):
+            transitions = self.get_state_dict( src_name ).setdefault( HSM_RSVD_TRAN, {} )
+            assert( transition_name not in transitions )
+            transition = { HSM_RSVD_DEST: dst_name }
+            transitions[ transition_name ] = transition
+            self.transition_index.add_transition( src_name, transition_name, dst_name )
+            path = self.find_default_path( src_name, transition, dst_name )
+            self.set_transition_path( ( src_name, transition_name ), path )
+            self.paint_transition( src_name, transition_name )
+            self.undo_log.record( "Add transition", [ ( "add_transition", src_name, transition_name, dst_name ) ],
+                [ ( "delete_transition", src_name, transition_name ) ] )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+            return transition
+
+    def delete_transition( self, src_name: str, transition_name: str ) -> None:
+        with self.recording_edit( "Delete transition" ):
+            src_state = self.get_state_dict( src_name )
+            key = ( src_name, transition_name )
+            self.undo_log.record( "Delete transition", [ ( "delete_transition", src_name, transition_name ) ],
+                [ ( "restore_transition", src_name, transition_name, copy.deepcopy( src_state[ HSM_RSVD_TRAN ][ transition_name ] ), self.geometry.get_points( key ) ) ] )
+            del src_state[ HSM_RSVD_TRAN ][ transition_name ]
+            if not src_state[ HSM_RSVD_TRAN ]:
+                del src_state[ HSM_RSVD_TRAN ]
+            self.transition_index.remove_transition( src_name, transition_name )
+            self.geometry.remove_path( ( src_name, transition_name ) )
+            self.path_index.remove( ( src_name, transition_name ) )
+            self.changed_transitions.discard( ( src_name, transition_name ) )
+            item = self.transition_items.pop( ( src_name, transition_name ), None )
+            if item is not None:
+                self.canvas.delete( item )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
+
+    # Puts back a transition removed by delete_transition(), with its path as
+    # the flat x0, y0, x1, y1, ... points given, or routed afresh if None. The
+    # source may be hidden in a collapsed composite, in which case only its
+    # dict is changed.
+    def restore_transition( self, src_name: str, transition_name: str, transition: dict, points: list ) -> None:
+        with self.recording_edit( "Add transition" ):
+            transition = copy.deepcopy( transition )
+            if src_name not in self.widgets_by_name:
+                for ( hidden_name, hidden_state ) in self.iter_hidden_states():
+                    if hidden_name == src_name:
+                        hidden_state.setdefault( HSM_RSVD_TRAN, {} )[ transition_name ] = transition
+                        break
+            else:
+                self.get_state_dict( src_name ).setdefault( HSM_RSVD_TRAN, {} )[ transition_name ] = transition
+                self.transition_index.add_transition( src_name, transition_name, transition[ HSM_RSVD_DEST ] )
+                key = ( src_name, transition_name )
+                if points is None:
+                    self.set_transition_path( key, self.find_default_path( src_name, transition, transition[ HSM_RSVD_DEST ] ) )
+                else:
+                    self.geometry.set_points( key, points )
+                    self.index_path( key )
+                self.paint_transition( src_name, transition_name )
+                self.undo_log.record( "Add transition", [ ( "restore_transition", src_name, transition_name, transition, points ) ],
+                    [ ( "delete_transition", src_name, transition_name ) ] )
+
+            global have_changes
+            have_changes = True
+            self.notify_change()
@@ -0,0 +1,141 @@
+import hashlib
+import pickle
+import struct
+import threading
+import zlib
+
+import save_service
+
+
+# Bump this whenever the form of the records changes.
+JOURNAL_VERSION = 1
+
+JOURNAL_SUFFIX = ".journal"
+
+# Each record is its length and CRC-32, then the pickled record itself.
+RECORD_HEADER = struct.Struct( "<II" )
+
+
+# Returns the digest identifying a saved version of a model file.
+def get_digest( contents: bytes ) -> bytes:
+    return hashlib.sha256( contents ).digest()
+
+# This function is for internal use only. Returns the bytes of a record.
+def pack_record( record: object ) -> bytes:
+    data = pickle.dumps( record, protocol = pickle.HIGHEST_PROTOCOL )
+    return RECORD_HEADER.pack( len( data ), zlib.crc32( data ) ) + data
+
+# This function is for internal use only. Returns the records in the bytes,
+# stopping at the first one cut short or damaged, e.g. by a crash mid-write.
+def unpack_records( data: bytes ) -> list:
+    records = []
+    offset = 0
+    while offset + RECORD_HEADER.size <= len( data ):
+        ( length, crc ) = RECORD_HEADER.unpack_from( data, offset )
+        offset += RECORD_HEADER.size
+        record_data = data[ offset : offset + length ]
+        if len( record_data ) != length or zlib.crc32( record_data ) != crc:
+            break
+        try:
+            records.append( pickle.loads( record_data ) )
+        except ( pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError ):
+            break
+        offset += length
+    return records
+
+
+# An append-only journal of the edits made to a model since it was last saved.
+#
+# Rather than rewriting the whole model after every edit, the delta of each
+# edit, as recorded for undo, is appended to a file next to the model. The
+# journal starts with the digest of the saved model it applies to, so after a
+# crash, recover() gives back the edits to replay over that save, and none
+# if the model file has been saved since.
+#
+# Once the journal grows too big it is compacted: the model is saved in full,
+# and rebase() starts the journal over from the new save, keeping only the
+# edits made after the snapshot that was saved, see mark().
+class edit_journal():
+    def __init__( self, model_filename: str ):
+        self.filename = model_filename + JOURNAL_SUFFIX
+        self.lock = threading.Lock()
+        self.journal_file = None
+        self.num_bytes = 0
+        self.marked = None
+
+    # Returns the deltas journaled over the save with the given digest, or
+    # an empty list if there are none, or the journal is for another save.
+    def recover( self, digest: bytes ) -> list:
+        try:
+            with open( self.filename, "rb" ) as journal_file:
+                records = unpack_records( journal_file.read() )
+        except OSError:
+            return []
+        if not records or records[ 0 ] != ( JOURNAL_VERSION, digest ):
+            return []
+        return records[ 1: ]
+
+    # Starts journaling edits to the save with the given digest. With keep,
+    # a journal already there for that save, e.g. one just recovered, is
+    # carried on, otherwise it is replaced by an empty one.
+    def open( self, digest: bytes, keep: bool = False ) -> None:
+        with self.lock:
+            self.close_file()
+            self.marked = None
+            try:
+                if not ( keep and self.recover( digest ) ):
+                    save_service.write_file_atomic( self.filename, pack_record( ( JOURNAL_VERSION, digest ) ) )
+                self.journal_file = open( self.filename, "ab" )
+                self.num_bytes = self.journal_file.tell()
+            except OSError as e:
+                print( f"WARN: Could not open the journal \"{self.filename}\", {e}." )
+
+    # Appends the delta of an edit, as a list of operations, see sm_undo.
+    def append( self, delta: list ) -> None:
+        with self.lock:
+            if self.journal_file is None:
+                return
+            try:
+                self.journal_file.write( pack_record( delta ) )
+                self.journal_file.flush()
+                self.num_bytes = self.journal_file.tell()
+            except OSError as e:
+                print( f"WARN: Could not write to the journal \"{self.filename}\", {e}." )
+
+    def get_num_bytes( self ) -> int:
+        return self.num_bytes
+
+    # Notes that a snapshot of the model is being taken for a full save, so
+    # that what was journaled up to here is covered by it.
+    def mark( self ) -> None:
+        with self.lock:
+            self.marked = self.num_bytes
+
+    # Starts the journal over from the save with the given digest, which was
+    # taken at the last mark(), keeping the edits journaled since.
+    def rebase( self, digest: bytes ) -> None:
+        with self.lock:
+            if self.journal_file is None or self.marked is None:
+                return
+            try:
+                with open( self.filename, "rb" ) as journal_file:
+                    journal_file.seek( self.marked )
+                    newer = journal_file.read()
+                save_service.write_file_atomic( self.filename, pack_record( ( JOURNAL_VERSION, digest ) ) + newer )
+                # The file written replaces the one open for appending.
+                self.close_file()
+                self.journal_file = open( self.filename, "ab" )
+                self.num_bytes = self.journal_file.tell()
+            except OSError as e:
+                print( f"WARN: Could not compact the journal \"{self.filename}\", {e}." )
+            self.marked = None
+
+    def close( self ) -> None:
+        with self.lock:
+            self.close_file()
+
+    # This method is for internal use only.
+    def close_file( self ) -> None:
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
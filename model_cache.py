@@ -0,0 +1,117 @@
+import hashlib
+import marshal
+import os
+import sys
+import zlib
+
+import save_service
+
+
+# Bump this whenever the layout of an entry changes, or what is cached would
+# no longer match what loading the file gives, e.g. the router changes.
+CACHE_VERSION = 2
+
+# The space the cache may take on disk by default.
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+CACHE_SUFFIX = ".smc"
+
+# Compression is kept light, as the point is to load quickly.
+COMPRESS_LEVEL = 1
+
+
+# Returns the per-user folder the cache is kept in.
+def get_default_folder() -> str:
+    if sys.platform.startswith( "win" ):
+        base = os.environ.get( "LOCALAPPDATA" ) or os.path.expanduser( "~" )
+    elif sys.platform == "darwin":
+        base = os.path.join( os.path.expanduser( "~" ), "Library", "Caches" )
+    else:
+        base = os.environ.get( "XDG_CACHE_HOME" ) or os.path.join( os.path.expanduser( "~" ), ".cache" )
+    return os.path.join( base, "ccd_state_machine_editor" )
+
+
+# A cache of parsed models, so that reopening a large model skips both the
+# JSON parse and the routing of any transitions it has no path for.
+#
+# Each model file has one entry, named after a digest of its full path,
+# holding the model in marshal form along with the paths routed for it and
+# the bounds found for it, see sm_layout.get_bounds(). An
+# entry is only used if the file still has the size, modification time and
+# SHA-256 digest it had when the entry was written; otherwise the model is
+# loaded from the JSON as usual and the entry replaced. Once the entries take
+# more than max_bytes, the least recently used are deleted.
+class sm_model_cache():
+    def __init__( self, folder: str = None, max_bytes: int = DEFAULT_MAX_BYTES ):
+        self.folder = folder if folder is not None else get_default_folder()
+        self.max_bytes = max_bytes
+
+    # This method is for internal use only.
+    def get_entry_filename( self, filename: str ) -> str:
+        name = hashlib.sha256( os.path.abspath( filename ).encode( "utf-8" ) ).hexdigest()
+        return os.path.join( self.folder, name + CACHE_SUFFIX )
+
+    # Returns ( model, routes, bounds ) cached for the file, given its
+    # contents, or None if there is no entry or it is out of date.
+    def get( self, filename: str, contents: bytes ) -> tuple:
+        entry_filename = self.get_entry_filename( filename )
+        try:
+            status = os.stat( filename )
+            with open( entry_filename, "rb" ) as entry_file:
+                entry = marshal.loads( zlib.decompress( entry_file.read() ) )
+            ( version, size, mtime_ns, digest, model_data, routes, bounds ) = entry
+            if ( version, size, mtime_ns ) != ( CACHE_VERSION, status.st_size, status.st_mtime_ns ):
+                return None
+            if not isinstance( bounds, dict ):
+                return None
+            if size != len( contents ) or digest != hashlib.sha256( contents ).digest():
+                return None
+            model = marshal.loads( model_data )
+            # Mark the entry as recently used, for evict().
+            os.utime( entry_filename )
+        except ( OSError, EOFError, ValueError, TypeError, zlib.error ):
+            return None
+        return ( model, routes, bounds )
+
+    # Returns the model in the form put() takes, to be taken before anything
+    # can change it.
+    def pack_model( self, model: dict ) -> bytes:
+        return marshal.dumps( model )
+
+    # Stores the model, as given by pack_model(), the ( key, path ) routes
+    # found for it, and its bounds, for a file with the given contents.
+    def put( self, filename: str, contents: bytes, model_data: bytes, routes: list, bounds: dict ) -> None:
+        try:
+            status = os.stat( filename )
+            if status.st_size != len( contents ):
+                # The file has changed since it was read.
+                return
+            entry = ( CACHE_VERSION, status.st_size, status.st_mtime_ns, hashlib.sha256( contents ).digest(), model_data, routes, bounds )
+            data = zlib.compress( marshal.dumps( entry ), COMPRESS_LEVEL )
+            os.makedirs( self.folder, exist_ok = True )
+            save_service.write_file_atomic( self.get_entry_filename( filename ), data )
+        except ( OSError, ValueError ) as e:
+            print( f"WARN: Could not cache \"{filename}\", {e}." )
+            return
+        self.evict()
+
+    # Deletes the least recently used entries until the rest fit in max_bytes.
+    def evict( self ) -> None:
+        entries = []
+        try:
+            with os.scandir( self.folder ) as folder:
+                for dir_entry in folder:
+                    if dir_entry.name.endswith( CACHE_SUFFIX ) and dir_entry.is_file():
+                        status = dir_entry.stat()
+                        entries.append( ( status.st_mtime_ns, status.st_size, dir_entry.path ) )
+        except OSError:
+            return
+        total = sum( size for ( mtime_ns, size, path ) in entries )
+        for ( mtime_ns, size, path ) in sorted( entries ):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove( path )
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,210 @@
+import edit_journal
+import json
+import queue
+import threading
+
+
+# Number of transitions routed between progress reports.
+ROUTE_BATCH_SIZE = 100
+
+# With fewer transitions to route than this, they are routed on a thread in
+# this process, as starting the routing processes would take longer.
+PARALLEL_MIN_ROUTES = 1000
+
+# Message kinds posted to the loader's results queue.
+LOAD_MSG_PARSED = "parsed"
+LOAD_MSG_ROUTED = "routed"
+LOAD_MSG_DONE   = "done"
+LOAD_MSG_ERROR  = "error"
+
+
+# The layout each routing process routes on, built once per process by
+# init_route_worker() from the snapshot given by the layout's get_route_snapshot().
+worker_layout = None
+
+def init_route_worker( create_layout, snapshot: dict ) -> None:
+    global worker_layout
+    worker_layout = create_layout( snapshot )
+
+# Routes a batch of the pending transitions in a routing process, returning
+# ( key, path ) for each which needed a path.
+def route_batch( keys: list ) -> list:
+    routes = []
+    for key in keys:
+        path = worker_layout.route_pending( key )
+        if path is not None:
+            routes.append( ( key, path ) )
+    return routes
+
+
+# Loads a state machine model off the Tk thread.
+#
+# The file is parsed, and later the missing transition paths are routed, on
+# background threads. Results are posted to a queue as ( kind, ... ) tuples,
+# which the UI drains from its own thread with get_messages(), so no Tk calls
+# are ever made from the workers.
+#
+# Given a model cache, a file cached unchanged is loaded from there, paths,
+# bounds and all, and save_to_cache() stores a file that wasn't, once it is
+# loaded.
+class sm_model_loader():
+    def __init__( self, filename: str, cache: object = None ):
+        self.filename = filename
+        self.cache = cache
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+        # The digest of the file as read, which identifies the save for its journal.
+        self.digest = None
+        # The file's contents and the model as parsed, kept for save_to_cache().
+        self.contents = None
+        self.model_data = None
+        # The routes found so far, or those taken from the cache.
+        self.routes = []
+        # The bounds of the model taken from the cache, for sm_layout, or None.
+        self.bounds = None
+        self.from_cache = False
+
+    def start_parse( self ) -> None:
+        self.thread = threading.Thread( target = self.parse, daemon = True )
+        self.thread.start()
+
+    # Thread body: deserialize the JSON state machine description.
+    def parse( self ) -> None:
+        try:
+            with open( self.filename, "rb" ) as model_file:
+                contents = model_file.read()
+        except OSError:
+            self.results.put( ( LOAD_MSG_ERROR, f"WARN: There is something wrong with the file {self.filename}, and it can't be opened." ) )
+            return
+        self.digest = edit_journal.get_digest( contents )
+
+        if self.cache is not None:
+            cached = self.cache.get( self.filename, contents )
+            if cached is not None:
+                ( model, self.routes, self.bounds ) = cached
+                self.from_cache = True
+                if not self.cancelled.is_set():
+                    self.results.put( ( LOAD_MSG_PARSED, model ) )
+                return
+
+        try:
+            model = json.loads( contents )
+        except json.JSONDecodeError as e:
+            self.results.put( ( LOAD_MSG_ERROR, f"ERR: JSONDecodeError, {e.msg}, file=\"{self.filename}\", line = {e.lineno}, col = {e.colno}." ) )
+            return
+        except UnicodeDecodeError:
+            self.results.put( ( LOAD_MSG_ERROR, f"WARN: There is something wrong with the file {self.filename}, and it can't be opened." ) )
+            return
+
+        if self.cache is not None:
+            # Taken now, as the layout fills in the model once it has it.
+            self.contents = contents
+            self.model_data = self.cache.pack_model( model )
+        if not self.cancelled.is_set():
+            self.results.put( ( LOAD_MSG_PARSED, model ) )
+
+    # Routes the transitions listed in the layout's pending_routes.
+    # The layout's route_pending() does the work, one transition at a time,
+    # either on a thread here or, for larger models with num_workers above
+    # one, spread over that many processes, each with its own copy of the
+    # layout made from a snapshot of the states.
+    def start_routing( self, layout: object, num_workers: int = 1 ) -> None:
+        jobs = list( layout.pending_routes )
+        if self.from_cache:
+            # Routed when the model was cached.
+            self.results.put( ( LOAD_MSG_ROUTED, self.routes, len( jobs ), len( jobs ) ) )
+            self.results.put( ( LOAD_MSG_DONE, ) )
+            return
+        if num_workers > 1 and len( jobs ) >= PARALLEL_MIN_ROUTES:
+            self.thread = threading.Thread( target = self.route_parallel, args = ( layout, jobs, num_workers, layout.get_route_snapshot() ), daemon = True )
+        else:
+            self.thread = threading.Thread( target = self.route, args = ( layout, jobs ), daemon = True )
+        self.thread.start()
+
+    # Thread body: route in batches, posting each batch as it completes.
+    # num_done are those of the total already routed elsewhere. Should the
+    # routing fail, the load is ended with an error rather than left waiting.
+    def route( self, layout: object, jobs: list, total: int = None, num_done: int = 0 ) -> None:
+        if total is None:
+            total = len( jobs )
+        try:
+            for first in range( 0, len( jobs ), ROUTE_BATCH_SIZE ):
+                routes = []
+                for key in jobs[ first : first + ROUTE_BATCH_SIZE ]:
+                    if self.cancelled.is_set():
+                        return
+                    path = layout.route_pending( key )
+                    if path is not None:
+                        routes.append( ( key, path ) )
+                num_done += len( jobs[ first : first + ROUTE_BATCH_SIZE ] )
+                self.routes.extend( routes )
+                self.results.put( ( LOAD_MSG_ROUTED, routes, num_done, total ) )
+        except Exception as e:
+            self.results.put( ( LOAD_MSG_ERROR, f"ERR: Routing the transitions of \"{self.filename}\" failed, {type( e ).__name__} {e}." ) )
+            return
+
+        if not self.cancelled.is_set():
+            self.results.put( ( LOAD_MSG_DONE, ) )
+
+    # Thread body: hand the batches to a pool of processes, posting each
+    # batch's routes as it comes back, in whatever order they finish. The
+    # processes are started afresh ( "spawn" ) rather than forked from this
+    # one, which has the Tk and loader threads running. If the pool breaks,
+    # or anything else goes wrong with it, e.g. the snapshot can't be pickled,
+    # whatever is left is routed here instead.
+    def route_parallel( self, layout: object, jobs: list, num_workers: int, snapshot: tuple ) -> None:
+        # Imported here, as they are slow to import and seldom needed.
+        import concurrent.futures
+        import multiprocessing
+        ( create_layout, model ) = snapshot
+        total = len( jobs )
+        batches = [ jobs[ first : first + ROUTE_BATCH_SIZE ] for first in range( 0, total, ROUTE_BATCH_SIZE ) ]
+        done = set()
+        num_done = 0
+        try:
+            context = multiprocessing.get_context( "spawn" )
+            with concurrent.futures.ProcessPoolExecutor( max_workers = num_workers, mp_context = context,
+              initializer = init_route_worker, initargs = ( create_layout, model ) ) as executor:
+                futures = { executor.submit( route_batch, batch ): idx for idx, batch in enumerate( batches ) }
+                for future in concurrent.futures.as_completed( futures ):
+                    if self.cancelled.is_set():
+                        executor.shutdown( wait = False, cancel_futures = True )
+                        return
+                    routes = future.result()
+                    done.add( futures[ future ] )
+                    num_done += len( batches[ futures[ future ] ] )
+                    self.routes.extend( routes )
+                    self.results.put( ( LOAD_MSG_ROUTED, routes, num_done, total ) )
+        except Exception as e:
+            print( f"WARN: Routing in {num_workers} processes failed, {type( e ).__name__} {e}, routing the rest in this one." )
+            remaining = [ key for idx, batch in enumerate( batches ) if idx not in done for key in batch ]
+            self.route( layout, remaining, total, num_done )
+            return
+
+        if not self.cancelled.is_set():
+            self.results.put( ( LOAD_MSG_DONE, ) )
+
+    # Stores the model just loaded in the cache, with the bounds found for it,
+    # on a thread of its own, unless it came from there. Call once loading is
+    # done, so the routes are all in, and before the model is edited.
+    def save_to_cache( self, bounds: dict ) -> None:
+        if self.cache is None or self.from_cache or self.model_data is None:
+            return
+        thread = threading.Thread( target = self.cache.put, args = ( self.filename, self.contents, self.model_data, self.routes, bounds ), daemon = True )
+        thread.start()
+
+    def cancel( self ) -> None:
+        self.cancelled.set()
+
+    def is_cancelled( self ) -> bool:
+        return self.cancelled.is_set()
+
+    # Returns any messages posted since the last call, without blocking.
+    def get_messages( self ) -> list:
+        messages = []
+        while True:
+            try:
+                messages.append( self.results.get_nowait() )
+            except queue.Empty:
+                return messages
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# How long the edits must pause before an autosave is written.
+DEFAULT_QUIET_SECS = 2.0
+
+
+# Serialize a document the way the editor always has, but into bytes.
+def serialize_json( document: object ) -> bytes:
+    return json.dumps( document, ensure_ascii = True, indent = 4 ).encode( "ascii" )
+
+# Write the bytes to a temporary file in the same folder, then swap it into
+# place, so the file on disk is always either the old or the new version.
+def write_file_atomic( filename: str, data: bytes ) -> None:
+    folder = os.path.dirname( os.path.abspath( filename ) )
+    ( temp_fd, temp_name ) = tempfile.mkstemp( dir = folder, prefix = os.path.basename( filename ) + ".", suffix = ".tmp" )
+    try:
+        with os.fdopen( temp_fd, "wb" ) as temp_file:
+            temp_file.write( data )
+            temp_file.flush()
+            os.fsync( temp_file.fileno() )
+        # Keep the permissions of the file being replaced.
+        if os.path.exists( filename ):
+            os.chmod( temp_name, os.stat( filename ).st_mode & 0o7777 )
+        os.replace( temp_name, filename )
+    except BaseException:
+        try:
+            os.remove( temp_name )
+        except OSError:
+            pass
+        raise
+
+# Returns True if the file already holds exactly these bytes.
+def file_matches( filename: str, data: bytes ) -> bool:
+    try:
+        if os.path.getsize( filename ) != len( data ):
+            return False
+        with open( filename, "rb" ) as existing_file:
+            return existing_file.read() == data
+    except OSError:
+        return False
+
+
+# A write-behind saver.
+#
+# Each schedule() call notes that a file's document has changed. Once the
+# changes to a file have paused for the quiet period, a worker thread calls
+# the snapshot function, serializes the result and writes it atomically,
+# unless the bytes are the same as those last written. A burst of edits
+# therefore costs a single write, and none of the work is done on the Tk
+# thread.
+#
+# The snapshot function must return a copy of the document which no edit
+# can touch, taken under whatever lock the edits hold, so that it is never
+# caught half way through one. Only the copy is serialized, once the lock is
+# released. If the document changes again meanwhile, the result is discarded
+# in favour of the newer write already scheduled.
+class save_service():
+    def __init__( self, quiet_secs: float = DEFAULT_QUIET_SECS ):
+        self.quiet_secs = quiet_secs
+        self.condition = threading.Condition()
+        # filename -> [ snapshot_fn, generation, due time, on_saved ]
+        self.pending = {}
+        # filename -> generation of the latest schedule() call
+        self.generations = {}
+        # filename -> digest of the bytes last written
+        self.written = {}
+        self.busy = False
+        self.stopping = False
+        self.thread = threading.Thread( target = self.run, daemon = True )
+        self.thread.start()
+
+    # Note a change to the document for filename. The write happens after
+    # delay seconds without further changes, by default the quiet period.
+    # Once the file holds the snapshot, on_saved is called with its bytes,
+    # on the worker thread.
+    def schedule( self, filename: str, snapshot_fn, delay: float = None, on_saved = None ) -> None:
+        if delay is None:
+            delay = self.quiet_secs
+        with self.condition:
+            generation = self.generations.get( filename, 0 ) + 1
+            self.generations[ filename ] = generation
+            self.pending[ filename ] = [ snapshot_fn, generation, time.monotonic() + delay, on_saved ]
+            self.condition.notify_all()
+
+    # Write everything pending right away, returning once it is on disk.
+    def flush( self ) -> None:
+        with self.condition:
+            for entry in self.pending.values():
+                entry[ 2 ] = 0
+            self.condition.notify_all()
+            while self.pending or self.busy:
+                self.condition.wait()
+
+    def stop( self ) -> None:
+        self.flush()
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def is_pending( self ) -> bool:
+        with self.condition:
+            return bool( self.pending ) or self.busy
+
+    # Thread body: wait for the next file to come due, and save it.
+    def run( self ) -> None:
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopping:
+                        return
+                    now = time.monotonic()
+                    due = [ ( entry[ 2 ], filename ) for filename, entry in self.pending.items() ]
+                    if due:
+                        ( due_time, filename ) = min( due )
+                        if due_time <= now:
+                            ( snapshot_fn, generation, due_time, on_saved ) = self.pending.pop( filename )
+                            self.busy = True
+                            break
+                        self.condition.wait( due_time - now )
+                    else:
+                        self.condition.wait()
+
+            try:
+                self.save( filename, snapshot_fn, generation, on_saved )
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def save( self, filename: str, snapshot_fn, generation: int, on_saved = None ) -> None:
+        data = serialize_json( snapshot_fn() )
+
+        with self.condition:
+            if self.generations.get( filename ) != generation and filename in self.pending:
+                # Changed again mid-serialize, the newer write will cover it.
+                return
+
+        digest = hashlib.sha1( data ).digest()
+        if self.written.get( filename ) == digest:
+            pass
+        elif filename not in self.written and file_matches( filename, data ):
+            self.written[ filename ] = digest
+        else:
+            try:
+                write_file_atomic( filename, data )
+                self.written[ filename ] = digest
+                print( f"Saved file = \"{filename}\"." )
+            except OSError:
+                print( f"WARN: There is something wrong with the file {filename}, and it can't be opened for writing." )
+                return
+
+        if on_saved is not None:
+            on_saved( data )
@@ -0,0 +1,433 @@
+import collections
+
+
+# The number of sweeps up and down the layers made to reduce crossings.
+ORDER_SWEEPS = 4
+
+# The number of sweeps up and down the layers made to line states up with
+# their neighbours.
+PLACE_SWEEPS = 2
+
+
+# Lays out the states of a model in layers, Sugiyama style.
+#
+# Each set of sibling states is laid out on its own, innermost first, so a
+# composite is sized to fit its substates before its own level is laid out:
+#   - Cycles are broken by reversing the transitions which close them.
+#   - States are put in layers, each transition going down at least one, and
+#     placeholders are added where a transition passes through a layer.
+#   - The states in each layer are ordered by the mean position of their
+#     neighbours in the layer before or after, sweeping down and up, which
+#     removes most crossings.
+#   - Each state is then moved towards its neighbours, keeping the order.
+# Transitions between sibling states get a path down through the gaps between
+# the layers and the placeholders' places, so they cross no states. Others,
+# e.g. into a composite's substates or spanning more than max_span layers,
+# are left without one.
+#
+# All of this takes time in proportion to the states and transitions, bar the
+# sorting of each layer. Positions and sizes are multiples of grid, paths
+# multiples of grid / 2.
+#
+# The model is a dict of states under states_key, each with its layout under
+# layout_key as { "x", "y", "w", "h" }, its transitions under tran_key, each
+# with its destination under dest_key and path under path_key, and any
+# substates under states_key again.
+class sm_auto_layout():
+    def __init__( self, grid: int, states_key: str, layout_key: str, tran_key: str, dest_key: str, path_key: str ):
+        assert( grid > 0 and grid % 2 == 0 )
+        self.grid = grid
+        self.states_key = states_key
+        self.layout_key = layout_key
+        self.tran_key = tran_key
+        self.dest_key = dest_key
+        self.path_key = path_key
+
+        # ( w, h ) of states without a size, and of states by name, e.g. the start state.
+        self.default_size = ( 12 * grid, 9 * grid )
+        self.fixed_sizes = {}
+        # Space between the states in a layer, and between a placeholder and
+        # anything next to it.
+        self.state_gap = 4 * grid
+        self.passing_gap = 2 * grid
+        # Space between the layers.
+        self.layer_gap = 6 * grid
+        # Transitions spanning more layers than this get no placeholders, and
+        # so no path; otherwise those in a large model could add many times
+        # more placeholders than there are states.
+        self.max_span = 8
+        # Space around the substates inside a composite, with more at the top for the title.
+        self.composite_pad = 2 * grid
+        self.composite_title = 4 * grid
+
+    def set_default_size( self, wid: int, hgt: int ) -> None:
+        self.default_size = ( wid, hgt )
+
+    def set_fixed_size( self, state_name: str, wid: int, hgt: int ) -> None:
+        self.fixed_sizes[ state_name ] = ( wid, hgt )
+
+    # Returns True if none of the states in the model has a layout.
+    def is_unlaid( self, model: dict ) -> bool:
+        pending = [ model ]
+        while pending:
+            for state in pending.pop().get( self.states_key, {} ).values():
+                if state.get( self.layout_key ):
+                    return False
+                pending.append( state )
+        return True
+
+    # Writes a new layout into every state of the model, and a path into each
+    # transition between sibling states, removing the paths of the others.
+    # Returns the number of states laid out.
+    def layout( self, model: dict ) -> int:
+        # State name -> ( x, y ), ( w, h ) relative to its level, and
+        # transition key -> path relative to the level of its source.
+        self.positions = {}
+        self.sizes = {}
+        self.paths = {}
+        states = model.get( self.states_key, {} )
+        self.layout_level( states )
+        num_states = self.place_level( states, 0, 0 )
+        self.positions = self.sizes = self.paths = None
+        return num_states
+
+    # This method is for internal use only. Lays out a set of sibling states,
+    # relative to their top left, and returns the ( w, h ) they take up.
+    def layout_level( self, states: dict ) -> tuple:
+        names = list( states )
+        if not names:
+            return ( 0, 0 )
+        grid = self.grid
+        for name in names:
+            state = states[ name ]
+            substates = state.get( self.states_key )
+            if substates:
+                ( sub_wid, sub_hgt ) = self.layout_level( substates )
+                wid = sub_wid + 2 * self.composite_pad
+                hgt = sub_hgt + self.composite_pad + self.composite_title
+                ( def_wid, def_hgt ) = self.get_size( name, state )
+                self.sizes[ name ] = ( self.snap_up( max( wid, def_wid ), grid ), self.snap_up( max( hgt, def_hgt ), grid ) )
+            else:
+                self.sizes[ name ] = self.get_size( name, state )
+
+        # Each member of this level, and everything inside it, -> the member.
+        index = { name: idx for idx, name in enumerate( names ) }
+        member_of = {}
+        for name in names:
+            member_of[ name ] = index[ name ]
+            pending = [ states[ name ] ]
+            while pending:
+                for sub_name, sub_state in pending.pop().get( self.states_key, {} ).items():
+                    member_of[ sub_name ] = index[ name ]
+                    pending.append( sub_state )
+
+        # The transitions between members, as ( src, dst, key or None ), with
+        # the key only for those between the members themselves.
+        edges = []
+        for name in names:
+            pending = [ ( name, states[ name ] ) ]
+            while pending:
+                ( src_name, state ) = pending.pop()
+                for transition_name, transition in state.get( self.tran_key, {} ).items():
+                    dst_name = transition.get( self.dest_key )
+                    src = member_of[ src_name ]
+                    dst = member_of.get( dst_name )
+                    if dst is None or dst == src:
+                        continue
+                    direct = src_name == names[ src ] and dst_name == names[ dst ]
+                    edges.append( ( src, dst, ( src_name, transition_name ) if direct else None ) )
+                pending.extend( state.get( self.states_key, {} ).items() )
+
+        edges = self.break_cycles( len( names ), edges )
+        layers = self.assign_layers( len( names ), edges )
+
+        # Nodes are the members followed by the placeholders; each edge
+        # becomes a chain of nodes, one per layer, from the upper end down.
+        node_layers = list( layers )
+        node_sizes = [ self.sizes[ name ] for name in names ]
+        chains = []
+        for ( src, dst, key, reversed_edge ) in edges:
+            if layers[ dst ] - layers[ src ] > self.max_span:
+                # Left to be routed, rather than widening every layer it passes.
+                continue
+            chain = [ src ]
+            for layer in range( layers[ src ] + 1, layers[ dst ] ):
+                chain.append( len( node_layers ) )
+                node_layers.append( layer )
+                node_sizes.append( ( 0, 0 ) )
+            chain.append( dst )
+            chains.append( ( chain, key, reversed_edge ) )
+
+        ups = [ [] for node in node_layers ]
+        downs = [ [] for node in node_layers ]
+        for ( chain, key, reversed_edge ) in chains:
+            for idx in range( len( chain ) - 1 ):
+                downs[ chain[ idx ] ].append( chain[ idx + 1 ] )
+                ups[ chain[ idx + 1 ] ].append( chain[ idx ] )
+
+        rows = self.order_layers( node_layers, ups, downs )
+        xs = self.place_nodes( rows, node_sizes, ups, downs, len( names ) )
+
+        # The top and bottom of each layer.
+        tops = []
+        top = 0
+        for row in rows:
+            tops.append( top )
+            top += max( [ node_sizes[ node ][ 1 ] for node in row ] + [ 0 ] ) + self.layer_gap
+        bottoms = [ tops[ idx + 1 ] - self.layer_gap for idx in range( len( rows ) - 1 ) ] + [ top - self.layer_gap ]
+
+        for idx, name in enumerate( names ):
+            self.positions[ name ] = ( xs[ idx ], tops[ layers[ idx ] ] )
+
+        half = grid // 2
+        for ( chain, key, reversed_edge ) in chains:
+            if key is None:
+                continue
+            points = []
+            for idx, node in enumerate( chain ):
+                ( wid, hgt ) = node_sizes[ node ]
+                layer = node_layers[ node ]
+                mid_x = xs[ node ] + wid // 2
+                if idx > 0:
+                    # Across the gap above, then down to the node.
+                    gap_y = self.snap( bottoms[ layer - 1 ] + self.layer_gap // 2, half )
+                    points.append( ( points[ -1 ][ 0 ], gap_y ) )
+                    points.append( ( mid_x, gap_y ) )
+                    points.append( ( mid_x, tops[ layer ] ) )
+                if idx < len( chain ) - 1:
+                    # Out of the bottom of the node, or through the layer for a placeholder.
+                    bottom = tops[ layer ] + hgt if node < len( names ) else bottoms[ layer ]
+                    if idx == 0 or node >= len( names ):
+                        points.append( ( mid_x, bottom ) )
+            if reversed_edge:
+                points.reverse()
+            self.paths[ key ] = self.simplify( points )
+
+        wid = max( xs[ idx ] + node_sizes[ idx ][ 0 ] for idx in range( len( names ) ) )
+        hgt = max( tops[ layers[ idx ] ] + node_sizes[ idx ][ 1 ] for idx in range( len( names ) ) )
+        return ( wid, hgt )
+
+    # This method is for internal use only. Returns the edges as
+    # ( src, dst, key, reversed ) with those which close a cycle reversed.
+    def break_cycles( self, num_nodes: int, edges: list ) -> list:
+        outs = [ [] for node in range( num_nodes ) ]
+        for ( src, dst, key ) in edges:
+            outs[ src ].append( dst )
+        # A depth first search in model order. An edge closes a cycle if it
+        # leads to a node on the search path, i.e. one which finishes after
+        # the edge's source; all others lead to nodes which finish before.
+        finish = [ 0 ] * num_nodes
+        marks = bytearray( num_nodes )
+        count = 0
+        for root in range( num_nodes ):
+            if marks[ root ]:
+                continue
+            marks[ root ] = 1
+            stack = [ ( root, iter( outs[ root ] ) ) ]
+            while stack:
+                ( node, children ) = stack[ -1 ]
+                for child in children:
+                    if not marks[ child ]:
+                        marks[ child ] = 1
+                        stack.append( ( child, iter( outs[ child ] ) ) )
+                        break
+                else:
+                    finish[ node ] = count
+                    count += 1
+                    stack.pop()
+
+        result = []
+        for ( src, dst, key ) in edges:
+            if finish[ src ] > finish[ dst ]:
+                result.append( ( src, dst, key, False ) )
+            else:
+                result.append( ( dst, src, key, True ) )
+        return result
+
+    # This method is for internal use only. Returns the layer of each node,
+    # its longest path from a node with no edges in, except that nodes with
+    # no edges in are put just above the highest node they lead to.
+    def assign_layers( self, num_nodes: int, edges: list ) -> list:
+        outs = [ [] for node in range( num_nodes ) ]
+        num_ins = [ 0 ] * num_nodes
+        for ( src, dst, key, reversed_edge ) in edges:
+            outs[ src ].append( dst )
+            num_ins[ dst ] += 1
+        layers = [ 0 ] * num_nodes
+        remaining = list( num_ins )
+        ready = collections.deque( node for node in range( num_nodes ) if remaining[ node ] == 0 )
+        while ready:
+            node = ready.popleft()
+            for child in outs[ node ]:
+                layers[ child ] = max( layers[ child ], layers[ node ] + 1 )
+                remaining[ child ] -= 1
+                if remaining[ child ] == 0:
+                    ready.append( child )
+        for node in range( num_nodes ):
+            if num_ins[ node ] == 0 and outs[ node ]:
+                layers[ node ] = min( layers[ child ] for child in outs[ node ] ) - 1
+        top = min( layers )
+        return [ layer - top for layer in layers ]
+
+    # This method is for internal use only. Returns the nodes of each layer
+    # in the order which crosses the fewest edges found.
+    def order_layers( self, node_layers: list, ups: list, downs: list ) -> list:
+        rows = [ [] for layer in range( max( node_layers ) + 1 ) ]
+        # Start in depth first order from the top, which keeps chains together.
+        seen = bytearray( len( node_layers ) )
+        for root in sorted( range( len( node_layers ) ), key = lambda node: node_layers[ node ] ):
+            if seen[ root ]:
+                continue
+            seen[ root ] = 1
+            stack = [ root ]
+            while stack:
+                node = stack.pop()
+                rows[ node_layers[ node ] ].append( node )
+                for child in reversed( downs[ node ] ):
+                    if not seen[ child ]:
+                        seen[ child ] = 1
+                        stack.append( child )
+
+        positions = [ 0 ] * len( node_layers )
+        for row in rows:
+            for idx, node in enumerate( row ):
+                positions[ node ] = idx
+
+        for sweep in range( ORDER_SWEEPS ):
+            if sweep % 2 == 0:
+                ( layer_range, neighbours ) = ( range( 1, len( rows ) ), ups )
+            else:
+                ( layer_range, neighbours ) = ( range( len( rows ) - 2, -1, -1 ), downs )
+            for layer in layer_range:
+                row = rows[ layer ]
+
+                # The mean position of the neighbours; nodes without any keep their place.
+                def barycenter( node: int ) -> float:
+                    nodes = neighbours[ node ]
+                    if not nodes:
+                        return positions[ node ]
+                    return sum( positions[ other ] for other in nodes ) / len( nodes )
+
+                row.sort( key = barycenter )
+                for idx, node in enumerate( row ):
+                    positions[ node ] = idx
+        return rows
+
+    # This method is for internal use only. Returns the x of each node, left
+    # to right in each row, moved towards the mean centre of its neighbours.
+    def place_nodes( self, rows: list, node_sizes: list, ups: list, downs: list, num_states: int ) -> list:
+        xs = [ 0 ] * len( node_sizes )
+
+        def get_gap( left: int, right: int ) -> int:
+            if left < num_states and right < num_states:
+                return self.state_gap
+            return self.passing_gap
+
+        # Packed to the left to begin with.
+        for row in rows:
+            x = 0
+            for idx, node in enumerate( row ):
+                if idx > 0:
+                    x += get_gap( row[ idx - 1 ], node )
+                xs[ node ] = x
+                x += node_sizes[ node ][ 0 ]
+
+        for sweep in range( 2 * PLACE_SWEEPS ):
+            if sweep % 2 == 0:
+                ( layer_range, neighbours ) = ( range( 1, len( rows ) ), ups )
+            else:
+                ( layer_range, neighbours ) = ( range( len( rows ) - 2, -1, -1 ), downs )
+            for layer in layer_range:
+                row = rows[ layer ]
+                wanted = []
+                for node in row:
+                    others = neighbours[ node ]
+                    if others:
+                        centre = sum( xs[ other ] + node_sizes[ other ][ 0 ] / 2 for other in others ) / len( others )
+                        wanted.append( centre - node_sizes[ node ][ 0 ] / 2 )
+                    else:
+                        wanted.append( xs[ node ] )
+                # As near the wanted places as the order and the gaps allow,
+                # first pushing right, then pulling back left where there is room.
+                placed = []
+                for idx, node in enumerate( row ):
+                    x = wanted[ idx ]
+                    if idx > 0:
+                        left = row[ idx - 1 ]
+                        x = max( x, placed[ -1 ] + node_sizes[ left ][ 0 ] + get_gap( left, node ) )
+                    placed.append( x )
+                for idx in range( len( row ) - 2, -1, -1 ):
+                    ( node, right ) = ( row[ idx ], row[ idx + 1 ] )
+                    limit = placed[ idx + 1 ] - node_sizes[ node ][ 0 ] - get_gap( node, right )
+                    if placed[ idx ] > limit:
+                        placed[ idx ] = limit
+                    elif placed[ idx ] < wanted[ idx ]:
+                        placed[ idx ] = min( wanted[ idx ], limit )
+                for idx, node in enumerate( row ):
+                    xs[ node ] = placed[ idx ]
+
+        # On the grid, and starting from 0. Snapping every x the same way
+        # keeps the gaps, bar rounding, which the gaps leave room for.
+        lft = min( xs ) if xs else 0
+        xs = [ self.snap( x - lft, self.grid ) for x in xs ]
+        for row in rows:
+            for idx in range( 1, len( row ) ):
+                ( left, node ) = ( row[ idx - 1 ], row[ idx ] )
+                least = xs[ left ] + node_sizes[ left ][ 0 ] + get_gap( left, node )
+                if xs[ node ] < least:
+                    xs[ node ] = self.snap_up( least, self.grid )
+        return xs
+
+    # This method is for internal use only. Writes the layouts and paths of a
+    # level and everything inside it, offset by ( dx, dy ), returning the
+    # number of states.
+    def place_level( self, states: dict, dx: int, dy: int ) -> int:
+        num_states = 0
+        for name, state in states.items():
+            ( x, y ) = self.positions[ name ]
+            ( wid, hgt ) = self.sizes[ name ]
+            ( x, y ) = ( x + dx, y + dy )
+            state[ self.layout_key ] = { "x": x, "y": y, "w": wid, "h": hgt }
+            for transition_name, transition in state.get( self.tran_key, {} ).items():
+                path = self.paths.get( ( name, transition_name ) )
+                if path is None:
+                    transition.pop( self.path_key, None )
+                else:
+                    transition[ self.path_key ] = [ { "x": px + dx, "y": py + dy } for ( px, py ) in path ]
+            num_states += 1
+            substates = state.get( self.states_key )
+            if substates:
+                num_states += self.place_level( substates, x + self.composite_pad, y + self.composite_title )
+        return num_states
+
+    # This method is for internal use only.
+    def get_size( self, name: str, state: dict ) -> tuple:
+        if name in self.fixed_sizes:
+            return self.fixed_sizes[ name ]
+        layout = state.get( self.layout_key ) or {}
+        ( wid, hgt ) = self.default_size
+        return ( self.snap_up( layout.get( "w", wid ), self.grid ), self.snap_up( layout.get( "h", hgt ), self.grid ) )
+
+    # This method is for internal use only. Rounds down to a multiple of step.
+    def snap( self, value: float, step: int ) -> int:
+        return int( value // step ) * step
+
+    # This method is for internal use only. Rounds up to a multiple of step.
+    def snap_up( self, value: float, step: int ) -> int:
+        return -int( -value // step ) * step
+
+    # This method is for internal use only. Drops repeated points and those
+    # in line with the points either side.
+    def simplify( self, points: list ) -> list:
+        result = []
+        for point in points:
+            if result and point == result[ -1 ]:
+                continue
+            if len( result ) >= 2:
+                ( ax, ay ) = result[ -2 ]
+                ( bx, by ) = result[ -1 ]
+                if ( ax == bx == point[ 0 ] ) or ( ay == by == point[ 1 ] ):
+                    result[ -1 ] = point
+                    continue
+            result.append( point )
+        return result
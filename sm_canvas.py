@@ -0,0 +1,182 @@
+# The drawing calls the state machine layout makes, so that it can be pointed
+# at a Tk canvas in the editor, or at a recording canvas when there is no
+# display, e.g. to exercise and time the layout code in tests.
+#
+# Items are identified by the integers returned from the create_*() calls, and
+# coordinates are passed flat, as x0, y0, x1, y1, ..., as with tk.Canvas.
+class sm_canvas_backend():
+    def create_line( self, *coords, **options ) -> int:
+        raise NotImplementedError
+
+    def create_arc( self, *coords, **options ) -> int:
+        raise NotImplementedError
+
+    def create_rectangle( self, *coords, **options ) -> int:
+        raise NotImplementedError
+
+    def create_oval( self, *coords, **options ) -> int:
+        raise NotImplementedError
+
+    def create_text( self, *coords, **options ) -> int:
+        raise NotImplementedError
+
+    # Calls func( event ) when the event sequence, e.g. "<Button-1>", happens on the item.
+    def tag_bind( self, item: int, sequence: str, func ) -> None:
+        raise NotImplementedError
+
+    def coords( self, item: int, *coords ) -> None:
+        raise NotImplementedError
+
+    def itemconfigure( self, item: int, **options ) -> None:
+        raise NotImplementedError
+
+    # Deletes one item, or every item if given "all".
+    def delete( self, item ) -> None:
+        raise NotImplementedError
+
+    # Scales the coordinates of one item, or every item if given "all", about
+    # the point ( x_origin, y_origin ).
+    def scale( self, item, x_origin: float, y_origin: float, x_scale: float, y_scale: float ) -> None:
+        raise NotImplementedError
+
+
+# Draws on a tk.Canvas, which is created as a child of master. The canvas
+# widget itself is available as widget, for placing it in its master.
+class sm_tk_canvas( sm_canvas_backend ):
+    def __init__( self, master: object, **kwargs ):
+        # Only imported here, so that the recording canvas works without Tk.
+        import tkinter as tk
+        self.widget = tk.Canvas( master = master, **kwargs )
+
+    def create_line( self, *coords, **options ) -> int:
+        return self.widget.create_line( *coords, **options )
+
+    def create_arc( self, *coords, **options ) -> int:
+        return self.widget.create_arc( *coords, **options )
+
+    def create_rectangle( self, *coords, **options ) -> int:
+        return self.widget.create_rectangle( *coords, **options )
+
+    def create_oval( self, *coords, **options ) -> int:
+        return self.widget.create_oval( *coords, **options )
+
+    def create_text( self, *coords, **options ) -> int:
+        return self.widget.create_text( *coords, **options )
+
+    def tag_bind( self, item: int, sequence: str, func ) -> None:
+        self.widget.tag_bind( item, sequence = sequence, func = func )
+
+    def coords( self, item: int, *coords ) -> None:
+        self.widget.coords( item, *coords )
+
+    def itemconfigure( self, item: int, **options ) -> None:
+        self.widget.itemconfigure( item, **options )
+
+    def delete( self, item ) -> None:
+        self.widget.delete( item )
+
+    def scale( self, item, x_origin: float, y_origin: float, x_scale: float, y_scale: float ) -> None:
+        self.widget.scale( item, x_origin, y_origin, x_scale, y_scale )
+
+
+# One item on a recording canvas.
+class sm_recorded_item():
+    __slots__ = ( "kind", "coords", "options", "bindings" )
+
+    def __init__( self, kind: str, coords: list, options: dict ):
+        self.kind = kind
+        self.coords = coords
+        self.options = options
+        # Event sequence -> function.
+        self.bindings = {}
+
+
+# Keeps the items in memory instead of drawing them, and counts the calls made
+# to each method, so the cost of an operation can be measured as the number of
+# canvas calls and items it needed. Bound functions can be invoked through
+# fire(), standing in for the mouse.
+class sm_recording_canvas( sm_canvas_backend ):
+    def __init__( self ):
+        self.items = {}
+        self.next_item = 1
+        # Method name -> number of calls.
+        self.calls = {}
+
+    def count_call( self, name: str ) -> None:
+        self.calls[ name ] = self.calls.get( name, 0 ) + 1
+
+    def reset_counts( self ) -> None:
+        self.calls = {}
+
+    def get_call_count( self, name: str = None ) -> int:
+        if name is None:
+            return sum( self.calls.values() )
+        return self.calls.get( name, 0 )
+
+    def get_item_count( self, kind: str = None ) -> int:
+        if kind is None:
+            return len( self.items )
+        return sum( 1 for item in self.items.values() if item.kind == kind )
+
+    def get_item( self, item: int ) -> sm_recorded_item:
+        return self.items.get( item )
+
+    # This method is for internal use only, the create_*() methods use it.
+    def create_item( self, kind: str, coords: tuple, options: dict ) -> int:
+        self.count_call( "create_" + kind )
+        item = self.next_item
+        self.next_item += 1
+        self.items[ item ] = sm_recorded_item( kind, list( coords ), dict( options ) )
+        return item
+
+    def create_line( self, *coords, **options ) -> int:
+        return self.create_item( "line", coords, options )
+
+    def create_arc( self, *coords, **options ) -> int:
+        return self.create_item( "arc", coords, options )
+
+    def create_rectangle( self, *coords, **options ) -> int:
+        return self.create_item( "rectangle", coords, options )
+
+    def create_oval( self, *coords, **options ) -> int:
+        return self.create_item( "oval", coords, options )
+
+    def create_text( self, *coords, **options ) -> int:
+        return self.create_item( "text", coords, options )
+
+    def tag_bind( self, item: int, sequence: str, func ) -> None:
+        self.count_call( "tag_bind" )
+        self.items[ item ].bindings[ sequence ] = func
+
+    def coords( self, item: int, *coords ) -> None:
+        self.count_call( "coords" )
+        self.items[ item ].coords = list( coords )
+
+    def itemconfigure( self, item: int, **options ) -> None:
+        self.count_call( "itemconfigure" )
+        self.items[ item ].options.update( options )
+
+    def delete( self, item ) -> None:
+        self.count_call( "delete" )
+        if item == "all":
+            self.items.clear()
+        else:
+            self.items.pop( item, None )
+
+    def scale( self, item, x_origin: float, y_origin: float, x_scale: float, y_scale: float ) -> None:
+        self.count_call( "scale" )
+        if item == "all":
+            scaled = self.items.values()
+        else:
+            scaled = [ self.items[ item ] ]
+        for recorded in scaled:
+            coords = recorded.coords
+            for idx in range( 0, len( coords ) - 1, 2 ):
+                coords[ idx ] = x_origin + ( coords[ idx ] - x_origin ) * x_scale
+                coords[ idx + 1 ] = y_origin + ( coords[ idx + 1 ] - y_origin ) * y_scale
+
+    # Calls the function bound to the event sequence on the item, if any.
+    def fire( self, item: int, sequence: str, event: object ) -> None:
+        func = self.items[ item ].bindings.get( sequence )
+        if func:
+            func( event )
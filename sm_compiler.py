@@ -0,0 +1,358 @@
+import json
+import random
+import time
+
+import save_service
+
+
+# Bump this whenever the form of a compiled model changes.
+COMPILED_VERSION = 1
+
+COMPILED_SUFFIX = ".dispatch.json"
+
+# The model's reserved names, as in ccd_ui_hsm, which isn't imported so that
+# a runtime can load compiled models without the editor.
+HSM_RSVD_STATES = "states"
+HSM_RSVD_START  = "start"
+HSM_RSVD_AUTO   = "auto"
+HSM_RSVD_TRAN   = "tran"
+HSM_RSVD_DEST   = "dest"
+HSM_RSVD_ENTRY  = "entry"
+HSM_RSVD_EXIT   = "exit"
+HSM_RSVD_EVENTS = "events"
+
+# The dispatch table is dense, a full row of events per state, when at least
+# this fraction of its cells have a transition, otherwise sparse, only the
+# events each state handles.
+DENSE_MIN_FILL = 0.25
+
+# No transition, in the dispatch table.
+NO_STEP = -1
+
+
+# Compiles a model into table driven form, for a runtime to dispatch events
+# with a couple of list lookups, rather than walking the model's dicts:
+#
+#   "states"   state names, by id, in model order. Parents come before their substates.
+#   "parents"  the id of each state's parent, or -1 at the top level.
+#   "events"   event names, by id: the model's "events" list, then any other
+#              transition names, except "auto".
+#   "steps"    each [ dest, exit actions, entry actions, source, event ] a
+#              transition can take.
+#   "table"    "dense" or "sparse".
+#   "dispatch" for each active state, the step each event takes, NO_STEP
+#              if none: a row with an entry per event if dense, or flat
+#              event, step pairs if sparse.
+#   "start"    the id of the start state, or if there is none, of the first
+#              state, -1 if there are no states.
+#   "initial"  the step of the start state's auto transition, or NO_STEP.
+#
+# An event is handled by the innermost of the active state and its
+# ancestors with a transition for it, which is resolved here, as is the
+# chain of states exited and entered. A transition exits from the active
+# state up to, but not including, the lowest state containing both its
+# source and destination, then enters down to the destination; so a
+# transition to itself, or to a state inside or around its source, exits
+# and reenters the source.
+def compile_model( model: dict ) -> dict:
+    names = []
+    parents = []
+    states = []
+    ids = {}
+    def add_states( substates: dict, parent_id: int ) -> None:
+        for state_name, state in substates.items():
+            # As in the editor, only the first state of a name counts.
+            if state_name in ids:
+                continue
+            ids[ state_name ] = len( names )
+            names.append( state_name )
+            parents.append( parent_id )
+            states.append( state )
+            add_states( state.get( HSM_RSVD_STATES, {} ), ids[ state_name ] )
+    add_states( model.get( HSM_RSVD_STATES, {} ), -1 )
+
+    events = []
+    event_ids = {}
+    def add_event( event_name: str ) -> None:
+        if event_name not in event_ids:
+            event_ids[ event_name ] = len( events )
+            events.append( event_name )
+    for event_name in model.get( HSM_RSVD_EVENTS, [] ):
+        add_event( event_name )
+    for state in states:
+        for event_name in state.get( HSM_RSVD_TRAN, {} ):
+            if event_name != HSM_RSVD_AUTO:
+                add_event( event_name )
+
+    # Each state's ancestors, itself first.
+    chains = []
+    for state_id in range( len( names ) ):
+        parent_id = parents[ state_id ]
+        chains.append( [ state_id ] + ( chains[ parent_id ] if parent_id >= 0 else [] ) )
+
+    steps = []
+    step_ids = {}
+    def get_step( active_id: int, source_id: int, event_name: str ) -> int:
+        dst_name = states[ source_id ][ HSM_RSVD_TRAN ][ event_name ].get( HSM_RSVD_DEST )
+        if dst_name not in ids:
+            raise ValueError( f"Transition \"{event_name}\" of \"{names[ source_id ]}\" goes to \"{dst_name}\", which is not a state." )
+        dst_id = ids[ dst_name ]
+        # The lowest state which is an ancestor of both, but neither itself, or -1 for the top level.
+        dst_ancestors = set( chains[ dst_id ][ 1 : ] )
+        lca_id = next( ( state_id for state_id in chains[ source_id ][ 1 : ] if state_id in dst_ancestors ), -1 )
+        exited = []
+        for state_id in chains[ active_id ]:
+            if state_id == lca_id:
+                break
+            exited.append( state_id )
+        entered = []
+        for state_id in chains[ dst_id ]:
+            if state_id == lca_id:
+                break
+            entered.insert( 0, state_id )
+        exit_actions = [ action for state_id in exited for action in states[ state_id ].get( HSM_RSVD_EXIT, [] ) ]
+        entry_actions = [ action for state_id in entered for action in states[ state_id ].get( HSM_RSVD_ENTRY, [] ) ]
+        step = ( dst_id, tuple( exit_actions ), tuple( entry_actions ), source_id, event_name )
+        step_id = step_ids.get( step )
+        if step_id is None:
+            step_id = len( steps )
+            step_ids[ step ] = step_id
+            steps.append( [ dst_id, exit_actions, entry_actions, source_id, event_name ] )
+        return step_id
+
+    rows = []
+    num_cells = 0
+    for active_id in range( len( names ) ):
+        row = {}
+        for state_id in chains[ active_id ]:
+            for event_name in states[ state_id ].get( HSM_RSVD_TRAN, {} ):
+                if event_name != HSM_RSVD_AUTO and event_ids[ event_name ] not in row:
+                    row[ event_ids[ event_name ] ] = get_step( active_id, state_id, event_name )
+        rows.append( row )
+        num_cells += len( row )
+
+    start_id = ids.get( HSM_RSVD_START, 0 if names else -1 )
+    initial = NO_STEP
+    if start_id >= 0 and names[ start_id ] == HSM_RSVD_START and HSM_RSVD_AUTO in states[ start_id ].get( HSM_RSVD_TRAN, {} ):
+        initial = get_step( start_id, start_id, HSM_RSVD_AUTO )
+
+    dense = num_cells >= DENSE_MIN_FILL * len( names ) * len( events )
+    if dense:
+        dispatch = [ [ row.get( event_id, NO_STEP ) for event_id in range( len( events ) ) ] for row in rows ]
+    else:
+        dispatch = [ [ value for event_id in sorted( row ) for value in ( event_id, row[ event_id ] ) ] for row in rows ]
+    return {
+        "version": COMPILED_VERSION,
+        "states": names,
+        "parents": parents,
+        "events": events,
+        "steps": steps,
+        "table": "dense" if dense else "sparse",
+        "dispatch": dispatch,
+        "start": start_id,
+        "initial": initial,
+    }
+
+def write_compiled( compiled: dict, filename: str ) -> None:
+    save_service.write_file_atomic( filename, json.dumps( compiled, separators = ( ",", ":" ) ).encode( "utf-8" ) )
+
+# Returns a compiled model written by write_compiled().
+def load_compiled( filename: str ) -> dict:
+    with open( filename, "rb" ) as compiled_file:
+        compiled = json.loads( compiled_file.read() )
+    if not isinstance( compiled, dict ) or compiled.get( "version" ) != COMPILED_VERSION:
+        raise ValueError( f"\"{filename}\" is not a compiled model of version {COMPILED_VERSION}." )
+    return compiled
+
+
+# Runs a compiled model. Events are dispatched by id, see get_event_id(),
+# each costing a table lookup and a list of actions, whatever the depth of
+# the states. on_action( action ) is called with each exit and entry action,
+# in order, if given.
+class sm_compiled_machine():
+    def __init__( self, compiled: dict, on_action = None ):
+        assert( compiled.get( "version" ) == COMPILED_VERSION )
+        self.state_names = compiled[ "states" ]
+        self.event_names = compiled[ "events" ]
+        self.event_ids = { event_name: event_id for event_id, event_name in enumerate( self.event_names ) }
+        # Step -> ( dest, actions, ( source name, event name ) ).
+        self.steps = [ ( dst_id, tuple( exit_actions ) + tuple( entry_actions ), ( self.state_names[ source_id ], event_name ) )
+            for ( dst_id, exit_actions, entry_actions, source_id, event_name ) in compiled[ "steps" ] ]
+        if compiled[ "table" ] == "dense":
+            self.rows = [ tuple( row ) for row in compiled[ "dispatch" ] ]
+        else:
+            # Event id -> step, for only the events each state handles.
+            self.rows = [ { row[ idx ]: row[ idx + 1 ] for idx in range( 0, len( row ), 2 ) } for row in compiled[ "dispatch" ] ]
+        self.dense = compiled[ "table" ] == "dense"
+        self.start_id = compiled[ "start" ]
+        self.initial = compiled[ "initial" ]
+        self.on_action = on_action
+        self.active = None
+        # ( source state name, event name ) of the last transition taken.
+        self.last_transition = None
+        self.num_taken = 0
+
+    # Returns the id of the named event, or None if no state handles it.
+    def get_event_id( self, event_name: str ) -> int:
+        return self.event_ids.get( event_name )
+
+    # Enters the start state and takes its auto transition. A model without
+    # a start state starts in its first state.
+    def start( self ) -> None:
+        self.active = self.start_id if self.start_id >= 0 else None
+        self.last_transition = None
+        self.num_taken = 0
+        if self.initial != NO_STEP:
+            self.take( self.initial )
+
+    # Dispatches an event to the active state. Returns whether a transition was taken.
+    def dispatch( self, event_id: int ) -> bool:
+        if self.active is None:
+            return False
+        if self.dense:
+            step_id = self.rows[ self.active ][ event_id ]
+        else:
+            step_id = self.rows[ self.active ].get( event_id, NO_STEP )
+        if step_id == NO_STEP:
+            return False
+        self.take( step_id )
+        return True
+
+    def dispatch_name( self, event_name: str ) -> bool:
+        event_id = self.event_ids.get( event_name )
+        return event_id is not None and self.dispatch( event_id )
+
+    # This method is for internal use only.
+    def take( self, step_id: int ) -> None:
+        ( self.active, actions, self.last_transition ) = self.steps[ step_id ]
+        self.num_taken += 1
+        if self.on_action is not None:
+            for action in actions:
+                self.on_action( action )
+
+    # Returns the name of the active state, or None before start().
+    def get_active_name( self ) -> str:
+        return None if self.active is None else self.state_names[ self.active ]
+
+
+# Runs a model as it is, walking its dicts for every event: the state, its
+# transitions and those of its ancestors, then the states to exit and
+# enter. This is the behaviour sm_compiled_machine compiles down, kept to
+# check against and to measure it by.
+class sm_interpreted_machine():
+    def __init__( self, model: dict, on_action = None ):
+        self.states = {}
+        self.parents = {}
+        def add_states( substates: dict, parent_name: str ) -> None:
+            for state_name, state in substates.items():
+                if state_name not in self.states:
+                    self.states[ state_name ] = state
+                    self.parents[ state_name ] = parent_name
+                    add_states( state.get( HSM_RSVD_STATES, {} ), state_name )
+        add_states( model.get( HSM_RSVD_STATES, {} ), None )
+        self.on_action = on_action
+        self.active = None
+        self.last_transition = None
+        self.num_taken = 0
+
+    def start( self ) -> None:
+        self.active = HSM_RSVD_START if HSM_RSVD_START in self.states else next( iter( self.states ), None )
+        self.last_transition = None
+        self.num_taken = 0
+        if self.active == HSM_RSVD_START and HSM_RSVD_AUTO in self.states[ HSM_RSVD_START ].get( HSM_RSVD_TRAN, {} ):
+            self.take( HSM_RSVD_START, HSM_RSVD_AUTO )
+
+    def dispatch_name( self, event_name: str ) -> bool:
+        if self.active is None or event_name == HSM_RSVD_AUTO:
+            return False
+        state_name = self.active
+        while state_name is not None:
+            if event_name in self.states[ state_name ].get( HSM_RSVD_TRAN, {} ):
+                self.take( state_name, event_name )
+                return True
+            state_name = self.parents[ state_name ]
+        return False
+
+    # This method is for internal use only.
+    def get_chain( self, state_name: str ) -> list:
+        chain = []
+        while state_name is not None:
+            chain.append( state_name )
+            state_name = self.parents[ state_name ]
+        return chain
+
+    # This method is for internal use only.
+    def take( self, source_name: str, event_name: str ) -> None:
+        dst_name = self.states[ source_name ][ HSM_RSVD_TRAN ][ event_name ][ HSM_RSVD_DEST ]
+        dst_ancestors = self.get_chain( dst_name )[ 1 : ]
+        lca_name = next( ( state_name for state_name in self.get_chain( source_name )[ 1 : ] if state_name in dst_ancestors ), None )
+        actions = []
+        for state_name in self.get_chain( self.active ):
+            if state_name == lca_name:
+                break
+            actions.extend( self.states[ state_name ].get( HSM_RSVD_EXIT, [] ) )
+        entered = []
+        for state_name in self.get_chain( dst_name ):
+            if state_name == lca_name:
+                break
+            entered.insert( 0, state_name )
+        for state_name in entered:
+            actions.extend( self.states[ state_name ].get( HSM_RSVD_ENTRY, [] ) )
+        self.active = dst_name
+        self.last_transition = ( source_name, event_name )
+        self.num_taken += 1
+        if self.on_action is not None:
+            for action in actions:
+                self.on_action( action )
+
+    def get_active_name( self ) -> str:
+        return self.active
+
+
+# Fires the same num_events random events, from those of the compiled
+# model, at the model run as it is and compiled, and returns how many events
+# a second each dispatches, and whether both ended up the same, having taken
+# the same transitions and actions.
+def run_benchmark( model: dict, num_events: int, seed: int = 0 ) -> dict:
+    compiled = compile_model( model )
+    result = { "events": num_events, "interpreted_eps": 0.0, "compiled_eps": 0.0, "speedup": 0.0, "same_result": True }
+    if not compiled[ "events" ] or num_events <= 0:
+        return result
+    rng = random.Random( seed )
+    event_names = [ rng.choice( compiled[ "events" ] ) for idx in range( num_events ) ]
+
+    interpreted = sm_interpreted_machine( model )
+    interpreted.start()
+    start = time.perf_counter()
+    for event_name in event_names:
+        interpreted.dispatch_name( event_name )
+    interpreted_secs = time.perf_counter() - start
+
+    machine = sm_compiled_machine( compiled )
+    machine.start()
+    # A runtime works with the ids, interning the names once, up front.
+    event_ids = [ machine.get_event_id( event_name ) for event_name in event_names ]
+    start = time.perf_counter()
+    for event_id in event_ids:
+        machine.dispatch( event_id )
+    compiled_secs = time.perf_counter() - start
+
+    result[ "interpreted_eps" ] = round( num_events / max( interpreted_secs, 1e-9 ) )
+    result[ "compiled_eps" ] = round( num_events / max( compiled_secs, 1e-9 ) )
+    result[ "speedup" ] = round( interpreted_secs / max( compiled_secs, 1e-9 ), 2 )
+
+    # Run both again, recording the actions, to check they behave the same.
+    interpreted_actions = []
+    compiled_actions = []
+    interpreted = sm_interpreted_machine( model, interpreted_actions.append )
+    machine = sm_compiled_machine( compiled, compiled_actions.append )
+    interpreted.start()
+    machine.start()
+    for ( event_name, event_id ) in zip( event_names, event_ids ):
+        interpreted.dispatch_name( event_name )
+        machine.dispatch( event_id )
+        if interpreted.get_active_name() != machine.get_active_name():
+            result[ "same_result" ] = False
+            break
+    result[ "same_result" ] = result[ "same_result" ] and interpreted_actions == compiled_actions and interpreted.num_taken == machine.num_taken
+    return result
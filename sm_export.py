@@ -0,0 +1,338 @@
+import math
+import os
+import xml.sax.saxutils
+
+import sm_canvas
+
+
+# The diagram is painted a tile of this many pixels square at a time, so only
+# the items of one tile exist at once. PNGs bigger than one tile are written
+# as a file per tile.
+DEFAULT_TILE_PIX = 4096
+
+# Blank space left around the states and transitions.
+EXPORT_MARGIN_PIX = 20
+
+BACKGROUND_COLOUR = "white"
+
+# The title font, about Tk's default.
+FONT_FAMILY = "sans-serif"
+FONT_PIX = 12
+
+# Tk's default arrow shape: the distances from the tip to where the arrow
+# head meets the line, and to its trailing points, and how far those points
+# stand out from the edge of the line.
+ARROW_SHAPE = ( 8, 10, 3 )
+
+
+# Returns ( coords, polygon ) for a line with an arrow head on the last
+# point, as Tk draws it: the line cut back to end inside the head, and the
+# head's points, flat. The polygon is None if the last segment has no length.
+def get_arrow( coords: list, width: float ) -> tuple:
+    ( shape_a, shape_b, shape_c ) = ARROW_SHAPE
+    shape_c += width / 2
+    ( tip_x, tip_y ) = coords[ -2 : ]
+    ( from_x, from_y ) = coords[ -4 : -2 ]
+    length = math.hypot( tip_x - from_x, tip_y - from_y )
+    if length == 0:
+        return ( coords, None )
+    cos_theta = ( tip_x - from_x ) / length
+    sin_theta = ( tip_y - from_y ) / length
+    neck_x = tip_x - shape_a * cos_theta
+    neck_y = tip_y - shape_a * sin_theta
+    out_1_x = tip_x - shape_b * cos_theta + shape_c * sin_theta
+    out_1_y = tip_y - shape_b * sin_theta - shape_c * cos_theta
+    out_2_x = out_1_x - 2 * shape_c * sin_theta
+    out_2_y = out_1_y + 2 * shape_c * cos_theta
+    # Where the edges of the line meet the back of the head.
+    frac = ( width / 2 ) / shape_c
+    in_1_x = out_1_x * frac + neck_x * ( 1 - frac )
+    in_1_y = out_1_y * frac + neck_y * ( 1 - frac )
+    in_2_x = out_2_x * frac + neck_x * ( 1 - frac )
+    in_2_y = out_2_y * frac + neck_y * ( 1 - frac )
+    backup = frac * shape_b + shape_a * ( 1 - frac ) / 2
+    coords = list( coords[ : -2 ] ) + [ tip_x - backup * cos_theta, tip_y - backup * sin_theta ]
+    polygon = [ tip_x, tip_y, out_1_x, out_1_y, in_1_x, in_1_y, in_2_x, in_2_y, out_2_x, out_2_y ]
+    return ( coords, polygon )
+
+# Returns ( lft, top, wid, hgt ), in canvas coordinates, around every state
+# and transition shown in the diagram, plus the margin.
+def get_export_rect( diagram: object ) -> tuple:
+    extents = [ index.get_extents() for index in ( diagram.spatial_index, diagram.path_index ) ]
+    extents = [ rect for rect in extents if rect is not None ]
+    if extents:
+        ( lft, top ) = ( min( rect[ 0 ] for rect in extents ) * diagram.zoom, min( rect[ 1 ] for rect in extents ) * diagram.zoom )
+        ( rgt, btm ) = ( max( rect[ 2 ] for rect in extents ) * diagram.zoom, max( rect[ 3 ] for rect in extents ) * diagram.zoom )
+    else:
+        ( lft, top, rgt, btm ) = ( 0, 0, 0, 0 )
+    lft = math.floor( lft ) - EXPORT_MARGIN_PIX
+    top = math.floor( top ) - EXPORT_MARGIN_PIX
+    return ( lft, top, math.ceil( rgt ) + EXPORT_MARGIN_PIX - lft, math.ceil( btm ) + EXPORT_MARGIN_PIX - top )
+
+# Returns the ( col, row, lft, top, wid, hgt ) of each tile covering the rect,
+# row by row.
+def get_tiles( rect: tuple, tile_pix: int ) -> list:
+    ( lft, top, wid, hgt ) = rect
+    tiles = []
+    for row, tile_top in enumerate( range( top, top + hgt, tile_pix ) ):
+        for col, tile_lft in enumerate( range( lft, lft + wid, tile_pix ) ):
+            tiles.append( ( col, row, tile_lft, tile_top, min( tile_pix, lft + wid - tile_lft ), min( tile_pix, top + hgt - tile_top ) ) )
+    return tiles
+
+# Paints the area ( lft, top, wid, hgt ) of the diagram, in canvas
+# coordinates, on the canvas, which from then on is the diagram's, exactly
+# as the editor paints it. With owned_only, only the states and transitions
+# whose top left corner is in the area are painted, so that across a set of
+# tiles each is painted once.
+def paint_area( diagram: object, canvas: sm_canvas.sm_canvas_backend, lft: int, top: int, wid: int, hgt: int, owned_only: bool = False ) -> None:
+    diagram.canvas = canvas
+    # Set directly, as set_view() would also update the previous canvas.
+    ( diagram.view_lft, diagram.view_top, diagram.view_wid, diagram.view_hgt ) = ( lft, top, wid, hgt )
+    diagram.paint_begin()
+    if owned_only:
+        def is_owned( rect: tuple ) -> bool:
+            ( x, y ) = ( rect[ 0 ] * diagram.zoom, rect[ 1 ] * diagram.zoom )
+            return lft <= x < lft + wid and top <= y < top + hgt
+        diagram.paint_states = [ widget for widget in diagram.paint_states if is_owned( diagram.spatial_index.get_rect( widget.name ) ) ]
+        diagram.paint_transitions = [ key for key in diagram.paint_transitions if is_owned( diagram.path_index.get_rect( key ) ) ]
+    diagram.paint_batch( 0, diagram.get_paint_count() )
+    # Drop the items of the tile, so that they don't build up over the tiles.
+    diagram.state_items = {}
+    diagram.transition_items = {}
+
+
+# A canvas which draws each item the moment it is created, for exporting
+# the diagram, and keeps nothing of it. The subclasses draw with the draw_*()
+# methods, given coordinates relative to ( x_origin, y_origin ), and the
+# options of the items with Tk's defaults filled in. Items can't be changed
+# once created, and there is no mouse to bind to.
+class sm_export_canvas( sm_canvas.sm_canvas_backend ):
+    def __init__( self, x_origin: int = 0, y_origin: int = 0 ):
+        self.x_origin = x_origin
+        self.y_origin = y_origin
+        self.next_item = 1
+
+    # This method is for internal use only. Returns the next item id.
+    def new_item( self ) -> int:
+        item = self.next_item
+        self.next_item += 1
+        return item
+
+    # This method is for internal use only. Returns the coordinates relative to the origin.
+    def to_local( self, coords: tuple ) -> list:
+        return [ value - ( self.x_origin if idx % 2 == 0 else self.y_origin ) for idx, value in enumerate( coords ) ]
+
+    def create_line( self, *coords, **options ) -> int:
+        coords = self.to_local( coords )
+        width = options.get( "width", 1 )
+        fill = options.get( "fill", "black" )
+        polygon = None
+        if options.get( "arrow", "none" ) == "last":
+            ( coords, polygon ) = get_arrow( coords, width )
+        self.draw_polyline( coords, width, fill )
+        if polygon is not None:
+            self.draw_polygon( polygon, fill )
+        return self.new_item()
+
+    def create_arc( self, *coords, **options ) -> int:
+        # Only outlines are drawn in the editor.
+        assert( options.get( "style" ) == "arc" )
+        self.draw_arc( self.to_local( coords ), options.get( "start", 0 ), options.get( "extent", 90 ),
+            options.get( "width", 1 ), options.get( "outline", "black" ) )
+        return self.new_item()
+
+    def create_rectangle( self, *coords, **options ) -> int:
+        width = options.get( "width", 1 )
+        fill = options.get( "fill" ) or None
+        # Nothing shows of an item without an outline or fill, e.g. a title bar until the mouse is over it.
+        if width > 0 or fill is not None:
+            self.draw_rectangle( self.to_local( coords ), width, options.get( "outline", "black" ), fill )
+        return self.new_item()
+
+    def create_oval( self, *coords, **options ) -> int:
+        width = options.get( "width", 1 )
+        fill = options.get( "fill" ) or None
+        if width > 0 or fill is not None:
+            self.draw_oval( self.to_local( coords ), width, options.get( "outline", "black" ), fill )
+        return self.new_item()
+
+    def create_text( self, *coords, **options ) -> int:
+        ( x, y ) = self.to_local( coords )
+        self.draw_text( x, y, str( options.get( "text", "" ) ), options.get( "fill", "black" ) )
+        return self.new_item()
+
+    def tag_bind( self, item: int, sequence: str, func ) -> None:
+        pass
+
+    def delete( self, item ) -> None:
+        # Only ever called to blank out the canvas before painting.
+        assert( item == "all" )
+
+    def draw_polyline( self, coords: list, width: float, fill: str ) -> None:
+        raise NotImplementedError
+
+    def draw_polygon( self, coords: list, fill: str ) -> None:
+        raise NotImplementedError
+
+    # The arc runs counterclockwise from start, in degrees from 3 o'clock, as in Tk.
+    def draw_arc( self, coords: list, start: float, extent: float, width: float, outline: str ) -> None:
+        raise NotImplementedError
+
+    def draw_rectangle( self, coords: list, width: float, outline: str, fill: str ) -> None:
+        raise NotImplementedError
+
+    def draw_oval( self, coords: list, width: float, outline: str, fill: str ) -> None:
+        raise NotImplementedError
+
+    # The text is centered on ( x, y ).
+    def draw_text( self, x: float, y: float, text: str, fill: str ) -> None:
+        raise NotImplementedError
+
+
+# This function is for internal use only. Formats an SVG number.
+def svg_number( value: float ) -> str:
+    text = f"{value:.2f}".rstrip( "0" ).rstrip( "." )
+    return "0" if text == "-0" else text
+
+# This function is for internal use only. Formats flat coordinates as SVG points.
+def svg_points( coords: list ) -> str:
+    return " ".join( f"{svg_number( coords[ idx ] )},{svg_number( coords[ idx + 1 ] )}" for idx in range( 0, len( coords ) - 1, 2 ) )
+
+# Writes each item as an SVG element to an open text file as it is created.
+class sm_svg_canvas( sm_export_canvas ):
+    def __init__( self, svg_file: object, x_origin: int = 0, y_origin: int = 0 ):
+        super().__init__( x_origin, y_origin )
+        self.svg_file = svg_file
+
+    # This method is for internal use only. Returns the stroke attributes,
+    # leaving out those the group already sets.
+    def get_stroke( self, width: float, colour: str ) -> str:
+        if width <= 0:
+            return " stroke=\"none\""
+        stroke = "" if width == 1 else f" stroke-width=\"{svg_number( width )}\""
+        if colour != "black":
+            stroke += f" stroke={xml.sax.saxutils.quoteattr( colour )}"
+        return stroke
+
+    # This method is for internal use only.
+    def get_fill( self, fill: str ) -> str:
+        return "" if fill is None else f" fill={xml.sax.saxutils.quoteattr( fill )}"
+
+    def draw_polyline( self, coords: list, width: float, fill: str ) -> None:
+        self.svg_file.write( f"<polyline points=\"{svg_points( coords )}\"{self.get_stroke( width, fill )}/>\n" )
+
+    def draw_polygon( self, coords: list, fill: str ) -> None:
+        self.svg_file.write( f"<polygon points=\"{svg_points( coords )}\" stroke=\"none\"{self.get_fill( fill )}/>\n" )
+
+    def draw_arc( self, coords: list, start: float, extent: float, width: float, outline: str ) -> None:
+        ( x0, y0, x1, y1 ) = coords
+        ( cx, cy, rx, ry ) = ( ( x0 + x1 ) / 2, ( y0 + y1 ) / 2, abs( x1 - x0 ) / 2, abs( y1 - y0 ) / 2 )
+        ( start, end ) = ( math.radians( start ), math.radians( start + extent ) )
+        # Counterclockwise on screen, where y runs down, is SVG's negative sweep.
+        self.svg_file.write( "<path d=\"M {} {} A {} {} 0 {} {} {} {}\"{}/>\n".format(
+            svg_number( cx + rx * math.cos( start ) ), svg_number( cy - ry * math.sin( start ) ),
+            svg_number( rx ), svg_number( ry ), 1 if abs( extent ) > 180 else 0, 0 if extent > 0 else 1,
+            svg_number( cx + rx * math.cos( end ) ), svg_number( cy - ry * math.sin( end ) ),
+            self.get_stroke( width, outline ) ) )
+
+    def draw_rectangle( self, coords: list, width: float, outline: str, fill: str ) -> None:
+        ( x0, y0, x1, y1 ) = coords
+        self.svg_file.write( f"<rect x=\"{svg_number( min( x0, x1 ) )}\" y=\"{svg_number( min( y0, y1 ) )}\" "
+            f"width=\"{svg_number( abs( x1 - x0 ) )}\" height=\"{svg_number( abs( y1 - y0 ) )}\"{self.get_stroke( width, outline )}{self.get_fill( fill )}/>\n" )
+
+    def draw_oval( self, coords: list, width: float, outline: str, fill: str ) -> None:
+        ( x0, y0, x1, y1 ) = coords
+        self.svg_file.write( f"<ellipse cx=\"{svg_number( ( x0 + x1 ) / 2 )}\" cy=\"{svg_number( ( y0 + y1 ) / 2 )}\" "
+            f"rx=\"{svg_number( abs( x1 - x0 ) / 2 )}\" ry=\"{svg_number( abs( y1 - y0 ) / 2 )}\"{self.get_stroke( width, outline )}{self.get_fill( fill )}/>\n" )
+
+    def draw_text( self, x: float, y: float, text: str, fill: str ) -> None:
+        self.svg_file.write( f"<text x=\"{svg_number( x )}\" y=\"{svg_number( y )}\" stroke=\"none\"{self.get_fill( fill )}>{xml.sax.saxutils.escape( text )}</text>\n" )
+
+
+# Draws each item on a PIL image as it is created.
+class sm_pil_canvas( sm_export_canvas ):
+    def __init__( self, draw: object, font: object, x_origin: int = 0, y_origin: int = 0 ):
+        super().__init__( x_origin, y_origin )
+        self.draw = draw
+        self.font = font
+
+    def draw_polyline( self, coords: list, width: float, fill: str ) -> None:
+        self.draw.line( coords, fill = fill, width = max( 1, round( width ) ), joint = "curve" )
+
+    def draw_polygon( self, coords: list, fill: str ) -> None:
+        self.draw.polygon( coords, fill = fill )
+
+    def draw_arc( self, coords: list, start: float, extent: float, width: float, outline: str ) -> None:
+        if width <= 0:
+            return
+        # PIL's angles run clockwise.
+        ( first, last ) = sorted( ( -start, -( start + extent ) ) )
+        self.draw.arc( get_box( coords ), first, last, fill = outline, width = max( 1, round( width ) ) )
+
+    def draw_rectangle( self, coords: list, width: float, outline: str, fill: str ) -> None:
+        self.draw.rectangle( get_box( coords ), fill = fill, outline = outline if width > 0 else None, width = round( width ) )
+
+    def draw_oval( self, coords: list, width: float, outline: str, fill: str ) -> None:
+        self.draw.ellipse( get_box( coords ), fill = fill, outline = outline if width > 0 else None, width = round( width ) )
+
+    def draw_text( self, x: float, y: float, text: str, fill: str ) -> None:
+        ( lft, top, rgt, btm ) = self.draw.textbbox( ( 0, 0 ), text, font = self.font )
+        self.draw.text( ( x - ( lft + rgt ) / 2, y - ( top + btm ) / 2 ), text, fill = fill, font = self.font )
+
+# This function is for internal use only. Returns the box ( x0, y0, x1, y1 )
+# with x0 <= x1 and y0 <= y1, as PIL needs.
+def get_box( coords: list ) -> tuple:
+    ( x0, y0, x1, y1 ) = coords
+    return ( min( x0, x1 ), min( y0, y1 ), max( x0, x1 ), max( y0, y1 ) )
+
+
+# Writes the diagram, as shown, to an SVG file, scaled by zoom. The elements
+# are written as the diagram is painted, a tile at a time, so neither the
+# items nor the document are ever held in memory. The diagram's own canvas is
+# replaced, so it is of no further use in the editor.
+def export_svg( diagram: object, filename: str, zoom: float = 1.0, tile_pix: int = DEFAULT_TILE_PIX ) -> None:
+    diagram.set_zoom( zoom )
+    rect = get_export_rect( diagram )
+    ( lft, top, wid, hgt ) = rect
+    with open( filename, "w", encoding = "utf-8" ) as svg_file:
+        svg_file.write( "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n" )
+        svg_file.write( f"<svg xmlns=\"http://www.w3.org/2000/svg\" width=\"{wid}\" height=\"{hgt}\" viewBox=\"0 0 {wid} {hgt}\">\n" )
+        svg_file.write( f"<rect width=\"100%\" height=\"100%\" fill=\"{BACKGROUND_COLOUR}\"/>\n" )
+        svg_file.write( f"<g fill=\"none\" stroke=\"black\" stroke-linecap=\"butt\" stroke-linejoin=\"round\" font-family=\"{FONT_FAMILY}\" "
+            f"font-size=\"{FONT_PIX}\" text-anchor=\"middle\" dominant-baseline=\"central\">\n" )
+        canvas = sm_svg_canvas( svg_file, lft, top )
+        for ( col, row, tile_lft, tile_top, tile_wid, tile_hgt ) in get_tiles( rect, tile_pix ):
+            paint_area( diagram, canvas, tile_lft, tile_top, tile_wid, tile_hgt, owned_only = True )
+        svg_file.write( "</g>\n</svg>\n" )
+
+# Returns the names of the PNG files export_png() writes for the given
+# number of tile columns and rows: just filename for a single tile, otherwise
+# one per tile, with its row and column added, e.g. "model_r0_c1.png".
+def get_png_filenames( filename: str, num_cols: int, num_rows: int ) -> list:
+    if num_cols == 1 and num_rows == 1:
+        return [ filename ]
+    ( root, ext ) = os.path.splitext( filename )
+    return [ f"{root}_r{row}_c{col}{ext}" for row in range( num_rows ) for col in range( num_cols ) ]
+
+# Writes the diagram, as shown, as a PNG, scaled by zoom. Only one tile of at
+# most tile_pix square is drawn at a time, each written to its own file if
+# there is more than one, see get_png_filenames(). Returns the files written.
+# The diagram's own canvas is replaced, so it is of no further use in the editor.
+def export_png( diagram: object, filename: str, zoom: float = 1.0, tile_pix: int = DEFAULT_TILE_PIX ) -> list:
+    # Only imported here, as nothing else needs PIL.
+    from PIL import Image, ImageDraw, ImageFont
+    try:
+        font = ImageFont.load_default( size = FONT_PIX )
+    except TypeError:
+        # Before Pillow 10.1 the default font has the one size.
+        font = ImageFont.load_default()
+
+    diagram.set_zoom( zoom )
+    tiles = get_tiles( get_export_rect( diagram ), tile_pix )
+    filenames = get_png_filenames( filename, tiles[ -1 ][ 0 ] + 1, tiles[ -1 ][ 1 ] + 1 )
+    for ( ( col, row, tile_lft, tile_top, tile_wid, tile_hgt ), tile_filename ) in zip( tiles, filenames ):
+        image = Image.new( "RGB", ( tile_wid, tile_hgt ), BACKGROUND_COLOUR )
+        canvas = sm_pil_canvas( ImageDraw.Draw( image ), font, tile_lft, tile_top )
+        paint_area( diagram, canvas, tile_lft, tile_top, tile_wid, tile_hgt )
+        image.save( tile_filename, "PNG" )
+    return filenames
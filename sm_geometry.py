@@ -0,0 +1,285 @@
+from array import array
+
+# NumPy is optional; without it the callers keep to their scalar code.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Compact storage for the layout of a model.
+#
+# State rectangles are held in columns of machine integers indexed by a state
+# id, and each transition's path is a single flat buffer of x, y pairs, rather
+# than a dict per rectangle and per point. The JSON dict form is only read when
+# states and paths are added at load time, and rebuilt by export_layout() on save.
+class sm_geometry_store():
+    def __init__( self ):
+        # State name -> id, and id -> state name ( None for a freed id ).
+        self.ids = {}
+        self.names = []
+        self.free_ids = []
+        self.lft = array( 'i' )
+        self.top = array( 'i' )
+        self.wid = array( 'i' )
+        self.hgt = array( 'i' )
+        # ( state name, transition name ) -> array( 'i' ) of x0, y0, x1, y1, ...
+        self.paths = {}
+
+    def add_state( self, name: str, lft: int, top: int, wid: int, hgt: int ) -> int:
+        assert( name not in self.ids )
+        if self.free_ids:
+            state_id = self.free_ids.pop()
+            self.names[ state_id ] = name
+        else:
+            state_id = len( self.names )
+            self.names.append( name )
+            self.lft.append( 0 )
+            self.top.append( 0 )
+            self.wid.append( 0 )
+            self.hgt.append( 0 )
+        self.ids[ name ] = state_id
+        self.set_rect( state_id, lft, top, wid, hgt )
+        return state_id
+
+    def remove_state( self, name: str ) -> None:
+        state_id = self.ids.pop( name )
+        self.names[ state_id ] = None
+        self.free_ids.append( state_id )
+
+    def rename_state( self, old_name: str, new_name: str ) -> None:
+        state_id = self.ids.pop( old_name )
+        self.ids[ new_name ] = state_id
+        self.names[ state_id ] = new_name
+        for key in [ key for key in self.paths if key[ 0 ] == old_name ]:
+            self.paths[ ( new_name, key[ 1 ] ) ] = self.paths.pop( key )
+
+    def get_id( self, name: str ) -> int:
+        return self.ids.get( name )
+
+    # Returns ( lft, top, wid, hgt ) for a state id.
+    def get_rect( self, state_id: int ) -> tuple:
+        return ( self.lft[ state_id ], self.top[ state_id ], self.wid[ state_id ], self.hgt[ state_id ] )
+
+    def set_rect( self, state_id: int, lft: int, top: int, wid: int, hgt: int ) -> None:
+        self.lft[ state_id ] = int( lft )
+        self.top[ state_id ] = int( top )
+        self.wid[ state_id ] = int( wid )
+        self.hgt[ state_id ] = int( hgt )
+
+    # Returns the ( lft, top, rgt, btm ) enclosing every state, or None if there are none.
+    def get_extents( self ) -> tuple:
+        if not self.ids:
+            return None
+        state_ids = self.ids.values()
+        return ( min( self.lft[ state_id ] for state_id in state_ids ),
+                 min( self.top[ state_id ] for state_id in state_ids ),
+                 max( self.lft[ state_id ] + self.wid[ state_id ] for state_id in state_ids ),
+                 max( self.top[ state_id ] + self.hgt[ state_id ] for state_id in state_ids ) )
+
+    def get_state_view( self, state_id: int ) -> object:
+        return sm_state_geometry( self, state_id )
+
+    def get_transition_view( self, key: tuple ) -> object:
+        return sm_transition_geometry( self, key )
+
+    # Paths are passed in and out as lists of { "x", "y" } points, the form
+    # the routing code works in.
+    def set_path( self, key: tuple, path: list ) -> None:
+        points = array( 'i' )
+        for point in path:
+            points.append( int( point[ "x" ] ) )
+            points.append( int( point[ "y" ] ) )
+        self.paths[ key ] = points
+
+    def get_path( self, key: tuple ) -> list:
+        points = self.paths.get( key )
+        if points is None:
+            return None
+        return [ { "x": points[ idx ], "y": points[ idx + 1 ] } for idx in range( 0, len( points ), 2 ) ]
+
+    # A copy of the flat x0, y0, x1, y1, ... buffer of a path, or None.
+    def get_points( self, key: tuple ) -> array:
+        points = self.paths.get( key )
+        if points is None:
+            return None
+        return array( 'i', points )
+
+    def set_points( self, key: tuple, points: array ) -> None:
+        self.paths[ key ] = array( 'i', points )
+
+    def has_path( self, key: tuple ) -> bool:
+        return key in self.paths
+
+    def remove_path( self, key: tuple ) -> None:
+        self.paths.pop( key, None )
+
+    def rename_path( self, old_key: tuple, new_key: tuple ) -> None:
+        if old_key in self.paths:
+            self.paths[ new_key ] = self.paths.pop( old_key )
+
+    # Moves the transition paths of a set of states into the store, removing
+    # them from the states' dicts. Returns the keys of the paths moved.
+    # States are added separately, see add_state().
+    def load_paths( self, states: dict, path_key: str, tran_key: str ) -> list:
+        loaded = []
+        for state_name, state in states.items():
+            for transition_name, transition in state.get( tran_key, {} ).items():
+                path = transition.pop( path_key, None )
+                if path is not None:
+                    self.set_path( ( state_name, transition_name ), path )
+                    loaded.append( ( state_name, transition_name ) )
+        return loaded
+
+    # Builds the JSON dict form of a model with the stored layout put back.
+    # The model itself is not modified. States and transitions are copied
+    # one level deep, and the layouts and paths of nested states which are
+    # not in the store, which are moved in place, are copied too, so the
+    # result shares nothing an edit changes.
+    def export_layout( self, model: dict, layout_key: str, path_key: str, states_key: str, tran_key: str ) -> dict:
+        exported = dict( model )
+        exported[ states_key ] = self.export_states( model.get( states_key, {} ), layout_key, path_key, states_key, tran_key )
+        return exported
+
+    def export_states( self, states: dict, layout_key: str, path_key: str, states_key: str, tran_key: str ) -> dict:
+        exported_states = {}
+        for state_name, state in list( states.items() ):
+            exported_state = dict( state )
+            transitions = state.get( tran_key )
+            if transitions:
+                exported_transitions = {}
+                for transition_name, transition in list( transitions.items() ):
+                    exported_transition = dict( transition )
+                    path = self.get_path( ( state_name, transition_name ) )
+                    if path is not None:
+                        exported_transition[ path_key ] = path
+                    elif path_key in transition:
+                        exported_transition[ path_key ] = [ dict( point ) for point in transition[ path_key ] ]
+                    exported_transitions[ transition_name ] = exported_transition
+                exported_state[ tran_key ] = exported_transitions
+            substates = state.get( states_key )
+            if substates is not None:
+                exported_state[ states_key ] = self.export_states( substates, layout_key, path_key, states_key, tran_key )
+            state_id = self.ids.get( state_name )
+            if state_id is not None:
+                ( lft, top, wid, hgt ) = self.get_rect( state_id )
+                exported_state[ layout_key ] = { "x": lft, "y": top, "w": wid, "h": hgt }
+            elif layout_key in state:
+                exported_state[ layout_key ] = dict( state[ layout_key ] )
+            exported_states[ state_name ] = exported_state
+        return exported_states
+
+
+# A view of one state's rectangle in a geometry store.
+class sm_state_geometry():
+    __slots__ = ( "store", "id" )
+
+    def __init__( self, store: sm_geometry_store, state_id: int ):
+        self.store = store
+        self.id = state_id
+
+    @property
+    def x( self ) -> int:
+        return self.store.lft[ self.id ]
+
+    @x.setter
+    def x( self, value: int ) -> None:
+        self.store.lft[ self.id ] = int( value )
+
+    @property
+    def y( self ) -> int:
+        return self.store.top[ self.id ]
+
+    @y.setter
+    def y( self, value: int ) -> None:
+        self.store.top[ self.id ] = int( value )
+
+    @property
+    def w( self ) -> int:
+        return self.store.wid[ self.id ]
+
+    @w.setter
+    def w( self, value: int ) -> None:
+        self.store.wid[ self.id ] = int( value )
+
+    @property
+    def h( self ) -> int:
+        return self.store.hgt[ self.id ]
+
+    @h.setter
+    def h( self, value: int ) -> None:
+        self.store.hgt[ self.id ] = int( value )
+
+
+# A view of one transition's path in a geometry store.
+class sm_transition_geometry():
+    __slots__ = ( "store", "key" )
+
+    def __init__( self, store: sm_geometry_store, key: tuple ):
+        self.store = store
+        self.key = key
+
+    # The flat x0, y0, x1, y1, ... buffer, or None if the transition has no path.
+    def get_points( self ) -> array:
+        return self.store.paths.get( self.key )
+
+    def get_num_points( self ) -> int:
+        points = self.store.paths.get( self.key )
+        if points is None:
+            return 0
+        return len( points ) // 2
+
+    def get_point( self, idx: int ) -> dict:
+        points = self.store.paths[ self.key ]
+        return { "x": points[ idx * 2 ], "y": points[ idx * 2 + 1 ] }
+
+
+# True if the batched kernels below can be used.
+def have_vector_kernel() -> bool:
+    return numpy is not None
+
+# Tests every segment against every edge of every rectangle in one go.
+#
+# segments is a sequence of ( ax, ay, bx, by ) and rects a sequence of
+# ( lft, top, rgt, btm ). The edges of each rectangle are taken in the order
+# top, right, bottom, left, i.e. clockwise from the upper left corner, as in
+# sm_state_outline.get_path(). Returns ( mask, points ), where mask[ s, r, e ]
+# is True if segment s properly crosses edge e of rect r, using the same
+# counter-clockwise test as do_lines_intersect(), and points[ s, r, e ] is the
+# ( x, y ) where the two lines meet, or NaN where they are parallel.
+def intersect_segments_rects( segments, rects ) -> tuple:
+    seg = numpy.asarray( segments, dtype = numpy.int64 ).reshape( -1, 1, 1, 4 )
+    rct = numpy.asarray( rects, dtype = numpy.int64 ).reshape( 1, -1, 4 )
+    ( lft, top, rgt, btm ) = ( rct[ ..., 0 ], rct[ ..., 1 ], rct[ ..., 2 ], rct[ ..., 3 ] )
+    # Edge end points, shape ( 1, R, 4 ).
+    cx = numpy.stack( ( lft, rgt, rgt, lft ), axis = -1 )
+    cy = numpy.stack( ( top, top, btm, btm ), axis = -1 )
+    dx = numpy.stack( ( rgt, rgt, lft, lft ), axis = -1 )
+    dy = numpy.stack( ( top, btm, btm, top ), axis = -1 )
+    ( ax, ay, bx, by ) = ( seg[ ..., 0 ], seg[ ..., 1 ], seg[ ..., 2 ], seg[ ..., 3 ] )
+
+    def ccw( px, py, qx, qy, rx, ry ):
+        return ( ry - py ) * ( qx - px ) > ( qy - py ) * ( rx - px )
+
+    mask = ( ( ccw( ax, ay, cx, cy, dx, dy ) != ccw( bx, by, cx, cy, dx, dy ) )
+           & ( ccw( ax, ay, bx, by, cx, cy ) != ccw( ax, ay, bx, by, dx, dy ) ) )
+
+    # The intersection of the two lines, as in line_intersection().
+    x_diff_a = ax - bx
+    y_diff_a = ay - by
+    x_diff_b = cx - dx
+    y_diff_b = cy - dy
+    div = x_diff_a * y_diff_b - y_diff_a * x_diff_b
+    det_a = ax * by - ay * bx
+    det_b = cx * dy - cy * dx
+    with numpy.errstate( divide = "ignore", invalid = "ignore" ):
+        x = ( det_a * x_diff_b - det_b * x_diff_a ) / div
+        y = ( det_a * y_diff_b - det_b * y_diff_a ) / div
+    x = numpy.where( div == 0, numpy.nan, x )
+    y = numpy.where( div == 0, numpy.nan, y )
+    return ( mask, numpy.stack( ( x, y ), axis = -1 ) )
+
+# Returns the ( segment, rect, edge ) index triples set in a mask from
+# intersect_segments_rects(), ordered by segment, then rect, then edge.
+def get_crossings( mask ) -> list:
+    return [ tuple( idx ) for idx in numpy.argwhere( mask ).tolist() ]
@@ -0,0 +1,165 @@
+import math
+
+
+# A uniform grid of square cells covering the layout plane. Each state's
+# rectangle is registered in every cell it overlaps, so a query only has to
+# look at the few cells under the area of interest rather than every state
+# in the model.
+class sm_spatial_index():
+    def __init__( self, cell_size: int ):
+        assert( cell_size > 0 )
+        self.cell_size = cell_size
+        # State name -> ( lft, top, rgt, btm ).
+        self.rects = {}
+        # State name -> insertion sequence, so query results come back in model order.
+        self.order = {}
+        self.next_order = 0
+        # ( col, row ) -> set of state names overlapping that cell.
+        self.cells = {}
+
+    # Returns the inclusive ( col, row ) ranges of the cells covering a rectangle.
+    def get_cell_range( self, lft, top, rgt, btm ) -> tuple:
+        col_1 = math.floor( lft / self.cell_size )
+        row_1 = math.floor( top / self.cell_size )
+        col_2 = math.floor( rgt / self.cell_size )
+        row_2 = math.floor( btm / self.cell_size )
+        return ( col_1, row_1, col_2, row_2 )
+
+    # Add a state, or move it if it is already indexed.
+    def update( self, name: str, lft: int, top: int, wid: int, hgt: int ) -> None:
+        rect = ( lft, top, lft + wid, top + hgt )
+        if self.rects.get( name ) == rect:
+            return
+
+        if name in self.rects:
+            self.remove_from_cells( name )
+        else:
+            self.order[ name ] = self.next_order
+            self.next_order += 1
+
+        self.rects[ name ] = rect
+        ( col_1, row_1, col_2, row_2 ) = self.get_cell_range( *rect )
+        for col in range( col_1, col_2 + 1 ):
+            for row in range( row_1, row_2 + 1 ):
+                self.cells.setdefault( ( col, row ), set() ).add( name )
+
+    def remove( self, name: str ) -> None:
+        if name in self.rects:
+            self.remove_from_cells( name )
+            del self.rects[ name ]
+            del self.order[ name ]
+
+    # This method is for internal use only, the rectangle itself is left in place.
+    def remove_from_cells( self, name: str ) -> None:
+        ( col_1, row_1, col_2, row_2 ) = self.get_cell_range( *self.rects[ name ] )
+        for col in range( col_1, col_2 + 1 ):
+            for row in range( row_1, row_2 + 1 ):
+                cell = self.cells.get( ( col, row ) )
+                if cell is not None:
+                    cell.discard( name )
+                    if not cell:
+                        del self.cells[ ( col, row ) ]
+
+    def get_rect( self, name: str ) -> tuple:
+        return self.rects.get( name )
+
+    # Returns the ( lft, top, rgt, btm ) around every rectangle, or None if
+    # there are none.
+    def get_extents( self ) -> tuple:
+        if not self.rects:
+            return None
+        return ( min( rect[ 0 ] for rect in self.rects.values() ), min( rect[ 1 ] for rect in self.rects.values() ),
+                 max( rect[ 2 ] for rect in self.rects.values() ), max( rect[ 3 ] for rect in self.rects.values() ) )
+
+    # Returns the names of the states whose rectangles overlap the given one
+    # (edges touching counts as overlapping), in the order they were indexed.
+    def query_rect( self, lft, top, rgt, btm ) -> list:
+        found = set()
+        ( col_1, row_1, col_2, row_2 ) = self.get_cell_range( lft, top, rgt, btm )
+        for col in range( col_1, col_2 + 1 ):
+            for row in range( row_1, row_2 + 1 ):
+                cell = self.cells.get( ( col, row ) )
+                if cell:
+                    found.update( cell )
+
+        result = []
+        for name in found:
+            ( s_lft, s_top, s_rgt, s_btm ) = self.rects[ name ]
+            if s_lft <= rgt and lft <= s_rgt and s_top <= btm and top <= s_btm:
+                result.append( name )
+        result.sort( key = self.order.get )
+        return result
+
+    # Returns the candidate states for the line segment from point A to point B,
+    # i.e. those whose rectangles overlap the segment's bounding box.
+    def query_segment( self, A: dict, B: dict ) -> list:
+        return self.query_rect(
+            min( A[ 'x' ], B[ 'x' ] ), min( A[ 'y' ], B[ 'y' ] ),
+            max( A[ 'x' ], B[ 'x' ] ), max( A[ 'y' ], B[ 'y' ] ) )
+
+
+# Incoming and outgoing adjacency for the transitions of a model. Transitions
+# are identified by ( source state name, transition name ) keys, so finding the
+# transitions attached to a state costs O( degree ) rather than a walk over
+# every transition in the model.
+class sm_transition_index():
+    def __init__( self ):
+        # Transition key -> destination state name.
+        self.dests = {}
+        # State name -> { transition key: None } for transitions leaving / entering it.
+        # Dictionaries are used as ordered sets to keep iteration in model order.
+        self.outgoing = {}
+        self.incoming = {}
+
+    def add_transition( self, src_name: str, transition_name: str, dst_name: str ) -> None:
+        key = ( src_name, transition_name )
+        if key in self.dests:
+            self.remove_transition( src_name, transition_name )
+        self.dests[ key ] = dst_name
+        self.outgoing.setdefault( src_name, {} )[ key ] = None
+        self.incoming.setdefault( dst_name, {} )[ key ] = None
+
+    def remove_transition( self, src_name: str, transition_name: str ) -> None:
+        key = ( src_name, transition_name )
+        dst_name = self.dests.pop( key, None )
+        if dst_name is None:
+            return
+        self.outgoing[ src_name ].pop( key, None )
+        if not self.outgoing[ src_name ]:
+            del self.outgoing[ src_name ]
+        self.incoming[ dst_name ].pop( key, None )
+        if not self.incoming[ dst_name ]:
+            del self.incoming[ dst_name ]
+
+    # Drops every transition into or out of the state, returning their keys.
+    def remove_state( self, name: str ) -> list:
+        removed = self.get_connected( name )
+        for ( src_name, transition_name ) in removed:
+            self.remove_transition( src_name, transition_name )
+        return removed
+
+    def rename_state( self, old_name: str, new_name: str ) -> None:
+        connected = [ ( key, self.dests[ key ] ) for key in self.get_connected( old_name ) ]
+        for ( ( src_name, transition_name ), dst_name ) in connected:
+            self.remove_transition( src_name, transition_name )
+        for ( ( src_name, transition_name ), dst_name ) in connected:
+            if src_name == old_name:
+                src_name = new_name
+            if dst_name == old_name:
+                dst_name = new_name
+            self.add_transition( src_name, transition_name, dst_name )
+
+    def get_dest( self, src_name: str, transition_name: str ) -> str:
+        return self.dests.get( ( src_name, transition_name ) )
+
+    def get_outgoing( self, name: str ) -> list:
+        return list( self.outgoing.get( name, {} ) )
+
+    def get_incoming( self, name: str ) -> list:
+        return list( self.incoming.get( name, {} ) )
+
+    # Returns the keys of all transitions entering or leaving the state, each once.
+    def get_connected( self, name: str ) -> list:
+        connected = dict( self.incoming.get( name, {} ) )
+        connected.update( self.outgoing.get( name, {} ) )
+        return list( connected )
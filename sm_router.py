@@ -0,0 +1,266 @@
+import bisect
+import collections
+import heapq
+
+
+# Directions of travel, as ( dx, dy ): right, down, left and up.
+DIRECTIONS = ( ( 1, 0 ), ( 0, 1 ), ( -1, 0 ), ( 0, -1 ) )
+# In place of a direction, for a node where a goal has been reached.
+ARRIVED = len( DIRECTIONS )
+NUM_NODE_KINDS = ARRIVED + 1
+
+
+# Finds orthogonal paths around rectangular obstacles.
+#
+# Rather than searching every point of the lattice, the search runs over the
+# sparse grid formed by the lines through the obstacle edges, the corridor
+# edges and the end points, i.e. the only places a shortest orthogonal path
+# needs to turn. With the coordinates all on the lattice, so is the path.
+# The cost of a path is its length plus bend_cost for each bend, so among
+# paths of much the same length, the one with the fewest bends is chosen.
+#
+# With weight above 1 the search is greedier, taking paths up to that factor
+# costlier than the cheapest in return for exploring far fewer nodes, and it
+# gives up after max_nodes nodes, setting gave_up.
+class sm_orthogonal_router():
+    def __init__( self, bend_cost: int, weight: float = 1.0, max_nodes: int = None ):
+        self.bend_cost = bend_cost
+        self.weight = weight
+        self.max_nodes = max_nodes
+        self.gave_up = False
+
+    # Returns the shortest path, as a list of ( x, y ) points at the ends and
+    # bends, from any of the starts to any of the goals, or None if there is
+    # none inside the corridor or none was found within max_nodes.
+    #
+    # starts is a sequence of ( x, y, direction ), the direction the path must
+    # leave in, and goals of ( x, y, direction ), the direction it should
+    # arrive in, arriving otherwise costing a bend. Directions index DIRECTIONS.
+    # obstacles is a sequence of ( lft, top, rgt, btm ); paths may run along
+    # their edges but not through them. corridor is the ( lft, top, rgt, btm )
+    # the search is confined to.
+    def route( self, starts: list, goals: list, obstacles: list, corridor: tuple ) -> list:
+        ( c_lft, c_top, c_rgt, c_btm ) = corridor
+        self.gave_up = False
+        # Ends buried inside an obstacle can never be left or reached.
+        def is_buried( end: tuple ) -> bool:
+            return any( lft < end[ 0 ] < rgt and top < end[ 1 ] < btm for ( lft, top, rgt, btm ) in obstacles )
+        starts = [ start for start in starts if not is_buried( start ) ]
+        goals = [ goal for goal in goals if not is_buried( goal ) ]
+        if not starts or not goals:
+            return None
+        xs = set( [ c_lft, c_rgt ] )
+        ys = set( [ c_top, c_btm ] )
+        for ( x, y, direction ) in starts + goals:
+            if not ( c_lft <= x <= c_rgt and c_top <= y <= c_btm ):
+                return None
+            xs.add( x )
+            ys.add( y )
+        for ( lft, top, rgt, btm ) in obstacles:
+            for x in ( lft, rgt ):
+                if c_lft < x < c_rgt:
+                    xs.add( x )
+            for y in ( top, btm ):
+                if c_top < y < c_btm:
+                    ys.add( y )
+        xs = sorted( xs )
+        ys = sorted( ys )
+
+        # Points of the grid are numbered i * len( ys ) + j for ( xs[ i ], ys[ j ] ),
+        # so a step right adds len( ys ) and a step down adds one. blocked_x is set
+        # for a point if the step right from it passes through an obstacle, and
+        # blocked_y likewise for the step down.
+        ( num_xs, num_ys ) = ( len( xs ), len( ys ) )
+        blocked_x = bytearray( num_xs * num_ys )
+        blocked_y = bytearray( num_xs * num_ys )
+        for ( lft, top, rgt, btm ) in obstacles:
+            i_1 = max( bisect.bisect_right( xs, lft ) - 1, 0 )
+            i_2 = bisect.bisect_left( xs, rgt )
+            j_1 = max( bisect.bisect_right( ys, top ) - 1, 0 )
+            j_2 = bisect.bisect_left( ys, btm )
+            # Steps across the obstacle, along the lines strictly inside it.
+            if i_1 < i_2:
+                for j in range( bisect.bisect_right( ys, top ), j_2 ):
+                    blocked_x[ i_1 * num_ys + j : i_2 * num_ys + j : num_ys ] = bytes( [ 1 ] ) * ( i_2 - i_1 )
+            if j_1 < j_2:
+                for i in range( bisect.bisect_right( xs, lft ), i_2 ):
+                    blocked_y[ i * num_ys + j_1 : i * num_ys + j_2 ] = bytes( [ 1 ] ) * ( j_2 - j_1 )
+
+        # For each direction: the change to the point number, and a function
+        # giving whether the step from a point can be taken, and its length.
+        def step_right( point: int ) -> int:
+            if point >= ( num_xs - 1 ) * num_ys or blocked_x[ point ]:
+                return None
+            i = point // num_ys
+            return xs[ i + 1 ] - xs[ i ]
+
+        def step_down( point: int ) -> int:
+            if point % num_ys == num_ys - 1 or blocked_y[ point ]:
+                return None
+            j = point % num_ys
+            return ys[ j + 1 ] - ys[ j ]
+
+        def step_left( point: int ) -> int:
+            if point < num_ys or blocked_x[ point - num_ys ]:
+                return None
+            i = point // num_ys
+            return xs[ i ] - xs[ i - 1 ]
+
+        def step_up( point: int ) -> int:
+            if point % num_ys == 0 or blocked_y[ point - 1 ]:
+                return None
+            j = point % num_ys
+            return ys[ j ] - ys[ j - 1 ]
+
+        steps = ( ( num_ys, step_right ), ( 1, step_down ), ( -num_ys, step_left ), ( -1, step_up ) )
+
+        x_index = { x: i for i, x in enumerate( xs ) }
+        y_index = { y: j for j, y in enumerate( ys ) }
+        goal_points = {}
+        for ( x, y, direction ) in goals:
+            goal_points.setdefault( x_index[ x ] * num_ys + y_index[ y ], [] ).append( direction )
+
+        # A lower bound on the cost left: the distance to the box around the
+        # goals, plus the fewest bends which could get there going in the
+        # given direction, i.e. one if it must turn to reach the box, and two
+        # if the box is behind it.
+        g_lft = min( goal[ 0 ] for goal in goals )
+        g_top = min( goal[ 1 ] for goal in goals )
+        g_rgt = max( goal[ 0 ] for goal in goals )
+        g_btm = max( goal[ 1 ] for goal in goals )
+        bend_cost = self.bend_cost
+        weight = self.weight
+
+        def estimate( point: int, direction: int ) -> float:
+            ( x, y ) = ( xs[ point // num_ys ], ys[ point % num_ys ] )
+            dx = g_lft - x if x < g_lft else ( g_rgt - x if x > g_rgt else 0 )
+            dy = g_top - y if y < g_top else ( g_btm - y if y > g_btm else 0 )
+            ( step_x, step_y ) = DIRECTIONS[ direction ]
+            if dx * step_x < 0 or dy * step_y < 0:
+                bends = 2
+            elif ( dx and not step_x ) or ( dy and not step_y ):
+                bends = 1
+            else:
+                bends = 0
+            return ( abs( dx ) + abs( dy ) + bends * bend_cost ) * weight
+
+        # Nodes are point * NUM_NODE_KINDS + the direction of travel, or
+        # + ARRIVED. Of the nodes with the same estimated total, those furthest
+        # along go first, which saves exploring the many equally short paths
+        # across open space.
+        costs = {}
+        parents = {}
+        frontier = []
+        for ( x, y, direction ) in starts:
+            point = x_index[ x ] * num_ys + y_index[ y ]
+            node = point * NUM_NODE_KINDS + direction
+            if node not in costs:
+                costs[ node ] = 0
+                parents[ node ] = None
+                heapq.heappush( frontier, ( estimate( point, direction ), 0, node ) )
+
+        num_nodes = 0
+        while frontier:
+            ( estimated, cost, node ) = heapq.heappop( frontier )
+            cost = -cost
+            if cost > costs[ node ]:
+                continue
+            num_nodes += 1
+            if self.max_nodes is not None and num_nodes > self.max_nodes:
+                self.gave_up = True
+                return None
+            ( point, direction ) = divmod( node, NUM_NODE_KINDS )
+            if direction == ARRIVED:
+                return self.get_points( node, parents, xs, ys )
+
+            for goal_direction in goal_points.get( point, () ):
+                goal_cost = cost + ( 0 if direction == goal_direction else bend_cost )
+                goal_node = point * NUM_NODE_KINDS + ARRIVED
+                if goal_cost < costs.get( goal_node, goal_cost + 1 ):
+                    costs[ goal_node ] = goal_cost
+                    parents[ goal_node ] = node
+                    heapq.heappush( frontier, ( goal_cost, -goal_cost, goal_node ) )
+
+            for next_direction in range( len( DIRECTIONS ) ):
+                if next_direction == ( direction + 2 ) % 4:
+                    # No doubling back.
+                    continue
+                ( delta, step ) = steps[ next_direction ]
+                length = step( point )
+                if length is None:
+                    continue
+                next_cost = cost + length
+                if next_direction != direction:
+                    next_cost += bend_cost
+                next_point = point + delta
+                next_node = next_point * NUM_NODE_KINDS + next_direction
+                if next_cost < costs.get( next_node, next_cost + 1 ):
+                    costs[ next_node ] = next_cost
+                    parents[ next_node ] = node
+                    heapq.heappush( frontier, ( next_cost + estimate( next_point, next_direction ), -next_cost, next_node ) )
+        return None
+
+    # This method is for internal use only. Walks back from the goal, keeping
+    # only the end points and those where the direction changes.
+    def get_points( self, goal_node: int, parents: dict, xs: list, ys: list ) -> list:
+        nodes = []
+        node = parents[ goal_node ]
+        while node is not None:
+            nodes.append( divmod( node, NUM_NODE_KINDS ) )
+            node = parents[ node ]
+        nodes.reverse()
+
+        num_ys = len( ys )
+        def get_point( point: int ) -> tuple:
+            return ( xs[ point // num_ys ], ys[ point % num_ys ] )
+
+        points = [ get_point( nodes[ 0 ][ 0 ] ) ]
+        for idx in range( 1, len( nodes ) - 1 ):
+            if nodes[ idx ][ 1 ] != nodes[ idx + 1 ][ 1 ]:
+                points.append( get_point( nodes[ idx ][ 0 ] ) )
+        if len( nodes ) > 1:
+            points.append( get_point( nodes[ -1 ][ 0 ] ) )
+        return points
+
+
+# A least recently used cache of routes.
+#
+# Routes are keyed by everything that decides them: the end points, the
+# corridor and the obstacles in it. The obstacles stand in for a version of
+# the region the route passes through, one which comes back to the same value
+# when a move is undone or the model is reloaded, so those are hits, as is a
+# route past states moved elsewhere, while any change inside the region is a
+# miss. Up to max_entries routes are kept, forgetting the least recently used.
+class sm_route_cache():
+    def __init__( self, max_entries: int ):
+        assert( max_entries > 0 )
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the key for a route() call.
+    def get_key( self, starts: list, goals: list, obstacles: list, corridor: tuple ) -> tuple:
+        return ( tuple( starts ), tuple( goals ), tuple( corridor ), tuple( sorted( obstacles ) ) )
+
+    # Returns what was stored for the key, making it the most recently used,
+    # or None if it is not in the cache.
+    def get( self, key: tuple ) -> object:
+        entry = self.entries.get( key )
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end( key )
+        return entry
+
+    def put( self, key: tuple, entry: object ) -> None:
+        self.entries[ key ] = entry
+        self.entries.move_to_end( key )
+        while len( self.entries ) > self.max_entries:
+            self.entries.popitem( last = False )
+
+    def clear( self ) -> None:
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,66 @@
+import random
+import time
+
+import sm_compiler
+
+
+# Steps through a model one event at a time, as the runtime would run it,
+# using its compiled dispatch table, see sm_compiler. The model is compiled
+# once, when the simulator is made, so it doesn't follow later edits.
+class sm_simulator():
+    def __init__( self, model: dict ):
+        self.compiled = sm_compiler.compile_model( model )
+        # The exit and entry actions of the last step.
+        self.actions = []
+        self.machine = sm_compiler.sm_compiled_machine( self.compiled, self.actions.append )
+        self.rng = random.Random()
+
+    # Returns the events the model has, its "events" list first.
+    def get_event_names( self ) -> list:
+        return self.compiled[ "events" ]
+
+    # Enters the start state and follows its auto transition.
+    def reset( self ) -> None:
+        self.actions.clear()
+        self.machine.start()
+
+    # Fires the named event at the active state. Returns whether a transition
+    # was taken; an event nothing handles, e.g. a typing mistake, is dropped.
+    def fire( self, event_name: str ) -> bool:
+        self.actions.clear()
+        return self.machine.dispatch_name( event_name )
+
+    def get_active_name( self ) -> str:
+        return self.machine.get_active_name()
+
+    # Returns the ( state name, transition name ) of the last transition taken, or None.
+    def get_last_transition( self ) -> tuple:
+        return self.machine.last_transition
+
+    # Returns the actions run by the last fire() or reset().
+    def get_actions( self ) -> list:
+        return list( self.actions )
+
+    # Fires num_events events, picked at random from the model's, as fast as
+    # it can, and returns { "events", "taken", "seconds", "events_per_sec" }.
+    # Only the dispatching is timed, and no actions are kept.
+    def run_random( self, num_events: int ) -> dict:
+        result = { "events": 0, "taken": 0, "seconds": 0.0, "events_per_sec": 0.0 }
+        num_event_names = len( self.get_event_names() )
+        if num_event_names == 0 or num_events <= 0:
+            return result
+        event_ids = [ self.rng.randrange( num_event_names ) for idx in range( num_events ) ]
+        self.actions.clear()
+        ( on_action, self.machine.on_action ) = ( self.machine.on_action, None )
+        num_taken = self.machine.num_taken
+        dispatch = self.machine.dispatch
+        start = time.perf_counter()
+        for event_id in event_ids:
+            dispatch( event_id )
+        secs = time.perf_counter() - start
+        self.machine.on_action = on_action
+        result[ "events" ] = num_events
+        result[ "taken" ] = self.machine.num_taken - num_taken
+        result[ "seconds" ] = secs
+        result[ "events_per_sec" ] = num_events / max( secs, 1e-9 )
+        return result
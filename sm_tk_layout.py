@@ -0,0 +1,126 @@
+# Note: Tkinter is usually auto-installed with python, but if you get "ImportError: No module named Tkinter":
+# python -m pip install python3-tk
+import tkinter as tk
+import ccd_ui_hsm
+import sm_canvas
+
+
+# The State Machine Layout Widget
+# Shows an sm_diagram on a scrollable Tk canvas filling the frame.
+#
+# The bounds of the model may be given, as returned by get_bounds() when the
+# same model was last loaded, e.g. from the model cache, to save finding them.
+class sm_layout( tk.Frame, ccd_ui_hsm.sm_diagram ):
+    def __init__( self, *args, model: dict = None, route_missing: bool = True, bounds: dict = None, **kwargs ):
+        #print( f"frm = {self} = {self.winfo_width()}x{self.winfo_height()}+{self.winfo_x()}+{self.winfo_y()}" )
+        tk.Frame.__init__( self, *args, bd = 0, highlightthickness = 0, relief = 'ridge', **kwargs )
+        self.grid( row = 0, column = 0, padx = 0, pady = 0 )
+        self.grid_propagate( False )
+        self.grid_rowconfigure( 0, weight = 1 )
+        self.grid_columnconfigure( 0, weight = 1 )
+
+        # Start the view at the top left of the model, or the origin if further.
+        # The frame doesn't propagate, so it will be the size asked for, with no
+        # need to wait for Tk to lay it out.
+        canv_w = self.winfo_reqwidth()
+        canv_h = self.winfo_reqheight()
+        bounds = bounds or {}
+        if "extents" in bounds:
+            self.model_extents = bounds[ "extents" ]
+        else:
+            self.model_extents = ccd_ui_hsm.get_model_extents( model )
+        canv_geom = ccd_ui_hsm.find_canvas_rect( model, min_w = canv_w, min_h = canv_h, extents = self.model_extents )
+        #print( f"F Wrk Frame = {self.winfo_width()}x{self.winfo_height()}" )
+        canvas = sm_canvas.sm_tk_canvas( self, width = canv_w, height = canv_h, bd = 0, highlightthickness = 0, relief = 'ridge',
+            background = "white", xscrollincrement = ccd_ui_hsm.GRID_PIX, yscrollincrement = ccd_ui_hsm.GRID_PIX )
+        self.x_scroll = tk.Scrollbar( self, orient = tk.HORIZONTAL, command = self.scroll_x )
+        self.y_scroll = tk.Scrollbar( self, orient = tk.VERTICAL, command = self.scroll_y )
+        canvas.widget.configure( xscrollcommand = self.x_scroll.set, yscrollcommand = self.y_scroll.set )
+        canvas.widget.grid( row = 0, column = 0, padx = 0, pady = 0, sticky = "nsew" )
+        self.y_scroll.grid( row = 0, column = 1, sticky = "ns" )
+        self.x_scroll.grid( row = 1, column = 0, sticky = "ew" )
+        ccd_ui_hsm.sm_diagram.__init__( self, model, canvas, canv_w, canv_h, route_missing = route_missing,
+            view_lft = canv_geom[ "x" ], view_top = canv_geom[ "y" ], subtree_bboxes = bounds.get( "subtree_bboxes" ) )
+
+        self.update_scroll_region()
+        self.add_change_listener( self.update_scroll_region )
+        canvas.widget.bind( "<Configure>", self.view_moved )
+        canvas.widget.bind( "<MouseWheel>", self.wheel_scroll )
+        canvas.widget.bind( "<Shift-MouseWheel>", self.wheel_scroll )
+        canvas.widget.bind( "<Button-4>", self.wheel_scroll )
+        canvas.widget.bind( "<Button-5>", self.wheel_scroll )
+        canvas.widget.bind( "<Shift-Button-4>", self.wheel_scroll )
+        canvas.widget.bind( "<Shift-Button-5>", self.wheel_scroll )
+        canvas.widget.bind( "<Control-MouseWheel>", self.wheel_zoom )
+        canvas.widget.bind( "<Control-Button-4>", self.wheel_zoom )
+        canvas.widget.bind( "<Control-Button-5>", self.wheel_zoom )
+        # Pan by dragging with the middle button.
+        canvas.widget.bind( "<ButtonPress-2>", self.pan_start )
+        canvas.widget.bind( "<B2-Motion>", self.pan_motion )
+
+    # Returns the bounds found for the model as loaded, before any edits, as
+    # { "extents", "subtree_bboxes" }, to be passed back in to a later load.
+    def get_bounds( self ) -> dict:
+        return { "extents": self.model_extents, "subtree_bboxes": self.get_subtree_bboxes() }
+
+    # Lets the view scroll over every state, and a margin beyond, so that
+    # states can be dragged outwards.
+    def update_scroll_region( self ) -> None:
+        ( lft, top, rgt, btm ) = ( 0, 0, self.view_wid, self.view_hgt )
+        extents = self.get_extents()
+        if extents:
+            extents = self.to_canvas( extents )
+            lft = min( lft, extents[ 0 ] )
+            top = min( top, extents[ 1 ] )
+            rgt = max( rgt, extents[ 2 ] + ccd_ui_hsm.VIEW_MARGIN_PIX )
+            btm = max( btm, extents[ 3 ] + ccd_ui_hsm.VIEW_MARGIN_PIX )
+        self.scroll_region = ( int( lft ), int( top ), int( rgt ), int( btm ) )
+        self.canvas.widget.configure( scrollregion = "%d %d %d %d" % self.scroll_region )
+
+    def scroll_view_to( self, lft: float, top: float ) -> None:
+        self.update_scroll_region()
+        ( reg_lft, reg_top, reg_rgt, reg_btm ) = self.scroll_region
+        self.canvas.widget.xview_moveto( ( lft - reg_lft ) / max( reg_rgt - reg_lft, 1 ) )
+        self.canvas.widget.yview_moveto( ( top - reg_top ) / max( reg_btm - reg_top, 1 ) )
+        self.view_moved()
+
+    def wheel_zoom( self, event ):
+        if event.num == 4 or event.delta > 0:
+            self.zoom_by( ccd_ui_hsm.ZOOM_STEP, event.x, event.y )
+        else:
+            self.zoom_by( 1 / ccd_ui_hsm.ZOOM_STEP, event.x, event.y )
+
+    def pan_start( self, event ):
+        self.canvas.widget.scan_mark( event.x, event.y )
+
+    def pan_motion( self, event ):
+        self.canvas.widget.scan_dragto( event.x, event.y, gain = 1 )
+        self.view_moved()
+
+    def scroll_x( self, *args ):
+        self.canvas.widget.xview( *args )
+        self.view_moved()
+
+    def scroll_y( self, *args ):
+        self.canvas.widget.yview( *args )
+        self.view_moved()
+
+    def wheel_scroll( self, event ):
+        if event.num == 4 or event.delta > 0:
+            units = -ccd_ui_hsm.WHEEL_SCROLL_UNITS
+        else:
+            units = ccd_ui_hsm.WHEEL_SCROLL_UNITS
+        # Scroll sideways with the shift key held.
+        if event.state & 0x0001:
+            self.canvas.widget.xview_scroll( units, "units" )
+        else:
+            self.canvas.widget.yview_scroll( units, "units" )
+        self.view_moved()
+
+    # Follows the Tk canvas' scroll position and size.
+    def view_moved( self, event = None ):
+        widget = self.canvas.widget
+        self.set_view( int( widget.canvasx( 0 ) ), int( widget.canvasy( 0 ) ), widget.winfo_width(), widget.winfo_height() )
+
+    def schedule_idle( self, func ) -> None:
+        self.after_idle( func )
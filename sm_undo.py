@@ -0,0 +1,151 @@
+import collections
+import sys
+
+
+# The memory the undo history may use by default.
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+
+# Estimates the memory held by a delta, i.e. nested tuples, lists and dicts of
+# strings, numbers and arrays.
+def get_delta_size( value: object ) -> int:
+    size = sys.getsizeof( value )
+    if isinstance( value, dict ):
+        for key, item in value.items():
+            size += get_delta_size( key ) + get_delta_size( item )
+    elif isinstance( value, ( tuple, list ) ):
+        for item in value:
+            size += get_delta_size( item )
+    return size
+
+
+# One undoable edit. forward and inverse are lists of operations, each a tuple
+# of a method name and its arguments, which the owner of the log applies in
+# order by calling those methods on itself.
+class sm_undo_entry():
+    __slots__ = ( "label", "forward", "inverse", "size" )
+
+    def __init__( self, label: str, forward: list, inverse: list ):
+        self.label = label
+        self.forward = forward
+        self.inverse = inverse
+        self.size = get_delta_size( forward ) + get_delta_size( inverse )
+
+
+# An undo/redo history of edits.
+#
+# Only what an edit changed is kept, e.g. a state's old and new position, so
+# an entry costs the same however large the model is. Once the entries take
+# more than max_bytes, the oldest are forgotten, so the history stays within
+# a fixed amount of memory however many edits are made.
+#
+# Edits made inside another, e.g. the transitions deleted along with a state,
+# are collected into a single entry with begin_group() and end_group(), and
+# nothing is recorded while suspended, e.g. while a delta is being applied.
+class sm_undo_log():
+    def __init__( self, max_bytes: int = DEFAULT_MAX_BYTES ):
+        self.max_bytes = max_bytes
+        self.undo_entries = collections.deque()
+        self.redo_entries = []
+        self.num_bytes = 0
+        self.suspended = 0
+        # Each open group is [ label, forward, inverse ].
+        self.groups = []
+        # Called with each delta applied to the model, see add_listener().
+        self.listeners = []
+
+    # The listener is called with the operations of each edit recorded, and of
+    # each undo and redo, in the order they are applied to the model.
+    def add_listener( self, listener ) -> None:
+        self.listeners.append( listener )
+
+    # This method is for internal use only.
+    def notify( self, delta: list ) -> None:
+        for listener in self.listeners:
+            listener( delta )
+
+    def set_max_bytes( self, max_bytes: int ) -> None:
+        self.max_bytes = max_bytes
+        self.trim()
+
+    def is_recording( self ) -> bool:
+        return self.suspended == 0
+
+    def suspend( self ) -> None:
+        self.suspended += 1
+
+    def resume( self ) -> None:
+        assert( self.suspended > 0 )
+        self.suspended -= 1
+
+    def begin_group( self, label: str ) -> None:
+        self.groups.append( [ label, [], [] ] )
+
+    # Closes the innermost group. forward_after and inverse_after are run after
+    # the rest of the group when it is redone and undone respectively.
+    def end_group( self, forward_after: list = (), inverse_after: list = () ) -> None:
+        ( label, forward, inverse ) = self.groups.pop()
+        if forward or inverse:
+            self.record( label, forward + list( forward_after ), inverse + list( inverse_after ) )
+
+    # Notes an edit made, given the operations which redo and undo it.
+    def record( self, label: str, forward: list, inverse: list ) -> None:
+        if self.suspended:
+            return
+        if self.groups:
+            group = self.groups[ -1 ]
+            group[ 1 ].extend( forward )
+            # Undone in the reverse order to that in which they were made.
+            group[ 2 ][ 0:0 ] = inverse
+            return
+        # A new edit means what was undone can no longer be redone.
+        for entry in self.redo_entries:
+            self.num_bytes -= entry.size
+        self.redo_entries = []
+        self.push_undo( sm_undo_entry( label, forward, inverse ) )
+        self.notify( forward )
+
+    # This method is for internal use only.
+    def push_undo( self, entry: sm_undo_entry ) -> None:
+        self.undo_entries.append( entry )
+        self.num_bytes += entry.size
+        self.trim()
+
+    # Forgets the oldest entries until the history fits in max_bytes.
+    def trim( self ) -> None:
+        while self.num_bytes > self.max_bytes and self.undo_entries:
+            self.num_bytes -= self.undo_entries.popleft().size
+        while self.num_bytes > self.max_bytes and self.redo_entries:
+            self.num_bytes -= self.redo_entries.pop( 0 ).size
+
+    def can_undo( self ) -> bool:
+        return bool( self.undo_entries )
+
+    def can_redo( self ) -> bool:
+        return bool( self.redo_entries )
+
+    # Returns the entry to undo, moving it to the redo list, or None.
+    def pop_undo( self ) -> sm_undo_entry:
+        if not self.undo_entries:
+            return None
+        entry = self.undo_entries.pop()
+        self.redo_entries.append( entry )
+        self.notify( entry.inverse )
+        return entry
+
+    # Returns the entry to redo, moving it back to the undo list, or None.
+    def pop_redo( self ) -> sm_undo_entry:
+        if not self.redo_entries:
+            return None
+        entry = self.redo_entries.pop()
+        self.undo_entries.append( entry )
+        self.notify( entry.forward )
+        return entry
+
+    def clear( self ) -> None:
+        self.undo_entries.clear()
+        self.redo_entries = []
+        self.num_bytes = 0
+
+    def get_num_bytes( self ) -> int:
+        return self.num_bytes
@@ -0,0 +1,41 @@
+import time
+
+
+# When this module was first imported, which ccd_main does before anything else.
+START_TIME = time.perf_counter()
+
+
+# Times the phases of starting up, from the first import to the window being
+# ready for input, and reports them once, if enabled with -profile-startup.
+# Phases are marked as they finish, so each takes the time since the last.
+enabled = False
+phases = []
+last_time = START_TIME
+reported = False
+
+def enable() -> None:
+    global enabled
+    enabled = True
+
+# Notes that the named phase has just finished. Only the first time each
+# phase finishes counts, e.g. not the paints of models loaded later.
+def mark( phase: str ) -> None:
+    global last_time
+    if reported or any( name == phase for ( name, secs ) in phases ):
+        return
+    now = time.perf_counter()
+    phases.append( ( phase, now - last_time ) )
+    last_time = now
+
+# Call once the window is ready for input, to print the times of the phases.
+def report() -> None:
+    global reported
+    if reported:
+        return
+    mark( "idle" )
+    reported = True
+    if not enabled:
+        return
+    for ( phase, secs ) in phases:
+        print( f"INFO: Startup {phase:<12} {secs * 1000:8.1f} ms" )
+    print( f"INFO: Startup {'interactive':<12} {( last_time - START_TIME ) * 1000:8.1f} ms" )
@@ -0,0 +1,55 @@
+import copy
+import json
+import os
+import random
+
+import ccd_ui_hsm
+import sm_canvas
+
+
+SAMPLE_MODEL_FILENAME = os.path.join( os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ), "hsm_model.json" )
+
+
+# Returns the sample model shipped with the editor.
+def load_sample_model() -> dict:
+    with open( SAMPLE_MODEL_FILENAME, "r" ) as model_file:
+        return json.load( model_file )
+
+# Returns a model of num_states states scattered over a square span pixels
+# wide, each with a transition to one of the states near it in name order.
+# The same seed always gives the same model.
+def scattered_model( num_states: int, span: int, seed: int = 1 ) -> dict:
+    rng = random.Random( seed )
+    states = {}
+    for idx in range( num_states ):
+        states[ f"s{idx}" ] = { "layout": { "x": rng.randrange( 0, span, 10 ), "y": rng.randrange( 0, span, 10 ), "w": 120, "h": 90 } }
+    for idx in range( num_states ):
+        dst_idx = min( num_states - 1, max( 0, idx + rng.randrange( -5, 6 ) ) )
+        states[ f"s{idx}" ][ "tran" ] = { "e": { "dest": f"s{dst_idx}" } }
+    return { "states": states }
+
+# Returns a model of num_composites composites in a row, each holding
+# num_children substates chained by transitions, with transitions from one
+# composite, and one of its substates, to the next.
+def nested_model( num_composites: int, num_children: int ) -> dict:
+    states = {}
+    for comp_idx in range( num_composites ):
+        ( comp_x, comp_y ) = ( comp_idx * 800, 0 )
+        substates = {}
+        for child_idx in range( num_children ):
+            substates[ f"c{comp_idx}_{child_idx}" ] = {
+                "layout": { "x": comp_x + 20 + ( child_idx % 5 ) * 120, "y": comp_y + 40 + ( child_idx // 5 ) * 100, "w": 80, "h": 60 },
+                "tran": { "e": { "dest": f"c{comp_idx}_{( child_idx + 1 ) % num_children}" } } }
+        next_idx = ( comp_idx + 1 ) % num_composites
+        substates[ f"c{comp_idx}_0" ][ "tran" ][ "x" ] = { "dest": f"c{next_idx}_1" }
+        states[ f"c{comp_idx}" ] = { "layout": { "x": comp_x, "y": comp_y, "w": 700, "h": 700 }, "states": substates,
+            "tran": { "t": { "dest": f"c{next_idx}" } } }
+    return { "states": states }
+
+# Returns a diagram of a copy of the model, drawn on a recording canvas.
+def create_diagram( model: dict, view_wid: int = 800, view_hgt: int = 600 ) -> ccd_ui_hsm.sm_diagram:
+    return ccd_ui_hsm.sm_diagram( copy.deepcopy( model ), sm_canvas.sm_recording_canvas(), view_wid, view_hgt )
+
+# Returns the model a diagram would save, as JSON, for comparing diagrams.
+def get_saved_json( diagram: ccd_ui_hsm.sm_diagram ) -> str:
+    return json.dumps( diagram.export_model(), sort_keys = True )
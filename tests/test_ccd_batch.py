@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import unittest
+
+import ccd_batch
+import save_service
+import sm_compiler
+from tests import sample_models
+
+
+class test_ccd_batch( unittest.TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.TemporaryDirectory()
+        model = sample_models.scattered_model( 20, 1000 )
+        for state in model[ "states" ].values():
+            state[ "tran" ][ "e" ].pop( "path", None )
+        self.filename = self.write_file( "model.json", save_service.serialize_json( model ) )
+
+    def tearDown( self ):
+        self.folder.cleanup()
+
+    # This method is for internal use only.
+    def write_file( self, name: str, data: bytes ) -> str:
+        filename = os.path.join( self.folder.name, name )
+        with open( filename, "wb" ) as model_file:
+            model_file.write( data )
+        return filename
+
+    # This method is for internal use only.
+    def read_file( self, filename: str ) -> bytes:
+        with open( filename, "rb" ) as model_file:
+            return model_file.read()
+
+    def test_validate( self ):
+        result = ccd_batch.process_file( ccd_batch.BATCH_VALIDATE, self.filename, False )
+        self.assertTrue( result[ "ok" ] )
+        self.assertEqual( ( result[ "states" ], result[ "transitions" ], result[ "missing_paths" ] ), ( 20, 20, 20 ) )
+
+    def test_invalid( self ):
+        broken = self.write_file( "broken.json", b"{ \"states\": " )
+        result = ccd_batch.process_file( ccd_batch.BATCH_VALIDATE, broken, False )
+        self.assertFalse( result[ "ok" ] )
+        self.assertTrue( result[ "errors" ][ 0 ].startswith( "JSONDecodeError" ) )
+        ( errors, warnings, counts ) = ccd_batch.validate_model( { "states": { "a": { "layout": { "x": 0, "y": 0 },
+            "tran": { "e": { "dest": "b" } } } } } )
+        self.assertEqual( errors, [ "Transition \"e\" of \"a\" goes to \"b\", which is not a state." ] )
+
+    # With check, a file which would change is reported but left as it is.
+    def test_route( self ):
+        contents = self.read_file( self.filename )
+        result = ccd_batch.process_file( ccd_batch.BATCH_ROUTE, self.filename, True )
+        self.assertTrue( result[ "changed" ] )
+        self.assertEqual( self.read_file( self.filename ), contents )
+        result = ccd_batch.process_file( ccd_batch.BATCH_ROUTE, self.filename, False )
+        self.assertTrue( result[ "changed" ] )
+        self.assertEqual( ccd_batch.process_file( ccd_batch.BATCH_VALIDATE, self.filename, False )[ "missing_paths" ], 0 )
+        # Routing again changes nothing.
+        self.assertFalse( ccd_batch.process_file( ccd_batch.BATCH_ROUTE, self.filename, False )[ "changed" ] )
+
+    # The output folder is made if need be.
+    def test_export( self ):
+        output_dir = os.path.join( self.folder.name, "out", "svg" )
+        result = ccd_batch.process_file( ccd_batch.BATCH_EXPORT, self.filename, False, { "format": ccd_batch.EXPORT_SVG, "output_dir": output_dir } )
+        self.assertTrue( result[ "ok" ], result[ "errors" ] )
+        self.assertEqual( result[ "outputs" ], [ os.path.join( output_dir, "model.svg" ) ] )
+        self.assertTrue( os.path.exists( result[ "outputs" ][ 0 ] ) )
+
+    def test_compile( self ):
+        model = sample_models.load_sample_model()
+        filename = self.write_file( "sample.json", save_service.serialize_json( model ) )
+        output_dir = os.path.join( self.folder.name, "compiled" )
+        result = ccd_batch.process_file( ccd_batch.BATCH_COMPILE, filename, False, { "output_dir": output_dir, "benchmark": 1000 } )
+        self.assertTrue( result[ "ok" ], result[ "errors" ] )
+        self.assertTrue( result[ "benchmark" ][ "same_result" ] )
+        self.assertEqual( sm_compiler.load_compiled( result[ "outputs" ][ 0 ] ), sm_compiler.compile_model( model ) )
+
+    def test_run( self ):
+        self.write_file( "broken.json", b"[" )
+        report_filename = os.path.join( self.folder.name, "report.json" )
+        exit_code = ccd_batch.run( ccd_batch.BATCH_VALIDATE, [ os.path.join( self.folder.name, "*.json" ) ], 1, report_filename )
+        self.assertEqual( exit_code, 1 )
+        with open( report_filename, "r" ) as report_file:
+            report = json.load( report_file )
+        self.assertEqual( report[ "summary" ][ "files" ], 2 )
+        self.assertEqual( report[ "summary" ][ "failed" ], 1 )
+        os.remove( os.path.join( self.folder.name, "broken.json" ) )
+        self.assertEqual( ccd_batch.run( ccd_batch.BATCH_VALIDATE, [ self.filename ], 1, report_filename ), 0 )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+
+import edit_journal
+from tests import sample_models
+
+
+class test_records( unittest.TestCase ):
+    def setUp( self ):
+        self.records = [ ( edit_journal.JOURNAL_VERSION, b"digest" ), [ ( "move_state", "a", 10, 20 ) ], [ ( "delete_state", "b" ) ] ]
+        self.data = b"".join( edit_journal.pack_record( record ) for record in self.records )
+
+    def test_round_trip( self ):
+        self.assertEqual( edit_journal.unpack_records( self.data ), self.records )
+        self.assertEqual( edit_journal.unpack_records( b"" ), [] )
+
+    # A record cut short by a crash mid-write is dropped, with those after it.
+    def test_truncated( self ):
+        last_size = len( edit_journal.pack_record( self.records[ -1 ] ) )
+        for cut in range( 1, last_size ):
+            self.assertEqual( edit_journal.unpack_records( self.data[ : -cut ] ), self.records[ : -1 ] )
+
+    def test_damaged( self ):
+        first_size = len( edit_journal.pack_record( self.records[ 0 ] ) )
+        damaged = bytearray( self.data )
+        damaged[ first_size + edit_journal.RECORD_HEADER.size + 2 ] ^= 0xff
+        self.assertEqual( edit_journal.unpack_records( bytes( damaged ) ), self.records[ : 1 ] )
+
+
+class test_edit_journal( unittest.TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join( self.folder.name, "model.json" )
+        self.digest = edit_journal.get_digest( b"saved model" )
+        self.journal = edit_journal.edit_journal( self.filename )
+
+    def tearDown( self ):
+        self.journal.close()
+        self.folder.cleanup()
+
+    def test_recover( self ):
+        self.assertEqual( self.journal.recover( self.digest ), [] )
+        self.journal.open( self.digest )
+        self.journal.append( [ ( "op", 1 ) ] )
+        self.journal.append( [ ( "op", 2 ) ] )
+        self.assertEqual( self.journal.recover( self.digest ), [ [ ( "op", 1 ) ], [ ( "op", 2 ) ] ] )
+        # Not for another save of the model.
+        self.assertEqual( self.journal.recover( edit_journal.get_digest( b"another" ) ), [] )
+        self.journal.close()
+
+        # Carried on with keep, otherwise started over.
+        self.journal.open( self.digest, keep = True )
+        self.journal.append( [ ( "op", 3 ) ] )
+        self.assertEqual( len( self.journal.recover( self.digest ) ), 3 )
+        self.journal.open( self.digest )
+        self.assertEqual( self.journal.recover( self.digest ), [] )
+
+    def test_truncated_tail( self ):
+        self.journal.open( self.digest )
+        self.journal.append( [ ( "op", 1 ) ] )
+        self.journal.append( [ ( "op", 2 ) ] )
+        self.journal.close()
+        with open( self.filename + edit_journal.JOURNAL_SUFFIX, "r+b" ) as journal_file:
+            journal_file.truncate( os.path.getsize( self.filename + edit_journal.JOURNAL_SUFFIX ) - 3 )
+        self.assertEqual( self.journal.recover( self.digest ), [ [ ( "op", 1 ) ] ] )
+
+    # Only the edits after the mark are kept over the new save.
+    def test_rebase( self ):
+        self.journal.open( self.digest )
+        self.journal.append( [ ( "op", 1 ) ] )
+        self.journal.mark()
+        self.journal.append( [ ( "op", 2 ) ] )
+        new_digest = edit_journal.get_digest( b"saved again" )
+        self.journal.rebase( new_digest )
+        self.journal.append( [ ( "op", 3 ) ] )
+        self.assertEqual( self.journal.recover( self.digest ), [] )
+        self.assertEqual( self.journal.recover( new_digest ), [ [ ( "op", 2 ) ], [ ( "op", 3 ) ] ] )
+        self.assertEqual( self.journal.get_num_bytes(), os.path.getsize( self.filename + edit_journal.JOURNAL_SUFFIX ) )
+
+    # Replaying what was journaled of the edits to a diagram, undo and redo
+    # included, over the saved model gives back the model as edited.
+    def test_replay( self ):
+        model = sample_models.nested_model( 3, 6 )
+        diagram = sample_models.create_diagram( model )
+        diagram.paint()
+        self.journal.open( self.digest )
+        diagram.undo_log.add_listener( self.journal.append )
+        diagram.move_state( "c0", 0, 900 )
+        diagram.add_state( "new", { "x": 3000, "y": 100, "w": 100, "h": 60 } )
+        diagram.add_transition( "new", "go", "c1" )
+        diagram.rename_state( "c2", "renamed" )
+        diagram.undo()
+        diagram.delete_state( "c1" )
+        diagram.undo()
+        diagram.redo()
+        self.journal.close()
+
+        replayed = sample_models.create_diagram( model )
+        replayed.paint()
+        self.assertNotEqual( sample_models.get_saved_json( replayed ), sample_models.get_saved_json( diagram ) )
+        deltas = self.journal.recover( self.digest )
+        self.assertEqual( len( deltas ), 8 )
+        for delta in deltas:
+            replayed.apply_delta( delta )
+        self.assertEqual( sample_models.get_saved_json( replayed ), sample_models.get_saved_json( diagram ) )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import unittest
+
+import ccd_ui_hsm
+import model_cache
+from tests import sample_models
+
+
+class test_sm_model_cache( unittest.TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = model_cache.sm_model_cache( os.path.join( self.folder.name, "cache" ) )
+        self.model = sample_models.nested_model( 2, 4 )
+        self.filename = self.write_model( "model.json", self.model )
+        self.routes = [ ( ( "c0", "t" ), [ 0, 0, 10, 0 ] ) ]
+        self.bounds = { "extents": ( 0, 0, 1500, 700 ), "subtree_bboxes": { "c0": ( 0, 0, 700, 700 ) } }
+
+    def tearDown( self ):
+        self.folder.cleanup()
+
+    # This method is for internal use only.
+    def write_model( self, name: str, model: dict ) -> str:
+        filename = os.path.join( self.folder.name, name )
+        with open( filename, "wb" ) as model_file:
+            model_file.write( json.dumps( model ).encode( "utf-8" ) )
+        return filename
+
+    # This method is for internal use only.
+    def put( self, filename: str ) -> bytes:
+        with open( filename, "rb" ) as model_file:
+            contents = model_file.read()
+        self.cache.put( filename, contents, self.cache.pack_model( json.loads( contents ) ), self.routes, self.bounds )
+        return contents
+
+    def test_round_trip( self ):
+        contents = self.put( self.filename )
+        self.assertEqual( self.cache.get( self.filename, contents ), ( self.model, self.routes, self.bounds ) )
+
+    def test_missing( self ):
+        with open( self.filename, "rb" ) as model_file:
+            self.assertIsNone( self.cache.get( self.filename, model_file.read() ) )
+
+    # An entry is only used while the file is just as it was cached.
+    def test_stale( self ):
+        contents = self.put( self.filename )
+        status = os.stat( self.filename )
+        # Same size and modification time, but other contents.
+        changed = contents.replace( b"c0_1", b"c0_X" )
+        with open( self.filename, "wb" ) as model_file:
+            model_file.write( changed )
+        os.utime( self.filename, ns = ( status.st_atime_ns, status.st_mtime_ns ) )
+        self.assertIsNone( self.cache.get( self.filename, changed ) )
+        # Same contents, but touched since.
+        with open( self.filename, "wb" ) as model_file:
+            model_file.write( contents )
+        os.utime( self.filename, ns = ( status.st_atime_ns, status.st_mtime_ns + 1000000 ) )
+        self.assertIsNone( self.cache.get( self.filename, contents ) )
+
+    def test_evict( self ):
+        self.put( self.filename )
+        entry_size = os.path.getsize( self.cache.get_entry_filename( self.filename ) )
+        self.cache.max_bytes = entry_size * 2 + entry_size // 2
+        filenames = [ self.filename ] + [ self.write_model( f"model_{idx}.json", self.model ) for idx in range( 3 ) ]
+        for ( idx, filename ) in enumerate( filenames ):
+            self.put( filename )
+            # Apart in time, so the least recently used is clear.
+            os.utime( self.cache.get_entry_filename( filename ), ns = ( idx * 10 ** 9, idx * 10 ** 9 ) )
+        self.cache.evict()
+        kept = [ os.path.exists( self.cache.get_entry_filename( filename ) ) for filename in filenames ]
+        self.assertEqual( kept, [ False, False, True, True ] )
+
+
+# The bounds kept in the cache give a diagram just like one which worked
+# them out itself.
+class test_cached_bounds( unittest.TestCase ):
+    def test_seeded_diagram( self ):
+        model = sample_models.nested_model( 4, 6 )
+        fresh = sample_models.create_diagram( model )
+        bounds = fresh.get_subtree_bboxes()
+        self.assertEqual( sorted( bounds ), [ "c0", "c1", "c2", "c3" ] )
+        seeded = ccd_ui_hsm.sm_diagram( json.loads( json.dumps( model ) ), fresh.canvas, 800, 600, subtree_bboxes = bounds )
+        self.assertEqual( seeded.get_subtree_bboxes(), bounds )
+        self.assertEqual( seeded.get_extents(), fresh.get_extents() )
+        self.assertEqual( ccd_ui_hsm.get_model_extents( model ), fresh.get_extents() )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import save_service
+
+
+class test_write_file_atomic( unittest.TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join( self.folder.name, "model.json" )
+
+    def tearDown( self ):
+        self.folder.cleanup()
+
+    def test_write( self ):
+        save_service.write_file_atomic( self.filename, b"first" )
+        os.chmod( self.filename, 0o640 )
+        save_service.write_file_atomic( self.filename, b"second" )
+        with open( self.filename, "rb" ) as saved_file:
+            self.assertEqual( saved_file.read(), b"second" )
+        self.assertEqual( os.stat( self.filename ).st_mode & 0o777, 0o640 )
+        self.assertTrue( save_service.file_matches( self.filename, b"second" ) )
+        self.assertFalse( save_service.file_matches( self.filename, b"secont" ) )
+        self.assertFalse( save_service.file_matches( self.filename + ".missing", b"second" ) )
+        # No temporary files are left behind.
+        self.assertEqual( os.listdir( self.folder.name ), [ "model.json" ] )
+
+    def test_serialize_json( self ):
+        self.assertEqual( save_service.serialize_json( { "a": [ 1 ], "b": "\u00e9" } ), b'{\n    "a": [\n        1\n    ],\n    "b": "\\u00e9"\n}' )
+
+
+class test_save_service( unittest.TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join( self.folder.name, "model.json" )
+        self.service = save_service.save_service( quiet_secs = 60 )
+        self.messages = io.StringIO()
+        self.saved = []
+
+    def tearDown( self ):
+        with contextlib.redirect_stdout( self.messages ):
+            self.service.stop()
+        self.folder.cleanup()
+
+    # This method is for internal use only.
+    def flush( self ) -> None:
+        with contextlib.redirect_stdout( self.messages ):
+            self.service.flush()
+
+    def test_schedule( self ):
+        self.service.schedule( self.filename, lambda: { "n": 1 }, on_saved = self.saved.append )
+        self.assertTrue( self.service.is_pending() )
+        self.assertFalse( os.path.exists( self.filename ) )
+        self.flush()
+        self.assertFalse( self.service.is_pending() )
+        with open( self.filename, "rb" ) as saved_file:
+            self.assertEqual( saved_file.read(), save_service.serialize_json( { "n": 1 } ) )
+        self.assertEqual( self.saved, [ save_service.serialize_json( { "n": 1 } ) ] )
+
+    # A burst of changes costs a single write, of the latest snapshot.
+    def test_burst( self ):
+        snapshots = []
+        for idx in range( 10 ):
+            self.service.schedule( self.filename, lambda idx = idx: snapshots.append( idx ) or { "n": idx } )
+        self.flush()
+        self.assertEqual( snapshots, [ 9 ] )
+        self.assertEqual( self.messages.getvalue().count( "Saved file" ), 1 )
+
+    # Bytes already in the file are not written again.
+    def test_unchanged( self ):
+        save_service.write_file_atomic( self.filename, save_service.serialize_json( { "n": 1 } ) )
+        mtime_ns = os.stat( self.filename ).st_mtime_ns
+        for idx in range( 2 ):
+            self.service.schedule( self.filename, lambda: { "n": 1 }, delay = 0, on_saved = self.saved.append )
+            self.flush()
+        self.assertEqual( os.stat( self.filename ).st_mtime_ns, mtime_ns )
+        self.assertEqual( len( self.saved ), 2 )
+        self.assertNotIn( "Saved file", self.messages.getvalue() )
+
+
+if __name__ == "__main__":
+    unittest.main()
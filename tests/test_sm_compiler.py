@@ -0,0 +1,84 @@
+import os
+import random
+import tempfile
+import unittest
+
+import sm_compiler
+from tests import sample_models
+
+
+# Returns a random hierarchical machine, several levels deep, whose states
+# have entry and exit actions and handle events drawn from a small set, so
+# that many are handled by an ancestor, and which starts through "start".
+def random_machine( num_states: int, num_events: int, seed: int ) -> dict:
+    rng = random.Random( seed )
+    names = [ f"s{idx}" for idx in range( num_states ) ]
+    states = { "start": { "tran": { "auto": { "dest": names[ 0 ] } } } }
+    state_dicts = {}
+    for ( idx, name ) in enumerate( names ):
+        state = { "entry": [ f"enter_{name}" ], "exit": [ f"exit_{name}" ] }
+        state_dicts[ name ] = state
+        parent_idx = rng.randrange( -1, idx ) if idx else -1
+        if parent_idx < 0:
+            states[ name ] = state
+        else:
+            state_dicts[ names[ parent_idx ] ].setdefault( "states", {} )[ name ] = state
+    for name in names:
+        for idx in range( rng.randrange( 1, 4 ) ):
+            state_dicts[ name ].setdefault( "tran", {} )[ f"e{rng.randrange( num_events )}" ] = { "dest": rng.choice( names ) }
+    return { "states": states }
+
+
+class test_sm_compiler( unittest.TestCase ):
+    def test_benchmark_sample_model( self ):
+        result = sm_compiler.run_benchmark( sample_models.load_sample_model(), 2000 )
+        self.assertTrue( result[ "same_result" ] )
+
+    def test_benchmark_random_models( self ):
+        tables = set()
+        for seed in range( 20 ):
+            model = random_machine( 30, 3 + seed * 3, seed )
+            tables.add( sm_compiler.compile_model( model )[ "table" ] )
+            result = sm_compiler.run_benchmark( model, 2000, seed = seed )
+            self.assertTrue( result[ "same_result" ], f"seed = {seed}" )
+        # Both forms of the dispatch table were tried.
+        self.assertEqual( tables, { "dense", "sparse" } )
+
+    # The compiled machine takes the same transitions, with the same actions
+    # in the same order, as the model run as it is.
+    def test_same_actions( self ):
+        model = random_machine( 40, 6, 99 )
+        compiled = sm_compiler.compile_model( model )
+        ( compiled_actions, interpreted_actions ) = ( [], [] )
+        machine = sm_compiler.sm_compiled_machine( compiled, compiled_actions.append )
+        interpreted = sm_compiler.sm_interpreted_machine( model, interpreted_actions.append )
+        machine.start()
+        interpreted.start()
+        self.assertEqual( machine.get_active_name(), "s0" )
+        rng = random.Random( 4 )
+        for idx in range( 3000 ):
+            event_name = f"e{rng.randrange( 7 )}"
+            self.assertEqual( machine.dispatch_name( event_name ), interpreted.dispatch_name( event_name ) )
+            self.assertEqual( machine.get_active_name(), interpreted.get_active_name() )
+            self.assertEqual( machine.last_transition, interpreted.last_transition )
+        self.assertEqual( compiled_actions, interpreted_actions )
+        self.assertGreater( machine.num_taken, 100 )
+
+    def test_bad_dest( self ):
+        with self.assertRaises( ValueError ):
+            sm_compiler.compile_model( { "states": { "a": { "tran": { "e": { "dest": "nowhere" } } } } } )
+
+    def test_write_and_load( self ):
+        compiled = sm_compiler.compile_model( random_machine( 20, 4, 1 ) )
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join( folder, "model" + sm_compiler.COMPILED_SUFFIX )
+            sm_compiler.write_compiled( compiled, filename )
+            self.assertEqual( sm_compiler.load_compiled( filename ), compiled )
+            with open( filename, "w" ) as compiled_file:
+                compiled_file.write( "{\"version\": -1}" )
+            with self.assertRaises( ValueError ):
+                sm_compiler.load_compiled( filename )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import copy
+import random
+import unittest
+import unittest.mock
+
+import ccd_ui_hsm
+import sm_geometry
+from tests import sample_models
+
+
+# The items on a recording canvas, in a form which doesn't depend on the
+# order they were made in, for comparing what two paints drew.
+def get_drawing( canvas: object ) -> list:
+    return sorted( ( item.kind, [ round( value, 3 ) for value in item.coords ], sorted( ( key, str( value ) ) for key, value in item.options.items() ) )
+        for item in canvas.items.values() )
+
+
+class test_diagram_paint( unittest.TestCase ):
+    def setUp( self ):
+        self.diagram = sample_models.create_diagram( sample_models.scattered_model( 200, 4000 ) )
+        self.diagram.paint()
+
+    # Only the states in view, and their margin, are painted.
+    def test_paints_view( self ):
+        ( view_lft, view_top, view_rgt, view_btm ) = self.diagram.get_view_rect()
+        in_view = []
+        for state_name in self.diagram.widgets_by_name:
+            geom = self.diagram.get_state_widget( state_name ).geom
+            if geom.x <= view_rgt and view_lft <= geom.x + geom.w and geom.y <= view_btm and view_top <= geom.y + geom.h:
+                in_view.append( state_name )
+        self.assertTrue( in_view )
+        self.assertLess( len( in_view ), len( self.diagram.widgets_by_name ) )
+        self.assertEqual( sorted( self.diagram.state_items ), sorted( in_view ) )
+        for state_name in in_view:
+            self.check_items_inside( state_name )
+
+    # Painting in batches, as on loading, draws just what one paint() does.
+    def test_paint_batches( self ):
+        drawing = get_drawing( self.diagram.canvas )
+        self.diagram.paint_begin()
+        first = 0
+        while first < self.diagram.get_paint_count():
+            first = self.diagram.paint_batch( first, 7 )
+        self.assertEqual( get_drawing( self.diagram.canvas ), drawing )
+
+    # A move only touches the items of the state moved and its transitions.
+    def test_paint_changes( self ):
+        canvas = self.diagram.canvas
+        canvas.reset_counts()
+        self.diagram.paint()
+        num_paint_calls = canvas.get_call_count()
+        state_name = sorted( self.diagram.state_items )[ 0 ]
+        geom = self.diagram.get_state_widget( state_name ).geom
+        canvas.reset_counts()
+        self.diagram.move_state( state_name, geom.x + 20, geom.y )
+        self.assertGreater( canvas.get_call_count(), 0 )
+        self.assertLess( canvas.get_call_count(), num_paint_calls // 4 )
+        self.assertEqual( canvas.get_call_count( "create_rectangle" ), 0 )
+        self.check_items_inside( state_name )
+
+    # Checks that the items drawn for a state are all inside its rectangle.
+    def check_items_inside( self, state_name: str ) -> None:
+        geom = self.diagram.get_state_widget( state_name ).geom
+        for item in self.diagram.state_items[ state_name ]:
+            coords = self.diagram.canvas.get_item( item ).coords
+            self.assertTrue( all( geom.x <= x <= geom.x + geom.w for x in coords[ 0 : : 2 ] ), f"{state_name} {coords}" )
+            self.assertTrue( all( geom.y <= y <= geom.y + geom.h for y in coords[ 1 : : 2 ] ), f"{state_name} {coords}" )
+
+
+class test_diagram_routing( unittest.TestCase ):
+    # With no paths in the model, a second diagram of it gets every route
+    # from the cache, and the very same paths.
+    def test_route_cache( self ):
+        model = sample_models.scattered_model( 150, 3000 )
+        for state in model[ "states" ].values():
+            for transition in state[ "tran" ].values():
+                transition.pop( "path", None )
+        ccd_ui_hsm.route_cache.clear()
+        first = sample_models.create_diagram( model )
+        num_routed = ccd_ui_hsm.route_cache.misses
+        self.assertGreater( num_routed, 0 )
+        second = sample_models.create_diagram( model )
+        self.assertEqual( ccd_ui_hsm.route_cache.misses, num_routed )
+        self.assertEqual( ccd_ui_hsm.route_cache.hits, num_routed )
+        self.assertEqual( sample_models.get_saved_json( second ), sample_models.get_saved_json( first ) )
+        for state in second.export_model()[ "states" ].values():
+            self.assertIn( "path", state[ "tran" ][ "e" ] )
+
+    # The batched clean-up of paths gives the same path as the scalar loop.
+    @unittest.skipUnless( sm_geometry.have_vector_kernel(), "NumPy is not installed." )
+    def test_find_clean_path_batched( self ):
+        diagram = sample_models.create_diagram( sample_models.scattered_model( 200, 2500 ) )
+        rng = random.Random( 11 )
+        state_names = list( diagram.widgets_by_name )
+        num_batched = 0
+        for trial in range( 200 ):
+            path = [ { "x": rng.randrange( 0, 3000, 10 ), "y": rng.randrange( 0, 3000, 10 ) } for idx in range( rng.randrange( 2, 6 ) ) ]
+            ignore = rng.sample( state_names, 3 )
+            with unittest.mock.patch.object( ccd_ui_hsm, "VECTOR_MIN_RECTS", 10 ** 9 ):
+                scalar_path = diagram.find_clean_path( copy.deepcopy( path ), ignore )
+            with unittest.mock.patch.object( ccd_ui_hsm, "VECTOR_MIN_RECTS", 1 ):
+                batched_path = diagram.find_clean_path( copy.deepcopy( path ), ignore )
+            self.assertEqual( batched_path, scalar_path )
+            if len( scalar_path ) > len( path ):
+                num_batched += 1
+        # Enough of the paths cross states for the comparison to mean something.
+        self.assertGreater( num_batched, 20 )
+
+
+if __name__ == "__main__":
+    unittest.main()
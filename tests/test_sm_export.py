@@ -0,0 +1,74 @@
+import copy
+import importlib.util
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree
+
+import ccd_batch
+import ccd_ui_hsm
+import sm_export
+from tests import sample_models
+
+
+SVG_NAMESPACE = "{http://www.w3.org/2000/svg}"
+
+
+class test_sm_export( unittest.TestCase ):
+    def setUp( self ):
+        self.folder = tempfile.TemporaryDirectory()
+        self.model = sample_models.nested_model( 3, 6 )
+
+    def tearDown( self ):
+        self.folder.cleanup()
+
+    # This method is for internal use only. Returns the lines of the SVG.
+    def export_svg( self, zoom: float, tile_pix: int ) -> list:
+        filename = os.path.join( self.folder.name, f"model_{tile_pix}.svg" )
+        sm_export.export_svg( ccd_batch.create_expanded_diagram( copy.deepcopy( self.model ) ), filename, zoom, tile_pix )
+        with open( filename, "r", encoding = "utf-8" ) as svg_file:
+            return svg_file.read().splitlines()
+
+    def test_get_tiles( self ):
+        rect = ( -20, -30, 250, 120 )
+        tiles = sm_export.get_tiles( rect, 100 )
+        self.assertEqual( [ ( col, row ) for ( col, row, lft, top, wid, hgt ) in tiles ], [ ( 0, 0 ), ( 1, 0 ), ( 2, 0 ), ( 0, 1 ), ( 1, 1 ), ( 2, 1 ) ] )
+        self.assertEqual( tiles[ -1 ], ( 2, 1, 180, 70, 50, 20 ) )
+        self.assertEqual( sum( wid * hgt for ( col, row, lft, top, wid, hgt ) in tiles ), 250 * 120 )
+        self.assertEqual( sm_export.get_png_filenames( "a/model.png", 1, 1 ), [ "a/model.png" ] )
+        self.assertEqual( sm_export.get_png_filenames( "a/model.png", 2, 1 ), [ "a/model_r0_c0.png", "a/model_r0_c1.png" ] )
+
+    # Every state is drawn, with its name, in a well formed document. The
+    # names of composites are followed by their expand marker.
+    def test_svg( self ):
+        root = xml.etree.ElementTree.fromstring( "\n".join( self.export_svg( 1.0, sm_export.DEFAULT_TILE_PIX ) ) )
+        texts = [ element.text.split( " " )[ 0 ] for element in root.iter( SVG_NAMESPACE + "text" ) ]
+        state_names = [ name for ( name, state ) in ccd_ui_hsm.iter_substates( self.model ) ]
+        self.assertEqual( sorted( texts ), sorted( state_names ) )
+        ( lft, top, wid, hgt ) = sm_export.get_export_rect( ccd_batch.create_expanded_diagram( copy.deepcopy( self.model ) ) )
+        self.assertEqual( ( root.get( "width" ), root.get( "height" ) ), ( str( wid ), str( hgt ) ) )
+
+    # Drawing in tiles draws each item once, just as in one go.
+    def test_svg_tiles( self ):
+        whole = self.export_svg( 1.0, sm_export.DEFAULT_TILE_PIX )
+        for tile_pix in ( 300, 97 ):
+            self.assertEqual( sorted( self.export_svg( 1.0, tile_pix ) ), sorted( whole ) )
+
+    def test_svg_zoom( self ):
+        root = xml.etree.ElementTree.fromstring( "\n".join( self.export_svg( 0.5, sm_export.DEFAULT_TILE_PIX ) ) )
+        whole = xml.etree.ElementTree.fromstring( "\n".join( self.export_svg( 1.0, sm_export.DEFAULT_TILE_PIX ) ) )
+        self.assertAlmostEqual( int( root.get( "width" ) ) - 2 * sm_export.EXPORT_MARGIN_PIX,
+            ( int( whole.get( "width" ) ) - 2 * sm_export.EXPORT_MARGIN_PIX ) / 2, delta = 2 )
+
+    @unittest.skipIf( importlib.util.find_spec( "PIL" ) is None, "Pillow is not installed." )
+    def test_png_tiles( self ):
+        filename = os.path.join( self.folder.name, "model.png" )
+        diagram = ccd_batch.create_expanded_diagram( self.model )
+        ( lft, top, wid, hgt ) = sm_export.get_export_rect( diagram )
+        filenames = sm_export.export_png( diagram, filename, 1.0, 1000 )
+        self.assertEqual( filenames, sm_export.get_png_filenames( filename, ( wid + 999 ) // 1000, ( hgt + 999 ) // 1000 ) )
+        self.assertTrue( all( os.path.exists( tile_filename ) for tile_filename in filenames ) )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import random
+import unittest
+
+import ccd_ui_hsm
+import sm_geometry
+
+
+class test_sm_geometry_store( unittest.TestCase ):
+    def setUp( self ):
+        self.store = sm_geometry.sm_geometry_store()
+        self.a_id = self.store.add_state( "a", 10, 20, 100, 50 )
+        self.b_id = self.store.add_state( "b", -40, 200, 60, 30 )
+
+    def test_rects( self ):
+        self.assertEqual( self.store.get_rect( self.a_id ), ( 10, 20, 100, 50 ) )
+        self.store.set_rect( self.a_id, 11.6, 21, 90, 40 )
+        self.assertEqual( self.store.get_rect( self.a_id ), ( 11, 21, 90, 40 ) )
+        self.assertEqual( self.store.get_extents(), ( -40, 21, 101, 230 ) )
+        view = self.store.get_state_view( self.b_id )
+        view.x = 0
+        view.w = 20
+        self.assertEqual( ( view.x, view.y, view.w, view.h ), ( 0, 200, 20, 30 ) )
+        self.assertEqual( self.store.get_rect( self.b_id ), ( 0, 200, 20, 30 ) )
+
+    def test_ids_reused( self ):
+        self.store.remove_state( "a" )
+        self.assertIsNone( self.store.get_id( "a" ) )
+        self.assertEqual( self.store.get_extents(), ( -40, 200, 20, 230 ) )
+        self.assertEqual( self.store.add_state( "c", 0, 0, 10, 10 ), self.a_id )
+        self.assertEqual( self.store.get_rect( self.store.get_id( "c" ) ), ( 0, 0, 10, 10 ) )
+
+    def test_paths( self ):
+        path = [ { "x": 0, "y": 0 }, { "x": 50, "y": 0 }, { "x": 50, "y": 80 } ]
+        self.store.set_path( ( "a", "t" ), path )
+        self.assertTrue( self.store.has_path( ( "a", "t" ) ) )
+        self.assertEqual( self.store.get_path( ( "a", "t" ) ), path )
+        self.assertEqual( list( self.store.get_points( ( "a", "t" ) ) ), [ 0, 0, 50, 0, 50, 80 ] )
+        self.assertEqual( self.store.get_transition_view( ( "a", "t" ) ).get_num_points(), 3 )
+        self.store.rename_state( "a", "z" )
+        self.assertEqual( self.store.get_id( "z" ), self.a_id )
+        self.assertIsNone( self.store.get_path( ( "a", "t" ) ) )
+        self.assertEqual( self.store.get_path( ( "z", "t" ) ), path )
+        self.store.rename_path( ( "z", "t" ), ( "z", "u" ) )
+        self.store.remove_path( ( "z", "u" ) )
+        self.assertFalse( self.store.has_path( ( "z", "u" ) ) )
+
+    def test_load_paths( self ):
+        states = { "a": { "tran": { "t": { "dest": "b", "path": [ { "x": 1, "y": 2 }, { "x": 3, "y": 2 } ] }, "u": { "dest": "a" } } } }
+        self.assertEqual( self.store.load_paths( states, "path", "tran" ), [ ( "a", "t" ) ] )
+        self.assertNotIn( "path", states[ "a" ][ "tran" ][ "t" ] )
+        self.assertEqual( self.store.get_path( ( "a", "t" ) ), [ { "x": 1, "y": 2 }, { "x": 3, "y": 2 } ] )
+
+    # The export must share nothing with the model that a later edit changes,
+    # even the layouts and paths of states nested out of the store.
+    def test_export_layout( self ):
+        self.store.set_path( ( "a", "t" ), [ { "x": 0, "y": 0 }, { "x": 9, "y": 0 } ] )
+        model = { "states": {
+            "a": { "layout": { "x": 0, "y": 0, "w": 1, "h": 1 }, "tran": { "t": { "dest": "b" } } },
+            "b": { "layout": { "x": 0, "y": 0, "w": 1, "h": 1 }, "states": {
+                "hidden": { "layout": { "x": 5, "y": 6, "w": 7, "h": 8 },
+                    "tran": { "t": { "dest": "a", "path": [ { "x": 5, "y": 6 }, { "x": 0, "y": 6 } ] } } } } } } }
+        exported = self.store.export_layout( model, "layout", "path", "states", "tran" )
+        self.assertEqual( exported[ "states" ][ "a" ][ "layout" ], { "x": 10, "y": 20, "w": 100, "h": 50 } )
+        self.assertEqual( exported[ "states" ][ "a" ][ "tran" ][ "t" ][ "path" ], [ { "x": 0, "y": 0 }, { "x": 9, "y": 0 } ] )
+        self.assertEqual( model[ "states" ][ "a" ][ "layout" ], { "x": 0, "y": 0, "w": 1, "h": 1 } )
+        self.assertNotIn( "path", model[ "states" ][ "a" ][ "tran" ][ "t" ] )
+
+        hidden = model[ "states" ][ "b" ][ "states" ][ "hidden" ]
+        hidden[ "layout" ][ "x" ] += 100
+        hidden[ "tran" ][ "t" ][ "path" ][ 0 ][ "x" ] += 100
+        exported_hidden = exported[ "states" ][ "b" ][ "states" ][ "hidden" ]
+        self.assertEqual( exported_hidden[ "layout" ], { "x": 5, "y": 6, "w": 7, "h": 8 } )
+        self.assertEqual( exported_hidden[ "tran" ][ "t" ][ "path" ][ 0 ], { "x": 5, "y": 6 } )
+
+
+@unittest.skipUnless( sm_geometry.have_vector_kernel(), "NumPy is not installed." )
+class test_intersect_segments_rects( unittest.TestCase ):
+    # The batched kernel must give just what do_lines_intersect() gives for
+    # each segment and edge, including segments along, and ending on, edges.
+    def test_matches_scalar( self ):
+        rng = random.Random( 3 )
+        rects = []
+        for idx in range( 40 ):
+            ( lft, top ) = ( rng.randrange( 0, 500, 10 ), rng.randrange( 0, 500, 10 ) )
+            rects.append( ( lft, top, lft + rng.randrange( 10, 200, 10 ), top + rng.randrange( 10, 200, 10 ) ) )
+        segments = []
+        for idx in range( 200 ):
+            ( ax, ay ) = ( rng.randrange( -50, 700, 10 ), rng.randrange( -50, 700, 10 ) )
+            if idx % 3 == 0:
+                segments.append( ( ax, ay, rng.randrange( -50, 700, 10 ), ay ) )
+            elif idx % 3 == 1:
+                segments.append( ( ax, ay, ax, rng.randrange( -50, 700, 10 ) ) )
+            else:
+                segments.append( ( ax, ay, rng.randrange( -50, 700, 10 ), rng.randrange( -50, 700, 10 ) ) )
+        segments.append( ( rects[ 0 ][ 0 ], rects[ 0 ][ 1 ], rects[ 0 ][ 2 ], rects[ 0 ][ 1 ] ) )
+
+        ( mask, points ) = sm_geometry.intersect_segments_rects( segments, rects )
+        self.assertEqual( mask.shape, ( len( segments ), len( rects ), 4 ) )
+        expected = []
+        for ( seg_idx, ( ax, ay, bx, by ) ) in enumerate( segments ):
+            A = { "x": ax, "y": ay }
+            B = { "x": bx, "y": by }
+            for ( rect_idx, ( lft, top, rgt, btm ) ) in enumerate( rects ):
+                outline = [ { "x": lft, "y": top }, { "x": rgt, "y": top }, { "x": rgt, "y": btm }, { "x": lft, "y": btm }, { "x": lft, "y": top } ]
+                for edge_idx in range( 4 ):
+                    ( C, D ) = ( outline[ edge_idx ], outline[ edge_idx + 1 ] )
+                    crossed = ccd_ui_hsm.do_lines_intersect( A, B, C, D )
+                    self.assertEqual( bool( mask[ seg_idx, rect_idx, edge_idx ] ), crossed )
+                    if crossed:
+                        expected.append( ( seg_idx, rect_idx, edge_idx ) )
+                        point = ccd_ui_hsm.line_intersection( ( ( ax, ay ), ( bx, by ) ), ( ( C[ "x" ], C[ "y" ] ), ( D[ "x" ], D[ "y" ] ) ) )
+                        self.assertAlmostEqual( float( points[ seg_idx, rect_idx, edge_idx, 0 ] ), point[ "x" ], delta = 0.5 )
+                        self.assertAlmostEqual( float( points[ seg_idx, rect_idx, edge_idx, 1 ] ), point[ "y" ], delta = 0.5 )
+        self.assertTrue( expected )
+        self.assertEqual( sm_geometry.get_crossings( mask ), expected )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import random
+import unittest
+
+import sm_index
+
+
+# The states whose rectangles overlap the given one, edges touching counting,
+# found the slow way, for checking queries against.
+def find_overlapping( rects: dict, lft: int, top: int, rgt: int, btm: int ) -> list:
+    return [ name for name, ( s_lft, s_top, s_rgt, s_btm ) in rects.items()
+        if s_lft <= rgt and lft <= s_rgt and s_top <= btm and top <= s_btm ]
+
+
+class test_sm_spatial_index( unittest.TestCase ):
+    def setUp( self ):
+        self.rng = random.Random( 7 )
+        self.index = sm_index.sm_spatial_index( 100 )
+        # Name -> ( lft, top, rgt, btm ), in the order indexed.
+        self.rects = {}
+        for idx in range( 300 ):
+            self.add_random( f"s{idx}" )
+
+    # This method is for internal use only.
+    def add_random( self, name: str ) -> None:
+        ( lft, top ) = ( self.rng.randrange( -1000, 1000 ), self.rng.randrange( -1000, 1000 ) )
+        ( wid, hgt ) = ( self.rng.randrange( 1, 400 ), self.rng.randrange( 1, 400 ) )
+        self.index.update( name, lft, top, wid, hgt )
+        self.rects[ name ] = ( lft, top, lft + wid, top + hgt )
+
+    def check_queries( self ) -> None:
+        for idx in range( 200 ):
+            ( lft, top ) = ( self.rng.randrange( -1200, 1200 ), self.rng.randrange( -1200, 1200 ) )
+            ( rgt, btm ) = ( lft + self.rng.randrange( 0, 600 ), top + self.rng.randrange( 0, 600 ) )
+            self.assertEqual( self.index.query_rect( lft, top, rgt, btm ), find_overlapping( self.rects, lft, top, rgt, btm ) )
+
+    def test_query_rect( self ):
+        self.check_queries()
+
+    def test_edges_touching( self ):
+        index = sm_index.sm_spatial_index( 100 )
+        index.update( "a", 0, 0, 100, 100 )
+        self.assertEqual( index.query_rect( 100, 100, 150, 150 ), [ "a" ] )
+        self.assertEqual( index.query_rect( 101, 0, 150, 100 ), [] )
+
+    def test_update_and_remove( self ):
+        names = list( self.rects )
+        for name in names[ : 100 ]:
+            # Moved states keep their place in the order.
+            ( lft, top ) = ( self.rng.randrange( -1000, 1000 ), self.rng.randrange( -1000, 1000 ) )
+            self.index.update( name, lft, top, 50, 50 )
+            self.rects[ name ] = ( lft, top, lft + 50, top + 50 )
+        for name in names[ 100 : 150 ]:
+            self.index.remove( name )
+            del self.rects[ name ]
+        for idx in range( 300, 320 ):
+            self.add_random( f"s{idx}" )
+        self.check_queries()
+        self.assertIsNone( self.index.get_rect( names[ 120 ] ) )
+        self.assertEqual( self.index.get_rect( names[ 0 ] ), self.rects[ names[ 0 ] ] )
+
+    def test_get_extents( self ):
+        self.assertEqual( self.index.get_extents(), ( min( rect[ 0 ] for rect in self.rects.values() ),
+            min( rect[ 1 ] for rect in self.rects.values() ), max( rect[ 2 ] for rect in self.rects.values() ),
+            max( rect[ 3 ] for rect in self.rects.values() ) ) )
+        self.assertIsNone( sm_index.sm_spatial_index( 100 ).get_extents() )
+
+    def test_query_segment( self ):
+        A = { "x": 300, "y": -200 }
+        B = { "x": -100, "y": 250 }
+        self.assertEqual( self.index.query_segment( A, B ), find_overlapping( self.rects, -100, -200, 300, 250 ) )
+
+
+class test_sm_transition_index( unittest.TestCase ):
+    def setUp( self ):
+        self.index = sm_index.sm_transition_index()
+        self.index.add_transition( "a", "t1", "b" )
+        self.index.add_transition( "a", "t2", "c" )
+        self.index.add_transition( "b", "t1", "a" )
+        self.index.add_transition( "c", "t1", "c" )
+
+    def test_adjacency( self ):
+        self.assertEqual( self.index.get_outgoing( "a" ), [ ( "a", "t1" ), ( "a", "t2" ) ] )
+        self.assertEqual( self.index.get_incoming( "a" ), [ ( "b", "t1" ) ] )
+        self.assertEqual( self.index.get_connected( "c" ), [ ( "a", "t2" ), ( "c", "t1" ) ] )
+        self.assertEqual( self.index.get_dest( "a", "t2" ), "c" )
+        self.assertIsNone( self.index.get_dest( "a", "t3" ) )
+
+    def test_redirect( self ):
+        self.index.add_transition( "a", "t1", "c" )
+        self.assertEqual( self.index.get_incoming( "b" ), [] )
+        self.assertEqual( self.index.get_incoming( "c" ), [ ( "a", "t2" ), ( "c", "t1" ), ( "a", "t1" ) ] )
+
+    def test_remove_state( self ):
+        self.assertEqual( sorted( self.index.remove_state( "b" ) ), [ ( "a", "t1" ), ( "b", "t1" ) ] )
+        self.assertEqual( self.index.get_outgoing( "a" ), [ ( "a", "t2" ) ] )
+        self.assertEqual( self.index.get_incoming( "a" ), [] )
+        self.assertEqual( self.index.get_connected( "b" ), [] )
+
+    def test_rename_state( self ):
+        self.index.rename_state( "c", "d" )
+        self.assertEqual( self.index.get_dest( "a", "t2" ), "d" )
+        self.assertEqual( self.index.get_dest( "d", "t1" ), "d" )
+        self.assertEqual( self.index.get_connected( "c" ), [] )
+        self.assertEqual( sorted( self.index.get_connected( "d" ) ), [ ( "a", "t2" ), ( "d", "t1" ) ] )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import random
+import unittest
+
+import sm_router
+
+
+class test_sm_orthogonal_router( unittest.TestCase ):
+    # Checks that a route runs from the start to the goal in horizontal and
+    # vertical segments, inside the corridor and never through an obstacle.
+    def check_route( self, points: list, start: tuple, goal: tuple, obstacles: list, corridor: tuple ) -> None:
+        self.assertEqual( points[ 0 ], start[ : 2 ] )
+        self.assertEqual( points[ -1 ], goal[ : 2 ] )
+        ( c_lft, c_top, c_rgt, c_btm ) = corridor
+        for ( ( x1, y1 ), ( x2, y2 ) ) in zip( points, points[ 1 : ] ):
+            self.assertTrue( x1 == x2 or y1 == y2 )
+            self.assertTrue( c_lft <= min( x1, x2 ) and max( x1, x2 ) <= c_rgt and c_top <= min( y1, y2 ) and max( y1, y2 ) <= c_btm )
+            for ( lft, top, rgt, btm ) in obstacles:
+                # Running along an edge is fine, passing through the inside is not.
+                inside_x = max( min( x1, x2 ), lft ) < min( max( x1, x2 ), rgt ) if y1 == y2 else lft < x1 < rgt
+                inside_y = max( min( y1, y2 ), top ) < min( max( y1, y2 ), btm ) if x1 == x2 else top < y1 < btm
+                self.assertFalse( inside_x and inside_y, f"{( x1, y1 )} to {( x2, y2 )} passes through {( lft, top, rgt, btm )}" )
+
+    def test_around_obstacle( self ):
+        router = sm_router.sm_orthogonal_router( 40 )
+        start = ( 0, 100, 0 )
+        goal = ( 300, 100, 0 )
+        obstacles = [ ( 100, 50, 200, 150 ) ]
+        corridor = ( -100, -100, 400, 300 )
+        points = router.route( [ start ], [ goal ], obstacles, corridor )
+        self.check_route( points, start, goal, obstacles, corridor )
+        # Around the top or bottom edge.
+        self.assertTrue( min( y for ( x, y ) in points ) <= 50 or max( y for ( x, y ) in points ) >= 150 )
+
+    def test_straight( self ):
+        router = sm_router.sm_orthogonal_router( 40 )
+        self.assertEqual( router.route( [ ( 0, 0, 0 ) ], [ ( 100, 0, 0 ) ], [], ( 0, 0, 100, 100 ) ), [ ( 0, 0 ), ( 100, 0 ) ] )
+
+    def test_random_obstacles( self ):
+        rng = random.Random( 5 )
+        router = sm_router.sm_orthogonal_router( 40 )
+        corridor = ( 0, 0, 1000, 1000 )
+        for trial in range( 20 ):
+            obstacles = []
+            for idx in range( 15 ):
+                ( lft, top ) = ( rng.randrange( 100, 800, 10 ), rng.randrange( 100, 800, 10 ) )
+                obstacles.append( ( lft, top, lft + rng.randrange( 20, 150, 10 ), top + rng.randrange( 20, 150, 10 ) ) )
+            start = ( 0, rng.randrange( 0, 1000, 10 ), 0 )
+            goal = ( 1000, rng.randrange( 0, 1000, 10 ), 0 )
+            points = router.route( [ start ], [ goal ], obstacles, corridor )
+            self.assertIsNotNone( points )
+            self.check_route( points, start, goal, obstacles, corridor )
+
+    def test_no_route( self ):
+        router = sm_router.sm_orthogonal_router( 40 )
+        # The goal is buried in an obstacle.
+        self.assertIsNone( router.route( [ ( 0, 0, 0 ) ], [ ( 150, 150, 0 ) ], [ ( 100, 100, 200, 200 ) ], ( 0, 0, 300, 300 ) ) )
+        # The goal is outside the corridor.
+        self.assertIsNone( router.route( [ ( 0, 0, 0 ) ], [ ( 400, 0, 0 ) ], [], ( 0, 0, 300, 300 ) ) )
+        # A wall across the corridor.
+        self.assertIsNone( router.route( [ ( 0, 150, 0 ) ], [ ( 300, 150, 0 ) ], [ ( 100, -10, 200, 310 ) ], ( 0, 0, 300, 300 ) ) )
+        self.assertFalse( router.gave_up )
+
+    def test_gives_up( self ):
+        rng = random.Random( 9 )
+        obstacles = []
+        for idx in range( 100 ):
+            ( lft, top ) = ( rng.randrange( 50, 950, 10 ), rng.randrange( 50, 950, 10 ) )
+            obstacles.append( ( lft, top, lft + 30, top + 30 ) )
+        router = sm_router.sm_orthogonal_router( 40, max_nodes = 5 )
+        self.assertIsNone( router.route( [ ( 0, 0, 0 ) ], [ ( 1000, 1000, 0 ) ], obstacles, ( 0, 0, 1000, 1000 ) ) )
+        self.assertTrue( router.gave_up )
+
+
+class test_sm_route_cache( unittest.TestCase ):
+    def test_least_recently_used( self ):
+        cache = sm_router.sm_route_cache( 2 )
+        keys = [ cache.get_key( [ ( idx, 0, 0 ) ], [ ( 9, 9, 0 ) ], [], ( 0, 0, 10, 10 ) ) for idx in range( 3 ) ]
+        cache.put( keys[ 0 ], "a" )
+        cache.put( keys[ 1 ], "b" )
+        self.assertEqual( cache.get( keys[ 0 ] ), "a" )
+        cache.put( keys[ 2 ], "c" )
+        self.assertIsNone( cache.get( keys[ 1 ] ) )
+        self.assertEqual( cache.get( keys[ 0 ] ), "a" )
+        self.assertEqual( cache.get( keys[ 2 ] ), "c" )
+        self.assertEqual( ( cache.hits, cache.misses ), ( 3, 1 ) )
+        cache.clear()
+        self.assertIsNone( cache.get( keys[ 0 ] ) )
+        self.assertEqual( ( cache.hits, cache.misses ), ( 0, 1 ) )
+
+    def test_key( self ):
+        cache = sm_router.sm_route_cache( 10 )
+        obstacles = [ ( 0, 0, 10, 10 ), ( 20, 20, 30, 30 ) ]
+        key = cache.get_key( [ ( 0, 0, 0 ) ], [ ( 50, 50, 1 ) ], obstacles, ( 0, 0, 60, 60 ) )
+        self.assertEqual( cache.get_key( [ ( 0, 0, 0 ) ], [ ( 50, 50, 1 ) ], obstacles[ : : -1 ], ( 0, 0, 60, 60 ) ), key )
+        self.assertNotEqual( cache.get_key( [ ( 0, 0, 0 ) ], [ ( 50, 50, 1 ) ], obstacles[ : 1 ], ( 0, 0, 60, 60 ) ), key )
+        self.assertNotEqual( cache.get_key( [ ( 0, 0, 1 ) ], [ ( 50, 50, 1 ) ], obstacles, ( 0, 0, 60, 60 ) ), key )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+
+import sm_undo
+from tests import sample_models
+
+
+class test_sm_undo_log( unittest.TestCase ):
+    def setUp( self ):
+        self.log = sm_undo.sm_undo_log()
+        self.notified = []
+        self.log.add_listener( self.notified.append )
+
+    def test_undo_redo( self ):
+        self.log.record( "one", [ ( "f", 1 ) ], [ ( "i", 1 ) ] )
+        self.log.record( "two", [ ( "f", 2 ) ], [ ( "i", 2 ) ] )
+        self.assertEqual( self.log.pop_undo().label, "two" )
+        self.assertTrue( self.log.can_redo() )
+        self.assertEqual( self.log.pop_redo().label, "two" )
+        self.assertEqual( self.log.pop_undo().inverse, [ ( "i", 2 ) ] )
+        self.assertEqual( self.log.pop_undo().inverse, [ ( "i", 1 ) ] )
+        self.assertIsNone( self.log.pop_undo() )
+        self.assertEqual( self.notified, [ [ ( "f", 1 ) ], [ ( "f", 2 ) ], [ ( "i", 2 ) ], [ ( "f", 2 ) ], [ ( "i", 2 ) ], [ ( "i", 1 ) ] ] )
+
+    def test_new_edit_clears_redo( self ):
+        self.log.record( "one", [ ( "f", 1 ) ], [ ( "i", 1 ) ] )
+        self.log.pop_undo()
+        self.log.record( "two", [ ( "f", 2 ) ], [ ( "i", 2 ) ] )
+        self.assertFalse( self.log.can_redo() )
+        self.assertEqual( self.log.get_num_bytes(), self.log.undo_entries[ 0 ].size )
+
+    def test_group( self ):
+        self.log.begin_group( "group" )
+        self.log.record( "one", [ ( "f", 1 ) ], [ ( "i", 1 ) ] )
+        self.log.record( "two", [ ( "f", 2 ) ], [ ( "i", 2 ) ] )
+        self.log.end_group( [ ( "f", 3 ) ], [ ( "i", 3 ) ] )
+        # An empty group records nothing.
+        self.log.begin_group( "empty" )
+        self.log.end_group()
+        entry = self.log.pop_undo()
+        self.assertEqual( entry.label, "group" )
+        self.assertEqual( entry.forward, [ ( "f", 1 ), ( "f", 2 ), ( "f", 3 ) ] )
+        self.assertEqual( entry.inverse, [ ( "i", 2 ), ( "i", 1 ), ( "i", 3 ) ] )
+        self.assertFalse( self.log.can_undo() )
+
+    def test_suspend( self ):
+        self.log.suspend()
+        self.log.record( "one", [ ( "f", 1 ) ], [ ( "i", 1 ) ] )
+        self.log.resume()
+        self.assertFalse( self.log.can_undo() )
+        self.assertEqual( self.notified, [] )
+
+    def test_trim( self ):
+        for idx in range( 10 ):
+            self.log.record( f"edit {idx}", [ ( "f", "x" * 100 ) ], [ ( "i", "y" * 100 ) ] )
+        entry_size = self.log.undo_entries[ 0 ].size
+        self.log.set_max_bytes( 3 * entry_size )
+        self.assertEqual( [ entry.label for entry in self.log.undo_entries ], [ "edit 7", "edit 8", "edit 9" ] )
+        self.assertEqual( self.log.get_num_bytes(), 3 * entry_size )
+        self.log.clear()
+        self.assertEqual( self.log.get_num_bytes(), 0 )
+        self.assertFalse( self.log.can_undo() )
+
+
+# Each edit to a diagram is undone and redone exactly, as saved.
+class test_diagram_undo( unittest.TestCase ):
+    def check_edits( self, diagram: object, edits: list ) -> None:
+        saved = [ sample_models.get_saved_json( diagram ) ]
+        for edit in edits:
+            edit()
+            saved.append( sample_models.get_saved_json( diagram ) )
+        for idx in range( len( edits ) - 1, -1, -1 ):
+            self.assertTrue( diagram.undo() )
+            self.assertEqual( sample_models.get_saved_json( diagram ), saved[ idx ] )
+        self.assertFalse( diagram.undo() )
+        for idx in range( 1, len( edits ) + 1 ):
+            self.assertTrue( diagram.redo() )
+            self.assertEqual( sample_models.get_saved_json( diagram ), saved[ idx ] )
+        self.assertFalse( diagram.redo() )
+
+    def test_flat( self ):
+        diagram = sample_models.create_diagram( sample_models.scattered_model( 60, 2000 ) )
+        diagram.paint()
+        widget = diagram.get_state_widget( "s0" )
+        self.check_edits( diagram, [
+            lambda: diagram.move_state( "s0", widget.geom.x + 130, widget.geom.y + 70 ),
+            lambda: diagram.resize_state( "s1", 200, 150 ),
+            lambda: diagram.add_state( "new", { "x": 3000, "y": 3000, "w": 100, "h": 60 } ),
+            lambda: diagram.add_transition( "new", "go", "s0" ),
+            lambda: diagram.rename_state( "s1", "renamed" ),
+            lambda: diagram.delete_transition( "s0", "e" ),
+            lambda: diagram.delete_state( "renamed" ),
+        ] )
+
+    # Moving a collapsed composite moves the layouts and paths of its hidden
+    # substates, which must come back on undo.
+    def test_nested( self ):
+        diagram = sample_models.create_diagram( sample_models.nested_model( 3, 8 ) )
+        diagram.paint()
+        diagram.expand_state( "c1" )
+        self.check_edits( diagram, [
+            lambda: diagram.move_state( "c0", 0, 900 ),
+            lambda: diagram.move_state( "c1", 900, 900 ),
+            lambda: diagram.move_state( "c1_3", 900, 1300 ),
+            lambda: diagram.delete_state( "c2" ),
+        ] )
+
+
+if __name__ == "__main__":
+    unittest.main()
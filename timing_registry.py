@@ -0,0 +1,93 @@
+import collections
+import functools
+import json
+import threading
+import time
+
+
+# The latest calls of each function kept for the percentiles, so that the
+# memory used stays fixed however long the editor runs.
+MAX_SAMPLES = 4096
+
+PERCENTILES = ( 50, 95, 99 )
+
+
+# A registry of how long the functions marked with @timed take.
+#
+# For each, the calls are counted and their times totalled, and the latest
+# MAX_SAMPLES times are kept for the percentiles. Until enable() is called,
+# a timed function costs one extra call and a test of a flag. Functions may
+# be timed on any thread.
+enabled = False
+lock = threading.Lock()
+# name -> [ count, total secs, max secs, deque of the latest times ]
+entries = {}
+
+def enable() -> None:
+    global enabled
+    enabled = True
+
+def is_enabled() -> bool:
+    return enabled
+
+# Decorator for the functions to time, which are named by their qualified name.
+def timed( func ):
+    name = func.__qualname__
+    @functools.wraps( func )
+    def wrapper( *args, **kwargs ):
+        if not enabled:
+            return func( *args, **kwargs )
+        start = time.perf_counter()
+        try:
+            return func( *args, **kwargs )
+        finally:
+            record( name, time.perf_counter() - start )
+    return wrapper
+
+def record( name: str, secs: float ) -> None:
+    with lock:
+        entry = entries.get( name )
+        if entry is None:
+            entry = [ 0, 0.0, 0.0, collections.deque( maxlen = MAX_SAMPLES ) ]
+            entries[ name ] = entry
+        entry[ 0 ] += 1
+        entry[ 1 ] += secs
+        entry[ 2 ] = max( entry[ 2 ], secs )
+        entry[ 3 ].append( secs )
+
+def clear() -> None:
+    with lock:
+        entries.clear()
+
+# Returns { name: { "count", "total_ms", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms" } }.
+def get_stats() -> dict:
+    with lock:
+        snapshot = { name: ( count, total, longest, sorted( samples ) ) for name, ( count, total, longest, samples ) in entries.items() }
+    stats = {}
+    for name, ( count, total, longest, samples ) in sorted( snapshot.items() ):
+        stat = { "count": count, "total_ms": total * 1000, "mean_ms": total * 1000 / count }
+        for percentile in PERCENTILES:
+            # Nearest rank.
+            rank = max( ( percentile * len( samples ) + 99 ) // 100, 1 )
+            stat[ f"p{percentile}_ms" ] = samples[ rank - 1 ] * 1000
+        stat[ "max_ms" ] = longest * 1000
+        stats[ name ] = stat
+    return stats
+
+# Returns the stats as a table, one function per line.
+def format_stats() -> str:
+    columns = [ "count", "total_ms", "mean_ms" ] + [ f"p{percentile}_ms" for percentile in PERCENTILES ] + [ "max_ms" ]
+    stats = get_stats()
+    name_width = max( [ len( "function" ) ] + [ len( name ) for name in stats ] )
+    lines = [ f"{'function':<{name_width}}" + "".join( f"{column:>11}" for column in columns ) ]
+    for name, stat in stats.items():
+        lines.append( f"{name:<{name_width}}{stat[ 'count' ]:>11}" + "".join( f"{stat[ column ]:>11.2f}" for column in columns[ 1: ] ) )
+    return "\n".join( lines )
+
+def dump_json( filename: str ) -> None:
+    try:
+        with open( filename, "w" ) as stats_file:
+            json.dump( get_stats(), stats_file, indent = 4 )
+        print( f"INFO: Timings written to \"{filename}\"." )
+    except OSError:
+        print( f"WARN: There is something wrong with the file {filename}, and it can't be opened for writing." )
@@ -1,7 +1,10 @@
+import copy
 import io
 import os
 import json
 import mru
+import save_service
+import timing_registry
 
 
 DEFAULT_WS_FILENAME = "workspace.json"
@@ -31,7 +34,12 @@ DEFAULT_MAX_MRU_MODELS = 20
 class workspace_settings:
     # Preconditions:
     # pygame.init() has been called, and pygame.display.set_mode(...) has not yet been called.
-    def __init__( self, screen_max_x: int, screen_max_y: int, filename: str = DEFAULT_WS_FILENAME ):
+    #
+    # Param:  saver  A save_service to write the settings in the background, or None to
+    #                write them as sync_to_disk() is called.
+    def __init__( self, screen_max_x: int, screen_max_y: int, filename: str = DEFAULT_WS_FILENAME, saver: object = None ):
+        self.saver = saver
+
         # Select reasonable defaults for when attempted values are invalid.
         self.max_width = screen_max_x
         self.default_width  = int( self.max_width * DEFAULT_DISPLAY_PERCENT / 100 )
@@ -97,15 +105,28 @@ class workspace_settings:
 
         self.sync_to_disk()
     
-    # Write any settings changes to disk.
+    # Write any settings changes to disk. With a saver, a copy of the settings
+    # is handed to it to write right away on its own thread; flush the saver
+    # to wait for it.
+    @timing_registry.timed
     def sync_to_disk( self ) -> None:
         if self.are_settings_dirty:
             mru_list = self.mru_models.get_list()
             self.set_value( [ "mru_models" ], mru_list )
             #print( f"INFO: Updating \"{self.settings_filename}\" to {self.settings}" )
-            sess_file = open( self.settings_filename, "w" )
-            json.dump( self.settings, sess_file, ensure_ascii = True, indent = 4 )
-            sess_file.close()
+            if self.saver is not None:
+                settings = copy.deepcopy( self.settings )
+                self.saver.schedule( self.settings_filename, lambda: settings, delay = 0 )
+                self.are_settings_dirty = False
+                return
+            # Replace the file atomically, and only if the content has changed.
+            data = save_service.serialize_json( self.settings )
+            if not save_service.file_matches( self.settings_filename, data ):
+                try:
+                    save_service.write_file_atomic( self.settings_filename, data )
+                except OSError:
+                    print( f"WARN: There is something wrong with the file {self.settings_filename}, and it can't be opened for writing." )
+                    return
             self.are_settings_dirty = False
 
     # Read a value from current settings.